@@ -35,18 +35,22 @@ function formatAIResponse(text) {
   return text;
 }
 
-// 取得或建立 Session ID
+// 取得 Session ID（首次對話為 null，由後端核發）
 function getSessionId() {
   if (!sessionId) {
     sessionId = localStorage.getItem('pais_session_id');
-    if (!sessionId) {
-      sessionId = `user_${Date.now()}_${Math.random().toString(36).substr(2, 9)}`;
-      localStorage.setItem('pais_session_id', sessionId);
-    }
   }
   return sessionId;
 }
 
+// 保存後端回傳的 Session ID
+function saveSessionId(id) {
+  if (id && id !== sessionId) {
+    sessionId = id;
+    localStorage.setItem('pais_session_id', id);
+  }
+}
+
 // ==================== 訊息顯示 ====================
 
 function addMessage(content, sender, opts = {asHTML: false}) {
@@ -124,6 +128,7 @@ async function sendMessage() {
     const data = await sendChatMessage(message, getSessionId(), true);
 
     console.log('📥 收到回應:', data);
+    saveSessionId(data.session_id);
 
     // 移除思考中訊息
     removeTyping();
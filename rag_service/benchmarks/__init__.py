@@ -0,0 +1,4 @@
+"""
+效能基準測試腳本
+於 rag_service 目錄下以 `python -m benchmarks.<名稱>` 執行
+"""
@@ -0,0 +1,112 @@
+"""
+Agent 模式基準測試
+比較 ReAct 與 Function Calling 兩種模式每次回答的平均 LLM 呼叫次數與延遲分佈
+
+使用方式（需可連線 Gemini 與 Qdrant，於 rag_service 目錄下執行）：
+    python -m benchmarks.agent_modes --role public --rounds 3 --output benchmarks/results/agent_modes.json
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+from loguru import logger
+
+from benchmarks.common import LLMCallCounter, summarize_latencies, write_report
+
+
+DEFAULT_QUESTIONS = [
+    "桃園市的交通政策有哪些？",
+    "市長對於青年就業的看法是什麼？",
+    "國中小免費營養午餐的內容是什麼？",
+    "社會住宅目前的進度如何？",
+    "五歲幼兒教育助學金要怎麼申請？",
+    "比較一下桃園的托育補助和長照政策",
+]
+
+DEFAULT_STAFF_DRAFTS = [
+    "市長今天出席桃園燈會開幕，感謝大家的參與，桃園明年也會持續推動觀光。",
+    "本市國中小免費營養午餐政策將在明年全面實施，預算約五億元。",
+]
+
+
+async def run_mode(
+    runtime,
+    role: str,
+    questions: List[str],
+    rounds: int
+) -> Dict[str, Any]:
+    """
+    以指定的 AgentRuntime 依序執行問題集
+
+    Args:
+        runtime: AgentRuntime
+        role: 角色
+        questions: 問題列表
+        rounds: 重複輪數
+
+    Returns:
+        該模式的統計結果
+    """
+    latencies_ms: List[float] = []
+    llm_calls: List[int] = []
+    failures = 0
+
+    for _ in range(rounds):
+        for question in questions:
+            counter = LLMCallCounter()
+            started_at = time.perf_counter()
+            try:
+                await runtime.ainvoke(role, question, None, config={"callbacks": [counter]})
+            except Exception as e:
+                failures += 1
+                logger.warning(f"⚠️ 執行失敗 ({runtime.get_mode(role)}): {e}")
+            latencies_ms.append((time.perf_counter() - started_at) * 1000)
+            llm_calls.append(counter.calls)
+
+    return {
+        "answers": len(latencies_ms),
+        "failures": failures,
+        "avg_llm_calls": round(sum(llm_calls) / len(llm_calls), 2) if llm_calls else 0.0,
+        "max_llm_calls": max(llm_calls) if llm_calls else 0,
+        **summarize_latencies(latencies_ms),
+    }
+
+
+async def main(args: argparse.Namespace):
+    # 延遲載入：public_service 初始化時會連線 Qdrant 並載入 Embedding 模型
+    import public_service as ps
+    from services.agent_runtime import AgentRuntime
+
+    questions = DEFAULT_STAFF_DRAFTS if args.role == "staff" else DEFAULT_QUESTIONS
+    results = {}
+
+    for mode in args.modes:
+        runtime = AgentRuntime(
+            tools={args.role: ps.tools_by_mode[mode]},
+            agents={args.role: ps.agents_by_mode[mode][args.role]},
+            modes={args.role: mode}
+        )
+        logger.info(f"⏱️ 開始測試 {mode} 模式 ({len(questions)} 題 x {args.rounds} 輪)")
+        results[mode] = await run_mode(runtime, args.role, questions, args.rounds)
+        logger.info(f"📊 {mode}: {results[mode]}")
+
+    write_report({
+        "benchmark": "agent_modes",
+        "role": args.role,
+        "rounds": args.rounds,
+        "questions": len(questions),
+        "created_at": datetime.now().isoformat(),
+        "results": results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比較 ReAct 與 Function Calling Agent 模式")
+    parser.add_argument("--role", choices=["public", "staff"], default="public")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", default=["react", "function_calling"])
+    parser.add_argument("--output", default="benchmarks/results/agent_modes.json")
+    asyncio.run(main(parser.parse_args()))
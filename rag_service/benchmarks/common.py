@@ -0,0 +1,46 @@
+"""
+基準測試共用工具
+百分位數計算、LLM 呼叫計數與結果輸出
+"""
+
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict
+
+from langchain_core.callbacks import BaseCallbackHandler
+from loguru import logger
+
+from utils.latency_stats import percentile, summarize_latencies  # noqa: F401  (供各基準測試匯入)
+
+
+class LLMCallCounter(BaseCallbackHandler):
+    """
+    計算 LLM 呼叫次數的 Callback（同時支援 LLM 與聊天模型）
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        with self._lock:
+            self.calls += 1
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        with self._lock:
+            self.calls += 1
+
+
+def write_report(report: Dict[str, Any], output_path: str):
+    """
+    將結果寫入 JSON 檔
+
+    Args:
+        report: 結果字典
+        output_path: 輸出路徑
+    """
+    path = Path(output_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    logger.info(f"💾 基準測試結果已寫入: {path}")
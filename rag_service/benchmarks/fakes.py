@@ -0,0 +1,233 @@
+"""
+基準測試用的假依賴
+以可重現的假 Gemini（可設定延遲與 token 速率）、雜湊 Embeddings 與記憶體內 Qdrant
+取代外部服務，讓負載測試只量測 public_service 本身的處理能力
+
+必須在 import public_service 之前呼叫 install_fakes()
+"""
+
+import hashlib
+import json
+import math
+import re
+import time
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.language_models.llms import LLM
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult, GenerationChunk
+
+# 假回答以此片段重複組成，每個片段視為一個 token
+ANSWER_TOKEN = "善寶"
+ANSWER_PREFIX = "市民您好，關於您的問題，"
+
+SEED_DOCUMENTS = [
+    "桃園市國中小免費營養午餐政策自 2023 年起實施，全市公立國中小學生均可受惠。",
+    "桃園捷運綠線預計 2026 年通車，串聯八德、桃園、蘆竹與大園。",
+    "五歲幼兒教育助學金每學期補助一萬元，設籍桃園市滿一年即可申請。",
+    "桃園市社會住宅目前已完工約五千戶，興建中另有八千戶。",
+    "長照 2.0 在桃園設有超過四百個巷弄長照站，提供共餐與延緩失能課程。",
+    "青年創業貸款最高可申請兩百萬元，前兩年由市府全額補貼利息。",
+]
+
+
+def _extract(prompt: str, marker: str) -> str:
+    """取出 Prompt 中 marker 之後同一行的文字"""
+    match = re.search(re.escape(marker) + r"\s*(.*)", prompt)
+    return match.group(1).strip() if match else ""
+
+
+class FakeGeminiLLM(LLM):
+    """
+    假的 GoogleGenerativeAI
+
+    - ReAct Prompt：第一次回傳 Action（搜尋知識庫），看到 Observation 後回傳 Final Answer
+    - 其他 Prompt（RAG、摘要）：直接回傳固定長度的回答
+    - 首個 token 前等待 first_token_ms，之後以 tokens_per_second 的速率輸出
+    """
+
+    model: str = "fake-gemini"
+    first_token_ms: float = 300.0
+    tokens_per_second: float = 50.0
+    answer_tokens: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.model}
+
+    def _script(self, prompt: str) -> List[str]:
+        """依 Prompt 決定輸出並切成 token"""
+        answer = [ANSWER_PREFIX] + [ANSWER_TOKEN] * self.answer_tokens
+        if "Action Input" in prompt and "**Question**" in prompt:
+            scratchpad = prompt.rsplit("**Thought**:", 1)[-1]
+            if "Observation:" in scratchpad:
+                return ["Thought: 已有足夠資訊可回答\n", "Final Answer: "] + answer
+            question = _extract(prompt, "**Question**:") or "桃園市政"
+            return [f"Thought: 需要查詢知識庫\nAction: 搜尋知識庫\nAction Input: {question}"]
+        return answer
+
+    def _call(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+    def _stream(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        tokens = self._script(prompt)
+        time.sleep(self.first_token_ms / 1000)
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        for i, token in enumerate(tokens):
+            if i and interval:
+                time.sleep(interval)
+            chunk = GenerationChunk(text=token)
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+class FakeGeminiChat(BaseChatModel):
+    """
+    假的 ChatGoogleGenerativeAI（Function Calling 模式）
+
+    第一次回傳 search_knowledge_base 工具呼叫，收到工具結果後回傳回答
+    """
+
+    model: str = "fake-gemini-chat"
+    first_token_ms: float = 300.0
+    tokens_per_second: float = 50.0
+    answer_tokens: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini-chat"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.model}
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeGeminiChat":
+        return self
+
+    def _needs_tool(self, messages: List[BaseMessage]) -> bool:
+        return not any(isinstance(m, ToolMessage) for m in messages)
+
+    def _question(self, messages: List[BaseMessage]) -> str:
+        human = [m for m in messages if m.type == "human"]
+        return str(human[-1].content) if human else "桃園市政"
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        chunks = list(self._stream(messages, stop, run_manager, **kwargs))
+        if self._needs_tool(messages):
+            message = AIMessage(content="", tool_calls=[{
+                "name": "search_knowledge_base",
+                "args": {"query": self._question(messages)},
+                "id": "call-0"
+            }])
+        else:
+            message = AIMessage(content="".join(c.text for c in chunks))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_ms / 1000)
+        if self._needs_tool(messages):
+            args = json.dumps({"query": self._question(messages)}, ensure_ascii=False)
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[{"name": "search_knowledge_base", "args": args, "id": "call-0", "index": 0}]
+            ))
+            return
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        for i, token in enumerate([ANSWER_PREFIX] + [ANSWER_TOKEN] * self.answer_tokens):
+            if i and interval:
+                time.sleep(interval)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+class HashEmbeddings(Embeddings):
+    """
+    以字元 bigram 雜湊產生的 768 維向量（可重現，相近文字會有相近向量）
+
+    Attributes:
+        embed_ms: 每次 embedding 模擬的 CPU 時間（毫秒）
+    """
+
+    model_name = "fake-m3e-hash"
+    dimension = 768
+
+    def __init__(self, embed_ms: float = 0.0):
+        self.embed_ms = embed_ms
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.embed_ms:
+            time.sleep(self.embed_ms / 1000)
+        vector = [0.0] * self.dimension
+        grams = [text[i:i + 2] for i in range(max(len(text) - 1, 1))]
+        for gram in grams:
+            digest = hashlib.md5(gram.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimension] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+
+def install_fakes(
+    first_token_ms: float = 300.0,
+    tokens_per_second: float = 50.0,
+    answer_tokens: int = 60,
+    embed_ms: float = 0.0
+):
+    """
+    以假依賴取代 Gemini、m3e 與 Qdrant 連線（須在 import public_service 之前呼叫）
+
+    Args:
+        first_token_ms: 首個 token 延遲（毫秒）
+        tokens_per_second: 輸出速率
+        answer_tokens: 回答長度（token 數）
+        embed_ms: 每次 embedding 模擬的時間（毫秒）
+    """
+    import langchain_community.embeddings
+    import langchain_google_genai
+    import qdrant_client
+
+    llm_kwargs = {
+        "first_token_ms": first_token_ms,
+        "tokens_per_second": tokens_per_second,
+        "answer_tokens": answer_tokens,
+    }
+    langchain_google_genai.GoogleGenerativeAI = lambda **kw: FakeGeminiLLM(
+        model=kw.get("model", "fake-gemini"), callbacks=kw.get("callbacks"), **llm_kwargs
+    )
+    langchain_google_genai.ChatGoogleGenerativeAI = lambda **kw: FakeGeminiChat(
+        model=kw.get("model", "fake-gemini"), callbacks=kw.get("callbacks"), **llm_kwargs
+    )
+    langchain_community.embeddings.HuggingFaceEmbeddings = lambda **kw: HashEmbeddings(embed_ms)
+
+    real_client = qdrant_client.QdrantClient
+
+    class InMemoryQdrantClient(real_client):
+        """忽略 host/port，改用記憶體內的 Qdrant"""
+
+        def __init__(self, *args: Any, **kwargs: Any):
+            super().__init__(location=":memory:")
+
+    qdrant_client.QdrantClient = InMemoryQdrantClient
+
+
+def seed_vectorstore(vectorstore, documents: Optional[List[str]] = None):
+    """
+    寫入固定的測試文件
+
+    Args:
+        vectorstore: LangChain Qdrant vectorstore
+        documents: 文件內容，預設為 SEED_DOCUMENTS
+    """
+    texts = documents or SEED_DOCUMENTS
+    vectorstore.add_texts(texts, metadatas=[{"source": f"seed/{i}.txt"} for i in range(len(texts))])
@@ -0,0 +1,257 @@
+"""
+公眾對話負載測試
+以假的 Gemini / Embeddings / Qdrant 在同一個程序內以 uvicorn 啟動 public_service，
+以遞增的併發數透過 HTTP 呼叫 /api/chat 與 /api/chat/stream，
+量測吞吐量、延遲百分位數、首個 token 延遲與記憶體用量（RSS 即為服務本身的用量）
+
+使用方式（不需連線外部服務，於 rag_service 目錄下執行）：
+    python -m benchmarks.load_test --concurrency 1 4 16 32 --requests 64 \\
+        --first-token-ms 300 --tokens-per-second 50 --output benchmarks/results/load_test.json
+
+預設關閉答案快取、single-flight 與意圖路由，讓每個請求都走完整的 Agent 路徑；
+加上 --with-cache 則以正式環境的預設設定測試
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from benchmarks.common import summarize_latencies, write_report
+from benchmarks.fakes import install_fakes, seed_vectorstore
+
+
+QUESTION_TEMPLATES = [
+    "桃園市的免費營養午餐是怎麼實施的？（#{n}）",
+    "捷運綠線什麼時候會通車？（#{n}）",
+    "五歲幼兒教育助學金要怎麼申請？（#{n}）",
+    "社會住宅目前的進度如何？（#{n}）",
+    "桃園的長照資源有哪些？（#{n}）",
+    "青年創業貸款的利息補貼是多少？（#{n}）",
+]
+
+
+def current_rss_mb() -> float:
+    """目前程序的常駐記憶體（MB），非 Linux 時退回最大 RSS"""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def git_commit() -> Optional[str]:
+    """目前的 commit（方便不同版本之間比對結果）"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+async def call_chat(client, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """呼叫 /api/chat，回傳延遲與是否成功"""
+    started_at = time.perf_counter()
+    response = await client.post("/api/chat", json=payload)
+    latency_ms = (time.perf_counter() - started_at) * 1000
+    return {"latency_ms": latency_ms, "ttft_ms": None, "ok": response.status_code == 200}
+
+
+async def call_stream(client, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """呼叫 /api/chat/stream，首個 token 事件到達的時間即為 TTFT"""
+    started_at = time.perf_counter()
+    ttft_ms = None
+    ok = False
+    async with client.stream("POST", "/api/chat/stream", json=payload) as response:
+        async for line in response.aiter_lines():
+            if ttft_ms is None and line == "event: token":
+                ttft_ms = (time.perf_counter() - started_at) * 1000
+            elif line == "event: done":
+                ok = response.status_code == 200
+    latency_ms = (time.perf_counter() - started_at) * 1000
+    return {"latency_ms": latency_ms, "ttft_ms": ttft_ms, "ok": ok}
+
+
+async def run_level(
+    client,
+    endpoint: str,
+    concurrency: int,
+    total_requests: int,
+    use_agent: bool,
+    offset: int
+) -> Dict[str, Any]:
+    """
+    以固定併發數送出 total_requests 個請求（每個請求使用新的會話與不重複的問題）
+
+    Args:
+        client: httpx.AsyncClient
+        endpoint: "chat" 或 "stream"
+        concurrency: 同時進行的請求數
+        total_requests: 請求總數
+        use_agent: 是否使用 Agent 模式
+        offset: 問題編號起點（避免不同階段的問題重複）
+
+    Returns:
+        該併發數的統計結果
+    """
+    call = call_stream if endpoint == "stream" else call_chat
+    queue: asyncio.Queue = asyncio.Queue()
+    for n in range(offset, offset + total_requests):
+        queue.put_nowait(n)
+
+    results: List[Dict[str, Any]] = []
+    peak_rss = current_rss_mb()
+
+    async def worker():
+        nonlocal peak_rss
+        while not queue.empty():
+            n = queue.get_nowait()
+            payload = {
+                "message": QUESTION_TEMPLATES[n % len(QUESTION_TEMPLATES)].format(n=n),
+                "use_agent": use_agent,
+                "role": "public",
+            }
+            try:
+                results.append(await call(client, payload))
+            except Exception as e:
+                logger.warning(f"⚠️ 請求失敗: {e}")
+                results.append({"latency_ms": None, "ttft_ms": None, "ok": False})
+            peak_rss = max(peak_rss, current_rss_mb())
+
+    rss_before = current_rss_mb()
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+
+    succeeded = [r for r in results if r["ok"]]
+    ttfts = [r["ttft_ms"] for r in succeeded if r["ttft_ms"] is not None]
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": total_requests - len(succeeded),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(succeeded) / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency_ms": summarize_latencies([r["latency_ms"] for r in succeeded]),
+        "ttft_ms": summarize_latencies(ttfts) if ttfts else None,
+        "rss_mb": {"before": rss_before, "peak": peak_rss, "after": current_rss_mb()},
+    }
+
+
+async def main(args: argparse.Namespace):
+    import httpx
+    import uvicorn
+
+    install_fakes(
+        first_token_ms=args.first_token_ms,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        embed_ms=args.embed_ms
+    )
+    # 延遲載入：public_service 在 import 時就會建立 LLM 與 Qdrant 連線
+    import public_service as ps
+    from utils.concurrency import BLOCKING_POOL_SIZE
+
+    seed_vectorstore(ps.vectorstore)
+
+    # 走真正的 HTTP 連線（ASGITransport 會等整個回應結束才交給用戶端，量不到 TTFT）
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(ps.app, log_level="warning", access_log=False))
+    server_task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        if server_task.done():
+            raise RuntimeError("public_service 啟動失敗")
+        await asyncio.sleep(0.05)
+
+    endpoints = ["chat", "stream"] if args.endpoint == "both" else [args.endpoint]
+    results = []
+    offset = 0
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+            for endpoint in endpoints:
+                for concurrency in args.concurrency:
+                    logger.info(f"⏱️ 開始測試 {endpoint} (併發 {concurrency}, {args.requests} 個請求)")
+                    level = await run_level(
+                        client, endpoint, concurrency, args.requests, not args.no_agent, offset
+                    )
+                    offset += args.requests
+                    results.append(level)
+                    ttft = f", TTFT p50 {level['ttft_ms']['p50_ms']} ms" if level["ttft_ms"] else ""
+                    logger.info(
+                        f"📊 {endpoint} x{concurrency}: {level['throughput_rps']} req/s, "
+                        f"p95 {level['latency_ms']['p95_ms']} ms{ttft}, 錯誤 {level['errors']}"
+                    )
+    finally:
+        server.should_exit = True
+        await server_task
+
+    write_report({
+        "benchmark": "load_test",
+        "created_at": datetime.now().isoformat(),
+        "commit": args.commit,
+        "config": {
+            "first_token_ms": args.first_token_ms,
+            "tokens_per_second": args.tokens_per_second,
+            "answer_tokens": args.answer_tokens,
+            "embed_ms": args.embed_ms,
+            "agent_mode": ps.agent_modes["public"],
+            "use_agent": not args.no_agent,
+            "with_cache": args.with_cache,
+            "blocking_pool_size": BLOCKING_POOL_SIZE,
+        },
+        "results": results,
+    }, args.output)
+
+
+def configure_environment(args: argparse.Namespace):
+    """在 import public_service 之前設定環境變數並切換到暫存工作目錄"""
+    if not args.with_cache:
+        os.environ["ANSWER_CACHE_ENABLED"] = "false"
+        os.environ["SINGLE_FLIGHT_ENABLED"] = "false"
+        os.environ["INTENT_ROUTER_ENABLED"] = "false"
+    os.environ["HISTORY_ARCHIVE_ENABLED"] = "false"
+    os.environ["AGENT_MODE_PUBLIC"] = args.agent_mode
+    os.environ.setdefault("GEMINI_API_KEY", "fake-key")
+    # 對話歷史、日誌等檔案寫到暫存目錄，不污染工作目錄
+    args.output = str(Path(args.output).resolve())
+    args.commit = git_commit()
+    os.chdir(tempfile.mkdtemp(prefix="pais_load_test_"))
+    # 服務本身的逐請求日誌只保留警告以上，避免大量輸出影響量測
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    logger.add(sys.stderr, level="INFO", filter=lambda record: record["name"].startswith("benchmarks"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="公眾對話負載測試（假 Gemini / Qdrant）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--requests", type=int, default=64, help="每個併發數送出的請求數")
+    parser.add_argument("--endpoint", choices=["chat", "stream", "both"], default="both")
+    parser.add_argument("--first-token-ms", type=float, default=300.0, help="假 LLM 首個 token 延遲")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="假 LLM 輸出速率")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="假 LLM 回答長度")
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="假 Embedding 每次耗時")
+    parser.add_argument("--agent-mode", choices=["react", "function_calling"], default="react")
+    parser.add_argument("--no-agent", action="store_true", help="改用 RAG Chain 模式")
+    parser.add_argument("--with-cache", action="store_true", help="保留答案快取、single-flight 與意圖路由")
+    parser.add_argument("--output", default="benchmarks/results/load_test.json")
+    cli_args = parser.parse_args()
+    configure_environment(cli_args)
+    asyncio.run(main(cli_args))
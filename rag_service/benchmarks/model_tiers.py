@@ -0,0 +1,154 @@
+"""
+模型分級基準測試
+以相同的 Prompt 分別呼叫 lite 與 full 模型，比較各任務的首 token 延遲、總延遲與輸出長度，
+並列出 ModelRouter 對各任務實際選擇的等級，用來確認分級規則是否划算
+
+使用方式（需可連線 Gemini 與 Qdrant，於 rag_service 目錄下執行）：
+    python -m benchmarks.model_tiers --rounds 3 --output benchmarks/results/model_tiers.json
+
+以假 Gemini 驗證流程（lite 模型首 token 延遲較短）：
+    python -m benchmarks.model_tiers --fake --rounds 2
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from loguru import logger
+
+from benchmarks.common import summarize_latencies, write_report
+
+
+CHAT_HISTORY = (
+    "市民: 桃園捷運綠線什麼時候通車？\n"
+    "善寶: 桃園捷運綠線預計 2026 年通車，串聯八德、桃園、蘆竹與大園。"
+)
+FOLLOWUP_QUESTION = "那沿線有哪些站？"
+FACTUAL_QUESTION = "五歲幼兒教育助學金要怎麼申請？"
+CONTENT_TOPIC = "國中小免費營養午餐"
+
+
+def build_samples(ps) -> List[Tuple[str, str, int]]:
+    """
+    建立各任務的測試 Prompt（與線上路徑使用相同模板）
+
+    Args:
+        ps: public_service 模組
+
+    Returns:
+        (樣本名稱, Prompt, 預期輸出字數) 列表
+    """
+    from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+
+    from benchmarks.fakes import SEED_DOCUMENTS
+    from services.model_router import TASK_CONDENSE, TASK_CONTENT, TASK_SHORT_REPLY, TASK_SUMMARY, content_length_chars
+    from services.summary_memory import SUMMARY_PROMPT
+
+    context = "\n\n".join(SEED_DOCUMENTS)
+    samples = [
+        (TASK_CONDENSE, CONDENSE_QUESTION_PROMPT.format(chat_history=CHAT_HISTORY, question=FOLLOWUP_QUESTION), 0),
+        (TASK_SUMMARY, SUMMARY_PROMPT.format(max_chars=300, summary="（無）", conversation=CHAT_HISTORY), 0),
+        (TASK_SHORT_REPLY, ps.RAG_PROMPT.format(context=context, chat_history="", question=FACTUAL_QUESTION), 0),
+    ]
+    for length in ("短", "中", "長"):
+        prompt = ps.CONTENT_PROMPT.format(topic=CONTENT_TOPIC, style="輕鬆", length=length, context=context)
+        samples.append((f"{TASK_CONTENT}/{length}", prompt, content_length_chars(length)))
+    return samples
+
+
+async def measure(llm, prompt: str, rounds: int) -> Dict[str, Any]:
+    """
+    以串流呼叫量測首 token 與總延遲
+
+    Args:
+        llm: 要測試的 LLM
+        prompt: Prompt
+        rounds: 重複次數
+
+    Returns:
+        延遲分佈與平均輸出字數
+    """
+    ttft_ms: List[float] = []
+    latencies_ms: List[float] = []
+    output_chars: List[int] = []
+    failures = 0
+
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        first_token_at = None
+        text = ""
+        try:
+            async for chunk in llm.astream(prompt):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                text += chunk
+        except Exception as e:
+            failures += 1
+            logger.warning(f"⚠️ 呼叫失敗 ({getattr(llm, 'model', '')}): {e}")
+            continue
+        latencies_ms.append((time.perf_counter() - started_at) * 1000)
+        ttft_ms.append(((first_token_at or time.perf_counter()) - started_at) * 1000)
+        output_chars.append(len(text))
+
+    ttft = summarize_latencies(ttft_ms)
+    return {
+        "calls": len(latencies_ms),
+        "failures": failures,
+        "ttft_p50_ms": ttft.get("p50_ms", 0.0),
+        "ttft_p95_ms": ttft.get("p95_ms", 0.0),
+        "avg_output_chars": round(sum(output_chars) / len(output_chars), 1) if output_chars else 0.0,
+        **summarize_latencies(latencies_ms),
+    }
+
+
+async def main(args: argparse.Namespace):
+    if args.fake:
+        from benchmarks.fakes import install_fakes
+        install_fakes(first_token_ms=args.fake_first_token_ms, tokens_per_second=args.fake_tokens_per_second)
+
+    # 延遲載入：public_service 初始化時會連線 Qdrant 並載入 Embedding 模型
+    import public_service as ps
+    from services.model_router import TIER_FULL, TIER_LITE
+    from utils.token_counter import count_tokens
+
+    router = ps.model_router
+    if TIER_LITE not in router.tiers:
+        raise SystemExit("未設定 lite 模型（MODEL_ROUTER_ENABLED / LLM_MODEL_LITE），無法比較")
+    if args.fake:
+        # 假 Gemini 不區分模型，以較短的首 token 延遲模擬 lite 模型
+        fake_lite = router.tiers[TIER_LITE]
+        while hasattr(fake_lite, "inner"):  # 略過 gateway / cassette / hedge 包裝
+            fake_lite = fake_lite.inner
+        fake_lite.first_token_ms = args.fake_first_token_ms * args.fake_lite_ratio
+
+    results = {}
+    for name, prompt, output_chars in build_samples(ps):
+        task = name.split("/")[0]
+        chosen, reason = router.choose(task, count_tokens(prompt), output_chars)
+        results[name] = {"routed_tier": chosen, "reason": reason, "input_tokens": count_tokens(prompt)}
+        for tier in (TIER_LITE, TIER_FULL):
+            logger.info(f"⏱️ 開始測試 {name} / {tier} ({args.rounds} 輪)")
+            results[name][tier] = await measure(router.tiers[tier], prompt, args.rounds)
+        logger.info(f"📊 {name}: {results[name]}")
+
+    write_report({
+        "benchmark": "model_tiers",
+        "models": router.stats()["models"],
+        "rounds": args.rounds,
+        "fake": args.fake,
+        "created_at": datetime.now().isoformat(),
+        "results": results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比較 lite 與 full 模型在各任務的延遲與輸出")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--fake", action="store_true", help="使用假 Gemini / Qdrant（不需外部服務）")
+    parser.add_argument("--fake-first-token-ms", type=float, default=300.0)
+    parser.add_argument("--fake-tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--fake-lite-ratio", type=float, default=0.5, help="假 lite 模型首 token 延遲相對 full 的比例")
+    parser.add_argument("--output", default="benchmarks/results/model_tiers.json")
+    asyncio.run(main(parser.parse_args()))
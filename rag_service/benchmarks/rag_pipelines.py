@@ -0,0 +1,146 @@
+"""
+RAG 流程基準測試
+比較 use_agent=false 的 v1（ConversationalRetrievalChain）與 v2（精簡 RAG）
+在多輪對話中每則回答的 LLM 呼叫次數、Prompt token 數與延遲分佈
+
+使用方式（需可連線 Gemini 與 Qdrant，於 rag_service 目錄下執行）：
+    python -m benchmarks.rag_pipelines --rounds 3 --output benchmarks/results/rag_pipelines.json
+
+以假 Gemini 驗證流程：
+    python -m benchmarks.rag_pipelines --fake --rounds 2 --score-threshold 0.2  # 假 Embeddings 的相似度較低
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+from langchain.memory import ConversationBufferMemory
+from loguru import logger
+
+from benchmarks.common import summarize_latencies, write_report
+
+
+# 每組為一段對話：第一句為獨立問題，其後為依賴前文的追問
+DEFAULT_CONVERSATIONS = [
+    ["桃園捷運綠線什麼時候通車？", "那會經過哪些地方？", "預算大概多少？"],
+    ["五歲幼兒教育助學金要怎麼申請？", "補助多少錢？"],
+    ["社會住宅目前的進度如何？", "還有多少戶在興建？"],
+    ["青年創業貸款可以申請多少？", "利息怎麼算？"],
+]
+
+
+async def run_pipeline(ps, lean_rag, conversations: List[List[str]], rounds: int) -> Dict[str, Any]:
+    """
+    以指定的 RAG 流程依序執行多輪對話（每段對話使用新的暫時記憶）
+
+    Args:
+        ps: public_service 模組
+        lean_rag: LeanRAG（None 表示 v1 流程）
+        conversations: 對話列表
+        rounds: 重複輪數
+
+    Returns:
+        該流程的統計結果（整體、首句與追問分開統計）
+    """
+    chat_service = ps.chat_service
+    chat_service.lean_rag = lean_rag
+    turns: Dict[str, Dict[str, List[float]]] = {
+        kind: {"latency_ms": [], "llm_calls": [], "prompt_tokens": []} for kind in ("first", "followup")
+    }
+    failures = 0
+
+    for _ in range(rounds):
+        for conversation in conversations:
+            memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+            for index, message in enumerate(conversation):
+                kind = "first" if index == 0 else "followup"
+                started_at = time.perf_counter()
+                with ps.llm_usage.scope("benchmark/rag_pipelines", "public") as usage:
+                    try:
+                        await chat_service.process_chat(
+                            message=message,
+                            session_id="benchmark",
+                            memory=memory,
+                            use_agent=False
+                        )
+                    except Exception as e:
+                        failures += 1
+                        logger.warning(f"⚠️ 執行失敗: {e}")
+                turns[kind]["latency_ms"].append((time.perf_counter() - started_at) * 1000)
+                turns[kind]["llm_calls"].append(usage["calls"])
+                turns[kind]["prompt_tokens"].append(usage["prompt_tokens"])
+
+    def summarize(samples: Dict[str, List[float]]) -> Dict[str, Any]:
+        count = len(samples["latency_ms"])
+        return {
+            "answers": count,
+            "avg_llm_calls": round(sum(samples["llm_calls"]) / count, 2) if count else 0.0,
+            "avg_prompt_tokens": round(sum(samples["prompt_tokens"]) / count, 1) if count else 0.0,
+            **summarize_latencies(samples["latency_ms"]),
+        }
+
+    overall = {key: turns["first"][key] + turns["followup"][key] for key in turns["first"]}
+    return {
+        "failures": failures,
+        **summarize(overall),
+        "first_turn": summarize(turns["first"]),
+        "followup": summarize(turns["followup"]),
+    }
+
+
+async def main(args: argparse.Namespace):
+    # 關閉答案快取、single-flight 與意圖路由，兩種流程的每一題都實際執行檢索與 LLM
+    # （v1 與 v2 共用 rag 快取，否則 v2 與之後的輪次量到的是快取命中）
+    os.environ["ANSWER_CACHE_ENABLED"] = "false"
+    os.environ["SINGLE_FLIGHT_ENABLED"] = "false"
+    os.environ["INTENT_ROUTER_ENABLED"] = "false"
+
+    if args.fake:
+        from benchmarks.fakes import install_fakes
+        install_fakes(first_token_ms=args.fake_first_token_ms, tokens_per_second=args.fake_tokens_per_second)
+
+    # 延遲載入：public_service 初始化時會連線 Qdrant 並載入 Embedding 模型
+    import public_service as ps
+    from services.lean_rag import LeanRAG
+
+    if args.fake:
+        from benchmarks.fakes import seed_vectorstore
+        seed_vectorstore(ps.vectorstore)
+
+    lean_rag = LeanRAG(
+        ps.vectorstore,
+        top_k=ps.RAG_V2_TOP_K,
+        score_threshold=ps.RAG_V2_SCORE_THRESHOLD if args.score_threshold is None else args.score_threshold
+    )
+    pipelines = {"v1": None, "v2": lean_rag}
+    results = {}
+
+    for name in args.pipelines:
+        logger.info(f"⏱️ 開始測試 RAG {name} ({len(DEFAULT_CONVERSATIONS)} 段對話 x {args.rounds} 輪)")
+        results[name] = await run_pipeline(ps, pipelines[name], DEFAULT_CONVERSATIONS, args.rounds)
+        logger.info(f"📊 {name}: {results[name]}")
+    results["v2_retrieval"] = lean_rag.stats()
+
+    write_report({
+        "benchmark": "rag_pipelines",
+        "rounds": args.rounds,
+        "conversations": len(DEFAULT_CONVERSATIONS),
+        "fake": args.fake,
+        "created_at": datetime.now().isoformat(),
+        "results": results,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比較 RAG v1 (ConversationalRetrievalChain) 與 v2 (精簡 RAG)")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--pipelines", nargs="+", choices=["v1", "v2"], default=["v1", "v2"])
+    parser.add_argument("--score-threshold", type=float, default=None, help="v2 段落相似度門檻（預設為 RAG_V2_SCORE_THRESHOLD）")
+    parser.add_argument("--fake", action="store_true", help="使用假 Gemini / Qdrant（不需外部服務）")
+    parser.add_argument("--fake-first-token-ms", type=float, default=300.0)
+    parser.add_argument("--fake-tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--output", default="benchmarks/results/rag_pipelines.json")
+    asyncio.run(main(parser.parse_args()))
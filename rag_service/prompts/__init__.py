@@ -1,7 +1,10 @@
 from .public_agent import PUBLIC_AGENT_PROMPT
 from .staff_agent import STAFF_AGENT_PROMPT
+from .function_calling import PUBLIC_FUNCTION_CALLING_PROMPT, STAFF_FUNCTION_CALLING_PROMPT
 
 __all__ = [
     'PUBLIC_AGENT_PROMPT',
     'STAFF_AGENT_PROMPT',
+    'PUBLIC_FUNCTION_CALLING_PROMPT',
+    'STAFF_FUNCTION_CALLING_PROMPT',
 ]
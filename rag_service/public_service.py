@@ -1,17 +1,22 @@
 import os
 import json
+import asyncio
+import time
 import re # 匯入正規表達式模組
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator, Tuple
 from pathlib import Path
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Header, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Header, Form, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
 
 # ==================== LangChain 核心 ====================
 from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_google_genai import GoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from langchain_google_genai import (
+    GoogleGenerativeAI, GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
+)
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import (
     PyPDFLoader, Docx2txtLoader, TextLoader
@@ -21,12 +26,14 @@ from qdrant_client import QdrantClient
 from qdrant_client.models import Distance, VectorParams
 
 # ==================== LangChain Agents ====================
-from langchain.agents import AgentExecutor, create_react_agent, Tool
-from langchain.prompts import PromptTemplate
+from langchain.agents import (
+    AgentExecutor, create_react_agent, create_tool_calling_agent, Tool
+)
+from langchain.prompts import PromptTemplate, ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.tools import StructuredTool
 
 # ==================== LangChain Memory ====================
 from langchain.memory import ConversationBufferMemory
-from langchain_community.chat_message_histories import FileChatMessageHistory
 
 # ==================== LangChain Chains ====================
 from langchain.chains import (
@@ -39,10 +46,41 @@ from loguru import logger
 
 # 載入數據庫輔助類
 from utils.db_helper import StaffDatabase
+from utils.concurrency import run_blocking, install_default_executor, SingleFlight
+from utils.deadline import DeadlinePolicy, DEGRADATION_NONE
+from utils.session_cache import SessionCache, estimate_chat_memory_bytes
+from utils.chat_history_store import ChatHistoryStore, SQLiteChatMessageHistory
+from utils.retrieval_cache import memoized_retrieval
+from utils.llm_cassette import open_cassette, wrap_llm, wrap_chat_model, CassetteEmbeddings
+from utils.llm_hedging import HedgePolicy, wrap_hedged_llm, wrap_hedged_chat_model
+from utils.llm_gateway import LLMGateway, wrap_gateway_llm, wrap_gateway_chat_model
+from utils.metrics import (
+    MetricsMiddleware, LLMMetricsCallback, InstrumentedEmbeddings, instrument_qdrant_client,
+    collect_stage_timings, build_trace, observe_tool, render_metrics
+)
 
 # 載入 ChatService 和 Prompts
 from services.chat_service import ChatService
-from prompts import PUBLIC_AGENT_PROMPT, STAFF_AGENT_PROMPT
+from services.answer_cache import AnswerCache
+from services.intent_router import IntentRouter
+from services.retrieval_prefetch import RetrievalPrefetcher
+from services.session_manager import SessionManager
+from services.summary_memory import TokenBudgetMemory, MemorySummarizer
+from services.history_archiver import HistoryArchiver
+from services.llm_usage import LLMUsageTracker
+from services.batch_chat import BatchChatRunner, record_tool_use
+from services.lean_rag import LeanRAG
+from services.ws_chat import ChatSocket, ChatSocketHub, WS_CLOSE_POLICY_VIOLATION, WS_CLOSE_TRY_AGAIN
+from services.model_router import (
+    ModelRouter, TIER_FULL, TIER_LITE, TASK_AGENT_STEP, TASK_CONTENT, TASK_SUMMARY,
+    content_length_chars, parse_task_tiers
+)
+from services.admission import AdmissionScheduler, AdmissionRejected, admission_slot, parse_priority_classes
+from services.agent_runtime import AGENT_MODES, AGENT_MODE_REACT, AGENT_MODE_FUNCTION_CALLING
+from prompts import (
+    PUBLIC_AGENT_PROMPT, STAFF_AGENT_PROMPT,
+    PUBLIC_FUNCTION_CALLING_PROMPT, STAFF_FUNCTION_CALLING_PROMPT
+)
 
 # 載入環境變數
 load_dotenv()
@@ -54,6 +92,123 @@ QDRANT_PORT = int(os.getenv("QDRANT_PORT", 6333))
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123456")
 COLLECTION_NAME = "pais_knowledge_base"
 
+# 回答快取設定
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 512))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", 3600))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.92))
+
+# use_agent=false 的 RAG 流程：v2 以啟發式 / 向量分數判斷追問、依分數門檻檢索，只呼叫一次 LLM；
+# v1 為 ConversationalRetrievalChain（有對話歷史時多一次 LLM 改寫問題）
+RAG_PIPELINE = os.getenv("RAG_PIPELINE", "v2").lower()
+RAG_V2_TOP_K = int(os.getenv("RAG_V2_TOP_K", 4))
+RAG_V2_SCORE_THRESHOLD = float(os.getenv("RAG_V2_SCORE_THRESHOLD", 0.55))
+
+# 意圖路由設定（招呼/敏感話題模板回覆、單純查詢走單次 RAG）
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+
+# 預先檢索設定（與 Agent 第一次推理並行搜尋知識庫）
+RETRIEVAL_PREFETCH_ENABLED = os.getenv("RETRIEVAL_PREFETCH_ENABLED", "true").lower() == "true"
+RETRIEVAL_PREFETCH_MIN_OVERLAP = float(os.getenv("RETRIEVAL_PREFETCH_MIN_OVERLAP", 0.6))
+
+# 相同問題併發請求合併執行 (single-flight)
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+# 對話記憶預算：保留最近幾輪原文，較早的對話於背景摘要
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", 1500))
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", 6))
+MEMORY_SUMMARY_ENABLED = os.getenv("MEMORY_SUMMARY_ENABLED", "true").lower() == "true"
+
+# 常駐記憶體的會話上限（LRU + 閒置淘汰，被淘汰的會話下次存取時重新載入）
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", 1000))
+SESSION_CACHE_MAX_MB = int(os.getenv("SESSION_CACHE_MAX_MB", 64))
+SESSION_CACHE_IDLE_SECONDS = int(os.getenv("SESSION_CACHE_IDLE_SECONDS", 1800))
+SESSION_CACHE_SWEEP_INTERVAL = int(os.getenv("SESSION_CACHE_SWEEP_INTERVAL", 60))
+
+# 對話歷史資料庫（SQLite WAL，背景批次寫入）
+CHAT_HISTORY_DB = os.getenv("CHAT_HISTORY_DB", "chat_history/chat_history.db")
+CHAT_HISTORY_FLUSH_INTERVAL = float(os.getenv("CHAT_HISTORY_FLUSH_INTERVAL", 0.5))
+
+# 冷會話歸檔：閒置超過 N 天的會話移到每日壓縮段落檔，存取時自動還原
+HISTORY_ARCHIVE_ENABLED = os.getenv("HISTORY_ARCHIVE_ENABLED", "true").lower() == "true"
+HISTORY_ARCHIVE_IDLE_DAYS = int(os.getenv("HISTORY_ARCHIVE_IDLE_DAYS", 30))
+HISTORY_ARCHIVE_RETENTION_DAYS = int(os.getenv("HISTORY_ARCHIVE_RETENTION_DAYS", 0))
+HISTORY_ARCHIVE_INTERVAL_HOURS = float(os.getenv("HISTORY_ARCHIVE_INTERVAL_HOURS", 24))
+
+# 批次問答 (/api/chat/batch) 的併發與題數上限
+BATCH_CHAT_MAX_CONCURRENCY = int(os.getenv("BATCH_CHAT_MAX_CONCURRENCY", 4))
+BATCH_CHAT_MAX_ITEMS = int(os.getenv("BATCH_CHAT_MAX_ITEMS", 500))
+
+# 對話歷史 API：/api/memory/{session_id} 每頁預設與最大則數，/export 每批讀取的則數
+MEMORY_HISTORY_PAGE_SIZE = int(os.getenv("MEMORY_HISTORY_PAGE_SIZE", 50))
+MEMORY_HISTORY_MAX_PAGE_SIZE = int(os.getenv("MEMORY_HISTORY_MAX_PAGE_SIZE", 200))
+MEMORY_HISTORY_EXPORT_BATCH = int(os.getenv("MEMORY_HISTORY_EXPORT_BATCH", 500))
+
+# WebSocket 對話 (/ws/chat) 的連線上限與背壓：每條連線最多緩衝 WS_CHAT_SEND_BUFFER 個訊框，
+# 客戶端超過 WS_CHAT_SEND_TIMEOUT 秒未讀取時關閉連線
+WS_CHAT_MAX_CONNECTIONS = int(os.getenv("WS_CHAT_MAX_CONNECTIONS", 200))
+WS_CHAT_SEND_BUFFER = int(os.getenv("WS_CHAT_SEND_BUFFER", 64))
+WS_CHAT_SEND_TIMEOUT = float(os.getenv("WS_CHAT_SEND_TIMEOUT", 10))
+WS_CHAT_MAX_MESSAGE_CHARS = int(os.getenv("WS_CHAT_MAX_MESSAGE_CHARS", 2000))
+
+# 准入排程：對話與文案生成先取得執行名額。類別設定為 名稱:優先等級:權重:併發上限，
+# 等級數字越小越優先，同等級依權重公平排隊；public 上限小於總上限，保留名額給幕僚工作
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", 12))
+ADMISSION_CLASSES = os.getenv("ADMISSION_CLASSES", "public:0:4:10,staff:1:2:4,content:1:1:2,batch:2:1:4")
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 100))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", 30))
+
+# 對話請求期限（秒，0 表示不限）：Agent 每一步前檢查剩餘時間，
+# 不足一步（CHAT_DEADLINE_STEP_SECONDS）時改用單次 RAG，連單次 RAG（CHAT_DEADLINE_RAG_SECONDS）都不夠
+# 或 LLM 無法使用時改用擷取式回答
+CHAT_DEADLINE_PUBLIC_SECONDS = float(os.getenv("CHAT_DEADLINE_PUBLIC_SECONDS", 25))
+CHAT_DEADLINE_STAFF_SECONDS = float(os.getenv("CHAT_DEADLINE_STAFF_SECONDS", 60))
+CHAT_DEADLINE_STEP_SECONDS = float(os.getenv("CHAT_DEADLINE_STEP_SECONDS", 4))
+CHAT_DEADLINE_RAG_SECONDS = float(os.getenv("CHAT_DEADLINE_RAG_SECONDS", 3))
+
+# Agent 模式: react（文字解析 ReAct）或 function_calling（Gemini 原生工具呼叫）
+AGENT_MODE_PUBLIC = os.getenv("AGENT_MODE_PUBLIC", AGENT_MODE_REACT).lower()
+AGENT_MODE_STAFF = os.getenv("AGENT_MODE_STAFF", AGENT_MODE_REACT).lower()
+
+# LLM / Embedding 錄製與重播: off、record（錄製到檔案）或 replay（離線重播）
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off").lower()
+LLM_CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", "cassettes")
+LLM_CASSETTE_REPLAY_LATENCY = os.getenv("LLM_CASSETTE_REPLAY_LATENCY", "original").lower()
+
+# Gemini 單次回覆的 token 上限，以及估算費用用的單價（美元 / 百萬 token）
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", 2048))
+LLM_PRICE_INPUT_PER_MTOK = float(os.getenv("LLM_PRICE_INPUT_PER_MTOK", 0.10))
+LLM_PRICE_OUTPUT_PER_MTOK = float(os.getenv("LLM_PRICE_OUTPUT_PER_MTOK", 0.40))
+LLM_USAGE_FLUSH_INTERVAL = float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", 5))
+
+# Gemini 呼叫閘道：兩個服務透過同一個 SQLite 檔案（./shared 掛載到兩個容器）共用 RPM / TPM 額度，
+# 429 / 5xx 以隨機退避重試，等待額度超過 LLM_QUEUE_MAX_WAIT 秒時放棄
+LLM_GATEWAY_ENABLED = os.getenv("LLM_GATEWAY_ENABLED", "true").lower() == "true"
+LLM_GATEWAY_DB = os.getenv("LLM_GATEWAY_DB", "shared/llm_gateway.db")
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", 2000))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", 4000000))
+LLM_RETRY_MAX_ATTEMPTS = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", 4))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 8))
+LLM_QUEUE_MAX_WAIT = float(os.getenv("LLM_QUEUE_MAX_WAIT", 30))
+
+# 模型分級：full 用於 Agent 推理、最終回答與長篇文案，lite 用於問題改寫、摘要與簡短回覆
+# （任務等級可用 MODEL_TIER_RULES 覆寫，例如 "short_reply:full"；auto 依輸入 token 數與預期輸出字數決定）
+LLM_MODEL_FULL = os.getenv("LLM_MODEL_FULL", "gemini-2.0-flash")
+LLM_MODEL_LITE = os.getenv("LLM_MODEL_LITE", "gemini-2.0-flash-lite")
+MODEL_ROUTER_ENABLED = os.getenv("MODEL_ROUTER_ENABLED", "true").lower() == "true"
+MODEL_TIER_RULES = os.getenv("MODEL_TIER_RULES", "")
+MODEL_ROUTER_LITE_MAX_INPUT_TOKENS = int(os.getenv("MODEL_ROUTER_LITE_MAX_INPUT_TOKENS", 2000))
+MODEL_ROUTER_LITE_MAX_OUTPUT_CHARS = int(os.getenv("MODEL_ROUTER_LITE_MAX_OUTPUT_CHARS", 150))
+
+# Gemini 請求避險：超過近期第 N 百分位延遲仍未回應時再送一次，先回應者為準；
+# 額外請求比例上限為 LLM_HEDGE_BUDGET，累積 LLM_HEDGE_MIN_SAMPLES 次延遲後才開始
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 90))
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", 0.05))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+
 # 設定日誌
 logger.add("logs/pais_{time}.log", rotation="1 day", retention="30 days")
 
@@ -73,24 +228,101 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 各路由耗時（/metrics）
+app.add_middleware(MetricsMiddleware, service="public")
+
 # ==================== LangChain 初始化 ====================
 
-# Gemini LLM
-llm = GoogleGenerativeAI(
-    model="gemini-2.0-flash",
+# 錄製 / 重播（關閉時為 None，LLM 與 Embeddings 不做任何包裝）
+llm_cassette = open_cassette(
+    LLM_CASSETTE_MODE,
+    os.path.join(LLM_CASSETTE_DIR, "public.jsonl"),
+    replay_latency=LLM_CASSETTE_REPLAY_LATENCY
+)
+
+# 記錄每次 Gemini 呼叫耗時，健康檢查也依最近一次呼叫結果判斷 LLM 狀態
+llm_metrics = LLMMetricsCallback()
+
+# 訪客計數器 / LLM 用量數據庫
+db = StaffDatabase()
+
+# 每次 Gemini 呼叫的 token 用量（依路由 / 角色 / 會話彙總到 db）
+llm_usage = LLMUsageTracker(
+    db,
+    flush_interval=LLM_USAGE_FLUSH_INTERVAL,
+    price_input_per_mtok=LLM_PRICE_INPUT_PER_MTOK,
+    price_output_per_mtok=LLM_PRICE_OUTPUT_PER_MTOK
+)
+
+# Gemini 呼叫閘道（限流與重試由閘道負責，GoogleGenerativeAI 本身不再重試）
+llm_gateway = LLMGateway(
+    LLM_GATEWAY_DB,
+    rpm=LLM_RPM_LIMIT,
+    tpm=LLM_TPM_LIMIT,
+    service="public",
+    max_attempts=LLM_RETRY_MAX_ATTEMPTS,
+    base_delay=LLM_RETRY_BASE_DELAY,
+    max_delay=LLM_RETRY_MAX_DELAY,
+    max_wait=LLM_QUEUE_MAX_WAIT
+) if LLM_GATEWAY_ENABLED else None
+
+# Gemini 請求避險（錄製 / 重播時不啟用，避免重複請求打亂錄製順序）
+if LLM_HEDGE_ENABLED and llm_cassette is not None:
+    logger.warning("⚠️ LLM_CASSETTE_MODE 開啟時不啟用請求避險")
+hedge_policy = HedgePolicy(
+    pct=LLM_HEDGE_PERCENTILE,
+    budget=LLM_HEDGE_BUDGET,
+    min_samples=LLM_HEDGE_MIN_SAMPLES
+) if LLM_HEDGE_ENABLED and llm_cassette is None else None
+
+# Gemini LLM（依序包上閘道、錄製 / 重播與避險）
+def build_gemini_llm(model_name: str):
+    """建立 Gemini LLM（依序包上共用限流、錄製重播與請求避險）"""
+    return wrap_hedged_llm(wrap_llm(wrap_gateway_llm(GoogleGenerativeAI(
+        model=model_name,
+        google_api_key=GEMINI_API_KEY,
+        temperature=0.7,
+        max_output_tokens=LLM_MAX_OUTPUT_TOKENS,
+        max_retries=1 if llm_gateway else 6,
+        callbacks=[llm_metrics, llm_usage]
+    ), llm_gateway), llm_cassette), hedge_policy)
+
+llm = build_gemini_llm(LLM_MODEL_FULL)
+
+# 模型分級：問題改寫、摘要、簡短回覆與短文案使用 lite 模型
+model_router = ModelRouter(
+    {TIER_FULL: llm, TIER_LITE: build_gemini_llm(LLM_MODEL_LITE) if MODEL_ROUTER_ENABLED and LLM_MODEL_LITE else None},
+    task_tiers=parse_task_tiers(MODEL_TIER_RULES),
+    lite_max_input_tokens=MODEL_ROUTER_LITE_MAX_INPUT_TOKENS,
+    lite_max_output_chars=MODEL_ROUTER_LITE_MAX_OUTPUT_CHARS
+)
+
+# Gemini Chat Model（Function Calling Agent 使用）
+chat_llm = wrap_hedged_chat_model(wrap_chat_model(wrap_gateway_chat_model(ChatGoogleGenerativeAI(
+    model=LLM_MODEL_FULL,
     google_api_key=GEMINI_API_KEY,
     temperature=0.7,
-    max_output_tokens=2048
-)
+    max_output_tokens=LLM_MAX_OUTPUT_TOKENS,
+    callbacks=[llm_metrics, llm_usage]
+), llm_gateway), llm_cassette), hedge_policy)
 
 # Embeddings (使用 moka-ai/m3e-base)
-embeddings = HuggingFaceEmbeddings(
-    model_name="moka-ai/m3e-base",
-    model_kwargs={'device': 'cpu'}
-)
+def load_embeddings() -> HuggingFaceEmbeddings:
+    return HuggingFaceEmbeddings(
+        model_name="moka-ai/m3e-base",
+        model_kwargs={'device': 'cpu'}
+    )
+
+if llm_cassette is not None:
+    # 重播時不載入模型，完全離線
+    embeddings = InstrumentedEmbeddings(
+        CassetteEmbeddings(load_embeddings, llm_cassette, model_name="moka-ai/m3e-base")
+    )
+else:
+    embeddings = InstrumentedEmbeddings(load_embeddings())
 
 # Qdrant 向量資料庫
-qdrant_client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+qdrant_client = instrument_qdrant_client(QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT))
 
 try:
     qdrant_client.get_collection(COLLECTION_NAME)
@@ -112,40 +344,107 @@ vectorstore = Qdrant(
     embeddings=embeddings
 )
 
-# ==================== 訪客計數器數據庫 ====================
-db = StaffDatabase()
-
 # ==================== LangChain Memory 管理 ====================
-memory_store: Dict[str, ConversationBufferMemory] = {}
+# 所有會話共用的對話歷史資料庫
+chat_history_store = ChatHistoryStore(CHAT_HISTORY_DB, flush_interval=CHAT_HISTORY_FLUSH_INTERVAL)
+
+# 會話 ID 核發與會話鎖（同一會話的請求依序處理）
+session_manager = SessionManager()
+
+def flush_evicted_memory(session_id: str, memory: ConversationBufferMemory):
+    """會話被移出記憶體前寫回磁碟"""
+    flush = getattr(memory, "flush", None)
+    if flush is not None:
+        flush()
+    logger.debug(f"💤 會話移出記憶體: {session_id}")
+
+# 常駐會話快取（處理中的會話不會被淘汰）
+memory_store: SessionCache[ConversationBufferMemory] = SessionCache(
+    max_entries=SESSION_CACHE_MAX_ENTRIES,
+    max_bytes=SESSION_CACHE_MAX_MB * 1024 * 1024,
+    idle_ttl_seconds=SESSION_CACHE_IDLE_SECONDS,
+    size_func=estimate_chat_memory_bytes,
+    on_evict=flush_evicted_memory,
+    can_evict=lambda session_id: not session_manager.is_active(session_id),
+    name="public"
+)
+
+# 背景對話摘要器（超出 token 預算的舊對話折疊成摘要）
+memory_summarizer = MemorySummarizer(model_router.llm_for(TASK_SUMMARY, record=False)) if MEMORY_SUMMARY_ENABLED else None
+
+# 冷會話歸檔（常駐或處理中的會話不會被歸檔）
+history_archiver = HistoryArchiver(
+    chat_history_store,
+    archive_dir="chat_history/archive",
+    idle_days=HISTORY_ARCHIVE_IDLE_DAYS,
+    retention_days=HISTORY_ARCHIVE_RETENTION_DAYS,
+    can_archive=lambda session_id: session_id not in memory_store and not session_manager.is_active(session_id)
+) if HISTORY_ARCHIVE_ENABLED else None
+
+def rehydrate_if_archived(session_id: str):
+    """熱資料庫沒有此會話時，嘗試從歸檔還原"""
+    if history_archiver is not None and chat_history_store.count(session_id) == 0:
+        history_archiver.rehydrate(session_id)
 
 def get_memory(session_id: str) -> ConversationBufferMemory:
-    """取得或建立對話記憶"""
-    if session_id not in memory_store:
-        try:
-            Path("chat_history").mkdir(exist_ok=True)
-            history_file = f"chat_history/{session_id}.json"
-            message_history = FileChatMessageHistory(history_file)
-
-            memory_store[session_id] = ConversationBufferMemory(
-                chat_memory=message_history,
-                memory_key="chat_history",
-                return_messages=True
-            )
-            logger.info(f"🧠 建立新記憶: {session_id} (檔案: {history_file})")
-        except Exception as mem_err:
-            logger.error(f"❌ 建立記憶體失敗 ({session_id}): {mem_err}")
-            return ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-            
-    return memory_store[session_id]
+    """取得或建立對話記憶（摘要 + token 預算內的最近對話）"""
+    def load_memory() -> ConversationBufferMemory:
+        Path("chat_history").mkdir(exist_ok=True)
+        message_history = SQLiteChatMessageHistory(session_id, chat_history_store)
+
+        memory = TokenBudgetMemory(
+            chat_memory=message_history,
+            memory_key="chat_history",
+            return_messages=True,
+            max_token_limit=MEMORY_MAX_TOKENS,
+            max_turns=MEMORY_MAX_TURNS,
+            summarizer=memory_summarizer
+        )
+        logger.info(f"🧠 載入記憶: {session_id}")
+        return memory
+
+    try:
+        return memory_store.get_or_create(session_id, load_memory)
+    except Exception as mem_err:
+        logger.error(f"❌ 建立記憶體失敗 ({session_id}): {mem_err}")
+        return ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+
+async def load_session_memory(session_id: str) -> ConversationBufferMemory:
+    """
+    取得對話記憶；會話不在常駐快取時，先在執行緒池中從歸檔還原
+    （讀檔、解壓與寫回資料庫不佔用事件迴圈，也不在常駐快取的鎖內進行）
+
+    呼叫端應先持有 session_manager 的會話鎖或 hold，避免還原後又被歸檔
+
+    Args:
+        session_id: 會話 ID
+
+    Returns:
+        對話記憶
+    """
+    if history_archiver is not None and session_id not in memory_store:
+        await run_blocking(rehydrate_if_archived, session_id)
+    return get_memory(session_id)
 
 # ==================== LangChain Tools ====================
 
+@observe_tool("search_knowledge_base")
 def search_knowledge_base(query: str) -> str:
     """搜尋知識庫工具"""
     logger.info(f"🛠️ 使用工具 [搜尋知識庫]，查詢: {query}")
+    record_tool_use("搜尋知識庫", query)
+    if retrieval_prefetcher is not None:
+        prefetched = retrieval_prefetcher.consume(query)
+        if prefetched is not None:
+            return prefetched
+    return run_knowledge_search(query)
+
+def run_knowledge_search(query: str) -> str:
+    """實際執行知識庫搜尋並格式化為工具輸出"""
     try:
         retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
-        docs = retriever.invoke(query) # 使用 invoke
+        # 批次問答中相同查詢共用檢索結果
+        docs = memoized_retrieval(("similarity", query, 3), lambda: retriever.invoke(query))
         if docs:
             # 處理每個文檔，移除所有可能導致格式化問題的字符
             cleaned_contents = []
@@ -171,11 +470,17 @@ def search_knowledge_base(query: str) -> str:
         logger.error(f"❌ 工具 [搜尋知識庫] 執行錯誤: {e}", exc_info=True)
         return f"搜尋知識庫時發生錯誤: {str(e)}"
 
+@observe_tool("get_policy_info")
 def get_policy_info(policy_name: str) -> str:
     """取得特定政策資訊工具"""
     logger.info(f"🛠️ 使用工具 [查詢政策]，政策名稱: {policy_name}")
+    record_tool_use("查詢特定政策名稱", policy_name)
     try:
-        docs = vectorstore.similarity_search(policy_name, k=1) # 只取最相關的 1 筆
+        # 只取最相關的 1 筆
+        docs = memoized_retrieval(
+            ("similarity", policy_name, 1),
+            lambda: vectorstore.similarity_search(policy_name, k=1)
+        )
         if docs:
             result = docs[0].page_content
             # 移除所有大括號，避免格式化問題
@@ -194,20 +499,52 @@ def get_policy_info(policy_name: str) -> str:
         logger.error(f"❌ 工具 [查詢政策] 執行錯誤: {e}", exc_info=True)
         return f"查詢政策 '{policy_name}' 時發生錯誤: {str(e)}"
 
+# 預先檢索器：請求進來即以原始問題檢索，工具查詢相近時直接取用
+retrieval_prefetcher = RetrievalPrefetcher(
+    search_func=run_knowledge_search,
+    min_similarity=RETRIEVAL_PREFETCH_MIN_OVERLAP
+) if RETRIEVAL_PREFETCH_ENABLED else None
+
+async def asearch_knowledge_base(query: str) -> str:
+    """搜尋知識庫工具 (非同步版本，於共用執行緒池執行)"""
+    return await run_blocking(search_knowledge_base, query)
+
+async def aget_policy_info(policy_name: str) -> str:
+    """取得特定政策資訊工具 (非同步版本，於共用執行緒池執行)"""
+    return await run_blocking(get_policy_info, policy_name)
+
 # 定義 Agent 工具
 tools = [
     Tool(
         name="搜尋知識庫",
         func=search_knowledge_base,
+        coroutine=asearch_knowledge_base,
         description="當你需要回答關於市長的**政策、理念、施政報告、公開發言、個人背景**或**桃園市政相關問題**時使用。**輸入：** 具體的問題或清晰的關鍵字詞組 (例如：'桃園市的交通政策有哪些？', '市長對於青年就業的看法', '說明社會住宅的進度')。**不要**只輸入模糊的單詞。"
     ),
     Tool(
         name="查詢特定政策名稱",
         func=get_policy_info,
+        coroutine=aget_policy_info,
         description="當使用者**明確**提到一個**具體的政策名稱**，而你需要查找該政策的詳細內容時使用。**輸入：** 完整的政策名稱 (例如：'五歲幼兒教育助學金', '國中小免費營養午餐')。如果只是問某個領域的政策 (如 '交通政策')，請使用「搜尋知識庫」。"
     ),
 ]
 
+# Function Calling 工具（Gemini 函式名稱須為英文，功能與上方工具相同）
+function_calling_tools = [
+    StructuredTool.from_function(
+        func=search_knowledge_base,
+        coroutine=asearch_knowledge_base,
+        name="search_knowledge_base",
+        description="搜尋市長的政策、理念、施政報告、公開發言、個人背景或桃園市政相關資料。query 請輸入具體的問題或清晰的關鍵字詞組，例如「桃園市的交通政策有哪些？」。"
+    ),
+    StructuredTool.from_function(
+        func=get_policy_info,
+        coroutine=aget_policy_info,
+        name="get_policy_info",
+        description="查詢具體政策名稱的詳細內容。policy_name 請輸入完整的政策名稱，例如「五歲幼兒教育助學金」。只是詢問某個領域的政策時請改用 search_knowledge_base。"
+    ),
+]
+
 # ==================== LangChain Agent 定義 ====================
 
 # 創建 Agent Prompt Template（使用從 prompts 模組導入的 Prompt）
@@ -224,7 +561,7 @@ staff_agent_prompt = PromptTemplate(
 # 創建 Agent（公眾版 - 善寶）
 try:
     agent = create_react_agent(
-        llm=llm,
+        llm=model_router.llm_for(TASK_AGENT_STEP, record=False),
         tools=tools,
         prompt=agent_prompt
     )
@@ -239,7 +576,7 @@ except Exception as agent_create_err:
 # 創建 Staff Agent（幕僚版）
 try:
     staff_agent = create_react_agent(
-        llm=llm,
+        llm=model_router.llm_for(TASK_AGENT_STEP, record=False),
         tools=tools,
         prompt=staff_agent_prompt
     )
@@ -251,25 +588,136 @@ except Exception as staff_agent_create_err:
         logger.error(f"❌ 創建 Staff Agent 失敗，且 Logger 也發生錯誤: {log_err}")
     staff_agent = None
 
+def create_function_calling_agent(system_prompt: str):
+    """建立 Gemini 原生工具呼叫 Agent"""
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        MessagesPlaceholder("chat_history", optional=True),
+        ("human", "{input}"),
+        MessagesPlaceholder("agent_scratchpad"),
+    ])
+    return create_tool_calling_agent(chat_llm, function_calling_tools, prompt)
+
+# 創建 Function Calling Agent（公眾版、幕僚版）
+try:
+    fc_agent = create_function_calling_agent(PUBLIC_FUNCTION_CALLING_PROMPT)
+    fc_staff_agent = create_function_calling_agent(STAFF_FUNCTION_CALLING_PROMPT)
+    logger.info("✅ Function Calling Agent (公眾版/幕僚版) 創建成功")
+except Exception as fc_agent_create_err:
+    logger.error(f"❌ 創建 Function Calling Agent 失敗: {fc_agent_create_err}", exc_info=True)
+    fc_agent = None
+    fc_staff_agent = None
+
+# 各 Agent 模式對應的 Agent 與工具
+agents_by_mode = {
+    AGENT_MODE_REACT: {"public": agent, "staff": staff_agent},
+    AGENT_MODE_FUNCTION_CALLING: {"public": fc_agent, "staff": fc_staff_agent},
+}
+tools_by_mode = {
+    AGENT_MODE_REACT: tools,
+    AGENT_MODE_FUNCTION_CALLING: function_calling_tools,
+}
+
+agent_modes = {}
+for agent_role, agent_mode in (("public", AGENT_MODE_PUBLIC), ("staff", AGENT_MODE_STAFF)):
+    if agent_mode not in AGENT_MODES:
+        logger.warning(f"⚠️ 未知的 Agent 模式 '{agent_mode}' ({agent_role})，改用 {AGENT_MODE_REACT}")
+        agent_mode = AGENT_MODE_REACT
+    agent_modes[agent_role] = agent_mode
+
 # ==================== ChatService 初始化 ====================
 
+# 回答快取（精確 + 語意，知識庫更新時自動失效）
+answer_cache = AnswerCache(
+    embeddings=embeddings,
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY
+) if ANSWER_CACHE_ENABLED else None
+
+# 意圖路由器（本地規則 + m3e 中心點，僅使用 CPU）
+intent_router = IntentRouter(embeddings=embeddings) if INTENT_ROUTER_ENABLED else None
+
+# 請求合併器（相同問題的併發請求共用一次 Agent / RAG 執行）
+single_flight = SingleFlight() if SINGLE_FLIGHT_ENABLED else None
+
+# 各角色的請求期限
+deadline_policy = DeadlinePolicy(
+    {"public": CHAT_DEADLINE_PUBLIC_SECONDS, "staff": CHAT_DEADLINE_STAFF_SECONDS},
+    step_seconds=CHAT_DEADLINE_STEP_SECONDS,
+    rag_seconds=CHAT_DEADLINE_RAG_SECONDS
+)
+
+# 准入排程（市民對話優先於幕僚對話、文案生成與批次問答）
+admission = AdmissionScheduler(
+    parse_priority_classes(ADMISSION_CLASSES),
+    max_concurrency=ADMISSION_MAX_CONCURRENCY,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_wait=ADMISSION_MAX_WAIT,
+    service="public"
+) if ADMISSION_ENABLED else None
+
+# 精簡 RAG (use_agent=false 的 v2 流程)
+lean_rag = LeanRAG(
+    vectorstore,
+    top_k=RAG_V2_TOP_K,
+    score_threshold=RAG_V2_SCORE_THRESHOLD
+) if RAG_PIPELINE == "v2" else None
+
 # 創建 ChatService 實例
 chat_service = ChatService(
     llm=llm,
     vectorstore=vectorstore,
-    tools=tools,
-    agent=agent,
-    staff_agent=staff_agent,
-    rag_prompt=None  # RAG prompt 將在後面定義後更新
+    tools={role: tools_by_mode[mode] for role, mode in agent_modes.items()},
+    agent=agents_by_mode[agent_modes["public"]]["public"],
+    staff_agent=agents_by_mode[agent_modes["staff"]]["staff"],
+    rag_prompt=None,  # RAG prompt 將在後面定義後更新
+    answer_cache=answer_cache,
+    intent_router=intent_router,
+    agent_modes=agent_modes,
+    retrieval_prefetcher=retrieval_prefetcher,
+    single_flight=single_flight,
+    deadline_policy=deadline_policy,
+    model_router=model_router,
+    lean_rag=lean_rag
+)
+
+# 批次問答（離線評估、FAQ 大量產生）
+batch_runner = BatchChatRunner(
+    chat_service,
+    get_memory=load_session_memory,
+    session_manager=session_manager,
+    max_concurrency=BATCH_CHAT_MAX_CONCURRENCY,
+    admission=admission
+)
+
+# WebSocket 對話連線
+chat_socket_hub = ChatSocketHub(
+    max_connections=WS_CHAT_MAX_CONNECTIONS,
+    send_buffer=WS_CHAT_SEND_BUFFER,
+    send_timeout=WS_CHAT_SEND_TIMEOUT,
+    max_message_chars=WS_CHAT_MAX_MESSAGE_CHARS
 )
 
+def chat_priority_class(role: str) -> str:
+    """對話請求的准入類別（幕僚對話與市民對話分開排隊）"""
+    return "staff" if role == "staff" else "public"
+
+ADMISSION_BUSY_DETAIL = "系統忙碌中，請稍後再試"
+
+def invalidate_answer_cache(reason: str):
+    """知識庫內容變更後清空回答快取"""
+    if answer_cache is not None:
+        answer_cache.invalidate(reason)
+
 # ==================== Pydantic 模型 ====================
 # (保持不變)
 class ChatRequest(BaseModel):
     message: str
-    session_id: Optional[str] = "default"
+    session_id: Optional[str] = None  # 未提供時由伺服器核發，回應中會帶回
     use_agent: bool = True
     role: str = "public"  # "public" 或 "staff"，決定 AI 的身份
+    include_trace: bool = False  # 回應中附上各階段耗時
 
 class ChatResponse(BaseModel):
     reply: str
@@ -277,6 +725,18 @@ class ChatResponse(BaseModel):
     session_id: str
     timestamp: str
     thought_process: Optional[str] = None # 改為字串以容納錯誤訊息或步驟
+    degradation: str = DEGRADATION_NONE  # 降級層級: none / rag（時間不足改用單次 RAG）/ extractive（摘錄知識庫）
+    trace: Optional[Dict[str, Any]] = None  # include_trace 時的各階段耗時與 token 用量 {"total_ms", "stages", "tokens"}
+
+class BatchChatItem(BaseModel):
+    message: str
+    session_id: Optional[str] = None  # 未提供時使用不寫入歷史的暫時記憶
+
+class BatchChatRequest(BaseModel):
+    items: List[BatchChatItem]
+    role: str = "public"
+    use_agent: bool = True
+    concurrency: Optional[int] = None  # 不超過 BATCH_CHAT_MAX_CONCURRENCY
 
 class ContentGenerationRequest(BaseModel):
     topic: str
@@ -294,6 +754,21 @@ class VisitorStatsResponse(BaseModel):
 
 # ==================== 工具函數 ====================
 # (保持不變)
+def resolve_session_id(session_id: Optional[str], role: str = "public") -> str:
+    """取得本次請求的 session ID（未提供時核發新的），格式錯誤時回傳 400"""
+    try:
+        resolved, _ = session_manager.resolve(
+            session_id, prefix="staff" if role == "staff" else "user"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return resolved
+
+def validate_session_id(session_id: str):
+    """檢查路徑中的 session ID 格式"""
+    if not session_manager.is_valid(session_id):
+        raise HTTPException(status_code=400, detail="session_id 格式不正確")
+
 def verify_admin(authorization: Optional[str] = Header(None)):
     """驗證管理員權限"""
     if not ADMIN_PASSWORD or authorization != f"Bearer {ADMIN_PASSWORD}":
@@ -399,7 +874,7 @@ async def root():
 async def health_check():
     qdrant_ok = False
     llm_ok = False
-    agent_ok = agent is not None
+    agent_ok = "public" in chat_service.agent_runtime.executors
     error_msg = ""
     try:
         qdrant_client.get_collections()
@@ -408,18 +883,32 @@ async def health_check():
         error_msg += f"Qdrant 連接失敗: {e}; "
         logger.error(f"❌ 健康檢查 - Qdrant 連接失敗: {e}")
 
-    llm_ok = True # 暫時假設 LLM 正常
+    # 依最近一次 Gemini 呼叫的結果判斷（尚未呼叫過時視為正常）
+    llm_status = llm_metrics.status()
+    llm_ok = llm_status["healthy"]
+    if not llm_ok:
+        error_msg += f"Gemini 最近一次呼叫失敗: {llm_status['last_error_message']}; "
 
     status = "healthy" if qdrant_ok and llm_ok and agent_ok else "unhealthy"
 
     return {
         "status": status,
         "qdrant": "✅ connected" if qdrant_ok else "❌ disconnected",
-        "llm": "✅ assumed ok" if llm_ok else "❌ failed test",
+        "llm": "✅ ok" if llm_ok else "❌ last call failed",
+        "llm_last_success": llm_status["last_success"],
         "agents": "✅ active" if agent_ok else "❌ failed to create",
         "error": error_msg if error_msg else None
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指標（文字格式）"""
+    rendered = render_metrics()
+    if rendered is None:
+        raise HTTPException(status_code=503, detail="未安裝 prometheus_client，無法輸出指標")
+    content, content_type = rendered
+    return Response(content=content, headers={"Content-Type": content_type})
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """
@@ -427,22 +916,34 @@ async def chat(request: ChatRequest):
     支援不同角色：public (善寶) 或 staff (幕僚助理)
 
     此端點已重構為使用 ChatService 處理所有對話邏輯
+    未提供 session_id 時由伺服器核發，並於回應的 session_id 帶回
     """
-    session_id = request.session_id or "default"
-    memory = get_memory(session_id)
+    session_id = resolve_session_id(request.session_id, request.role)
+    started_at = time.perf_counter()
 
     try:
-        # 使用 ChatService 處理對話
-        result = await chat_service.process_chat(
-            message=request.message,
-            session_id=session_id,
-            memory=memory,
-            use_agent=request.use_agent,
-            role=request.role
-        )
-
+        with collect_stage_timings() as stages, \
+                llm_usage.scope("/api/chat", request.role, session_id) as tokens:
+            # 同一會話的請求依序處理，避免併發寫入同一份記憶
+            async with session_manager.lock(session_id):
+                memory = await load_session_memory(session_id)
+                # 取得執行名額後再交給 ChatService 處理對話
+                async with admission_slot(admission, chat_priority_class(request.role)):
+                    result = await chat_service.process_chat(
+                        message=request.message,
+                        session_id=session_id,
+                        memory=memory,
+                        use_agent=request.use_agent,
+                        role=request.role
+                    )
+
+        if request.include_trace:
+            result["trace"] = build_trace(stages, started_at, tokens)
         return ChatResponse(**result)
 
+    except AdmissionRejected as e:
+        logger.warning(f"⚠️ 對話請求未獲准入 ({session_id}): {e}")
+        raise HTTPException(status_code=503, detail=ADMISSION_BUSY_DETAIL)
     except ValueError as e:
         # Agent 未初始化錯誤
         logger.error(f"❌ Agent 初始化錯誤 ({session_id}): {str(e)}")
@@ -452,6 +953,184 @@ async def chat(request: ChatRequest):
         logger.error(f"❌ 對話處理失敗 ({session_id}): {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"對話處理失敗: {str(e)}")
 
+@app.post("/api/chat/batch")
+async def chat_batch(request: BatchChatRequest, admin: bool = Depends(verify_admin)):
+    """
+    批次問答 API (NDJSON 串流)
+
+    每完成一題輸出一行 {"type": "result", index, reply, sources, latency_ms, tool_calls, ...}，
+    全部完成後輸出一行 {"type": "summary", ...}；同一批次的知識庫檢索結果共用快取
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items 不可為空")
+    if len(request.items) > BATCH_CHAT_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"單次最多 {BATCH_CHAT_MAX_ITEMS} 題")
+    for item in request.items:
+        if item.session_id and not session_manager.is_valid(item.session_id):
+            raise HTTPException(status_code=400, detail=f"session_id 格式不正確: {item.session_id}")
+
+    async def ndjson_generator():
+        # 整批的用量歸在同一個 scope（各題不一定有 session_id）
+        with llm_usage.scope("/api/chat/batch", request.role, "batch"):
+            async for result in batch_runner.run(
+                [item.dict() for item in request.items],
+                role=request.role,
+                use_agent=request.use_agent,
+                concurrency=request.concurrency
+            ):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        ndjson_generator(),
+        media_type="application/x-ndjson",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """將事件格式化為 Server-Sent Events 文字"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+async def stream_chat_events(
+    request: ChatRequest,
+    session_id: str,
+    endpoint: str
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    依序取得會話鎖與執行名額後串流對話事件（SSE 與 WebSocket 共用）
+
+    Args:
+        request: 對話請求
+        session_id: 已驗證的 session ID
+        endpoint: 用量統計的端點名稱
+
+    Yields:
+        (事件類型, 資料)，事件類型為 progress / token / done；未獲准入時以帶 error 的 done 事件告知忙碌
+    """
+    started_at = time.perf_counter()
+    with collect_stage_timings() as stages, \
+            llm_usage.scope(endpoint, request.role, session_id) as tokens:
+        async with session_manager.lock(session_id):
+            try:
+                memory = await load_session_memory(session_id)
+                async with admission_slot(admission, chat_priority_class(request.role)):
+                    async for event, data in iter_chat_events(request, session_id, memory):
+                        if event == "done":
+                            data = {"degradation": DEGRADATION_NONE, **data}
+                            if request.include_trace:
+                                data["trace"] = build_trace(stages, started_at, tokens)
+                        yield event, data
+            except AdmissionRejected as e:
+                # 串流已開始回應，以 done 事件告知忙碌
+                logger.warning(f"⚠️ 串流對話未獲准入 ({session_id}): {e}")
+                yield "done", {
+                    "reply": ADMISSION_BUSY_DETAIL,
+                    "sources": [],
+                    "session_id": session_id,
+                    "degradation": DEGRADATION_NONE,
+                    "error": True
+                }
+
+async def iter_chat_events(
+    request: ChatRequest,
+    session_id: str,
+    memory: ConversationBufferMemory
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """以 Agent 串流或 RAG Chain 處理一則訊息"""
+    if request.use_agent:
+        async for event in chat_service.stream_chat(
+            message=request.message,
+            session_id=session_id,
+            memory=memory,
+            role=request.role
+        ):
+            yield event["event"], event["data"]
+    else:
+        # RAG Chain 模式不支援逐字輸出，完成後一次送出
+        started_at = datetime.now()
+        result = await chat_service.process_chat(
+            message=request.message,
+            session_id=session_id,
+            memory=memory,
+            use_agent=False,
+            role=request.role
+        )
+        elapsed_ms = int((datetime.now() - started_at).total_seconds() * 1000)
+        yield "token", {"text": result["reply"]}
+        yield "done", {**result, "ttft_ms": elapsed_ms, "total_ms": elapsed_ms}
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    串流對話 API (Server-Sent Events)
+
+    事件類型:
+    - progress: Agent 思考或工具執行進度
+    - token: Final Answer 的增量文字
+    - done: 完整回覆、來源、session_id、ttft_ms（首個 token 延遲）與 degradation（降級層級）
+    """
+    session_id = resolve_session_id(request.session_id, request.role)
+
+    async def event_generator():
+        async for event, data in stream_chat_events(request, session_id, "/api/chat/stream"):
+            yield format_sse(event, data)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # 避免 Nginx 緩衝串流
+            "X-Session-Id": session_id
+        }
+    )
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket, session_id: Optional[str] = None, role: str = "public"):
+    """
+    WebSocket 對話 (/ws/chat?session_id=...&role=public)
+
+    連線後先送出 {"type": "session", "session_id"}，連線期間會話記憶常駐；
+    客戶端送出 {"type": "chat", "message", "id"} 後依序收到 progress / token / done 訊框（內容與 SSE 相同），
+    送出 {"type": "cancel"} 可中止進行中的回答（回傳 cancelled 訊框，該輪不寫入記憶）
+    """
+    await websocket.accept()
+    try:
+        resolved, _ = session_manager.resolve(session_id, prefix="staff" if role == "staff" else "user")
+    except ValueError as e:
+        await websocket.close(code=WS_CLOSE_POLICY_VIOLATION, reason=str(e))
+        return
+    if not chat_socket_hub.open():
+        logger.warning(f"⚠️ WebSocket 連線數已達上限，拒絕連線 ({resolved})")
+        await websocket.close(code=WS_CLOSE_TRY_AGAIN, reason="too many connections")
+        return
+
+    async def run_turn(frame: Dict[str, Any]):
+        request = ChatRequest(
+            message=frame["message"],
+            session_id=resolved,
+            use_agent=bool(frame.get("use_agent", True)),
+            role=role,
+            include_trace=bool(frame.get("include_trace", False))
+        )
+        async for event, data in stream_chat_events(request, resolved, "/ws/chat"):
+            yield event, data
+
+    logger.info(f"🔌 WebSocket 對話連線建立: {resolved}")
+    try:
+        # 連線期間保留會話，常駐記憶不會被淘汰或歸檔
+        with session_manager.hold(resolved):
+            await load_session_memory(resolved)
+            socket = ChatSocket(websocket, chat_socket_hub, resolved)
+            await socket.send({"type": "session", "session_id": resolved})
+            await socket.serve(run_turn)
+    finally:
+        chat_socket_hub.close()
+        logger.info(f"🔌 WebSocket 對話連線結束: {resolved}")
+
 # --- /api/generate 保持不變 ---
 @app.post("/api/generate")
 async def generate_content(
@@ -471,7 +1150,7 @@ async def generate_content(
             try:
                 retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
                 logger.info(f"🔍 從知識庫搜尋主題 '{request.topic}' 的參考資料...")
-                relevant_docs = retriever.invoke(request.topic) # 使用 invoke
+                relevant_docs = await retriever.ainvoke(request.topic)
                 if relevant_docs:
                     context = "\n\n---\n\n".join([doc.page_content for doc in relevant_docs])
                     logger.info(f"✅ 找到 {len(relevant_docs)} 筆參考資料")
@@ -480,19 +1159,23 @@ async def generate_content(
             except Exception as search_err:
                  logger.error(f"❌ 搜尋參考資料時失敗: {search_err}")
 
+        # 短文案用 lite 模型，中長篇與參考資料較多時用 full 模型
+        content_llm = model_router.llm_for(TASK_CONTENT, context, output_chars=content_length_chars(request.length))
         content_chain = LLMChain(
-            llm=llm,
+            llm=content_llm,
             prompt=CONTENT_PROMPT,
             verbose=True
         )
 
         logger.info(f"🚀 開始調用 LLM 生成文案...")
-        result = content_chain.invoke({
-            "topic": request.topic,
-            "style": request.style,
-            "length": request.length,
-            "context": context
-        })
+        async with admission_slot(admission, "content"):
+            with llm_usage.scope("/api/generate", "staff") as tokens:
+                result = await content_chain.ainvoke({
+                    "topic": request.topic,
+                    "style": request.style,
+                    "length": request.length,
+                    "context": context
+                })
 
         generated_content = result.get("text", "").strip()
 
@@ -528,11 +1211,16 @@ async def generate_content(
                  doc.metadata.get("source", "未知來源").split('/')[-1]
                  for doc in relevant_docs
             ],
-            "context_used": len(relevant_docs) > 0
+            "context_used": len(relevant_docs) > 0,
+            "model": getattr(content_llm, "model", ""),
+            "tokens": tokens
         }
 
     except HTTPException as http_exc:
         raise http_exc
+    except AdmissionRejected as e:
+        logger.warning(f"⚠️ 文案生成未獲准入: {e}")
+        raise HTTPException(status_code=503, detail=ADMISSION_BUSY_DETAIL)
     except Exception as e:
         logger.error(f"❌ 文案生成過程中發生未預期錯誤: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"文案生成失敗: {str(e)}")
@@ -610,13 +1298,14 @@ async def ingest_documents(
         for i in range(0, total_chunks_created, batch_size):
             batch = all_splits[i:i + batch_size]
             try:
-                vectorstore.add_documents(batch)
+                await run_blocking(vectorstore.add_documents, batch)
                 logger.info(f"✍️ 已寫入 {len(batch)} 個片段 (總進度: {min(i + batch_size, total_chunks_created)} / {total_chunks_created})")
             except Exception as add_doc_err:
                  logger.error(f"❌ 寫入片段 {i} 到 {i+batch_size} 時失敗: {add_doc_err}", exc_info=True)
                  errors.append(f"部分資料寫入失敗: {add_doc_err}")
 
         logger.info(f"✅ 所有片段已成功寫入向量資料庫 '{COLLECTION_NAME}'")
+        invalidate_answer_cache(f"ingest {folder_path}")
 
         return {
             "message": "✅ 知識庫更新成功" + (f" (部分檔案處理失敗，請查看日誌)" if errors else ""),
@@ -742,8 +1431,9 @@ async def upload_file(
             }
 
         try:
-            vectorstore.add_documents(splits)
+            await run_blocking(vectorstore.add_documents, splits)
             logger.info(f"✅ 檔案 {file_path.name} 的片段已成功加入向量資料庫")
+            invalidate_answer_cache(f"upload {file_path.name}")
             return {
                 "success": True,
                 "message": "✅ 檔案上傳並成功加入知識庫",
@@ -764,32 +1454,30 @@ async def upload_file(
 
 # --- 其他 API 保持不變 ---
 @app.get("/api/memory/{session_id}")
-async def get_memory_history(session_id: str):
-    """取得指定 session 的對話記憶"""
+async def get_memory_history(session_id: str, before: Optional[int] = None, limit: Optional[int] = None):
+    """
+    取得指定 session 的對話記憶（以訊息 ID 為游標由新到舊分頁）
+
+    回傳本頁訊息（依時間順序）、訊息總數與 next_before；
+    以 next_before 作為下一次請求的 before 取得更早的訊息，為 null 時表示已到最早一則
+    """
+    validate_session_id(session_id)
+    limit = MEMORY_HISTORY_PAGE_SIZE if limit is None else limit
+    if not 1 <= limit <= MEMORY_HISTORY_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit 必須介於 1 到 {MEMORY_HISTORY_MAX_PAGE_SIZE}")
     try:
-        if session_id not in memory_store:
-            history_file = Path(f"chat_history/{session_id}.json")
-            if not history_file.exists():
-                logger.warning(f"⚠️ 請求記憶體歷史，但 session '{session_id}' 不存在 (記憶體與檔案皆無)")
-                raise HTTPException(status_code=404, detail="找不到此對話記錄")
-            else:
-                 get_memory(session_id)
-
-        memory = memory_store[session_id]
-        history_data = memory.load_memory_variables({})
-        messages = history_data.get("chat_history", [])
-        formatted_history = []
-        for msg in messages:
-            msg_type = "user" if msg.type == "human" else "ai" if msg.type == "ai" else "system"
-            formatted_history.append({
-                "type": msg_type,
-                "content": msg.content
-            })
-
-        logger.info(f"✅ 成功取得 session '{session_id}' 的對話歷史 ({len(formatted_history)} 條)")
+        # 直接讀取歷史資料庫，不把會話載入常駐快取
+        total = await run_blocking(count_history, session_id)
+        page, next_before = await run_blocking(chat_history_store.get_page, session_id, before, limit)
+
+        formatted_history = [format_history_item(item) for item in page]
+        logger.info(f"✅ 成功取得 session '{session_id}' 的對話歷史 ({len(formatted_history)}/{total} 條)")
         return {
             "session_id": session_id,
-            "history": formatted_history
+            "history": formatted_history,
+            "total": total,
+            "next_before": next_before,
+            "has_more": next_before is not None
         }
     except HTTPException as http_exc:
         raise http_exc
@@ -797,35 +1485,101 @@ async def get_memory_history(session_id: str):
         logger.error(f"❌ 取得對話歷史失敗 ({session_id}): {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"無法取得對話記錄: {str(e)}")
 
+@app.get("/api/memory/{session_id}/count")
+async def get_memory_count(session_id: str):
+    """取得指定 session 的訊息數（只讀會話索引，不讀訊息內容）"""
+    validate_session_id(session_id)
+    return {"session_id": session_id, "count": await run_blocking(count_history, session_id)}
+
+@app.get("/api/memory/{session_id}/export")
+async def export_memory_history(session_id: str):
+    """
+    以 NDJSON 串流匯出指定 session 的完整對話記錄（依時間順序，每行一則訊息）
+    """
+    validate_session_id(session_id)
+    total = await run_blocking(count_history, session_id)
+    batches = chat_history_store.iter_messages(session_id, batch_size=MEMORY_HISTORY_EXPORT_BATCH)
+
+    async def ndjson_generator():
+        exported = 0
+        while True:
+            batch = await run_blocking(next, batches, None)
+            if batch is None:
+                break
+            exported += len(batch)
+            yield "".join(json.dumps(format_history_item(item), ensure_ascii=False) + "\n" for item in batch)
+        logger.info(f"📤 匯出 session '{session_id}' 的對話歷史 ({exported}/{total} 條)")
+
+    return StreamingResponse(
+        ndjson_generator(),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="{session_id}.ndjson"',
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Total-Count": str(total)
+        }
+    )
+
+def count_history(session_id: str) -> int:
+    """取得會話訊息數（必要時先從歸檔還原），沒有對話記錄時回傳 404"""
+    rehydrate_if_archived(session_id)
+    total = chat_history_store.count(session_id)
+    if total == 0:
+        logger.warning(f"⚠️ 請求記憶體歷史，但 session '{session_id}' 不存在")
+        raise HTTPException(status_code=404, detail="找不到此對話記錄")
+    return total
+
+def format_history_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """將歷史資料庫的訊息轉為 API 格式（不建立 LangChain 訊息物件）"""
+    message = item["message"]
+    msg_type = message.get("type")
+    return {
+        "id": item["id"],
+        "type": "user" if msg_type == "human" else "ai" if msg_type == "ai" else "system",
+        "content": message.get("data", {}).get("content", ""),
+        "created_at": item["created_at"]
+    }
+
 @app.delete("/api/memory/{session_id}")
 async def clear_memory(session_id: str, admin: bool = Depends(verify_admin)):
-    """清除指定 session 的對話記憶 (記憶體與檔案)"""
+    """清除指定 session 的對話記憶 (記憶體與歷史資料庫)"""
+    validate_session_id(session_id)
     try:
         deleted_from_memory = False
-        deleted_from_file = False
+        deleted_from_store = False
 
-        if session_id in memory_store:
+        memory = memory_store.pop(session_id)
+        if memory is not None:
             try:
-                memory_store[session_id].clear()
-                del memory_store[session_id]
+                memory.clear()
                 deleted_from_memory = True
                 logger.info(f"🗑️ 已從記憶體中清除 session: {session_id}")
             except Exception as mem_clear_err:
                  logger.error(f"❌ 清除記憶體中 session '{session_id}' 失敗: {mem_clear_err}")
 
-        history_file = Path(f"chat_history/{session_id}.json")
-        if history_file.exists():
-            try:
-                history_file.unlink()
-                deleted_from_file = True
-                logger.info(f"🗑️ 已刪除對話歷史檔案: {history_file}")
-            except OSError as file_del_err:
-                logger.error(f"❌ 刪除對話歷史檔案 '{history_file}' 失敗: {file_del_err}")
-
-        if deleted_from_memory or deleted_from_file:
-            return {"message": f"✅ 已清除 {session_id} 的對話記憶" + (" (部分失敗，請查看日誌)" if not (deleted_from_memory and deleted_from_file) else "")}
+        try:
+            deleted_count = chat_history_store.delete(session_id)
+            deleted_from_store = deleted_from_memory or deleted_count > 0
+            if deleted_count:
+                logger.info(f"🗑️ 已從歷史資料庫刪除 session '{session_id}' ({deleted_count} 則)")
+        except Exception as store_del_err:
+            logger.error(f"❌ 從歷史資料庫刪除 session '{session_id}' 失敗: {store_del_err}")
+
+        if history_archiver is not None and history_archiver.remove(session_id):
+            deleted_from_store = True
+            logger.info(f"🗑️ 已移除 session '{session_id}' 的歸檔索引")
+
+        # 尚未遷移的舊版 JSON 歷史檔
+        legacy_file = Path(f"chat_history/{session_id}.json")
+        if legacy_file.exists():
+            legacy_file.unlink()
+            deleted_from_store = True
+
+        if deleted_from_memory or deleted_from_store:
+            return {"message": f"✅ 已清除 {session_id} 的對話記憶"}
         else:
-            logger.warning(f"⚠️ 嘗試清除 session '{session_id}'，但記憶體與檔案皆不存在或刪除失敗")
+            logger.warning(f"⚠️ 嘗試清除 session '{session_id}'，但記憶體與歷史資料庫皆不存在")
             raise HTTPException(status_code=404, detail="找不到或無法清除指定的對話記錄")
 
     except HTTPException as http_exc:
@@ -835,6 +1589,18 @@ async def clear_memory(session_id: str, admin: bool = Depends(verify_admin)):
         raise HTTPException(status_code=500, detail=f"清除記憶失敗: {str(e)}")
 
 
+@app.post("/api/memory/archive")
+async def run_history_archive(admin: bool = Depends(verify_admin)):
+    """立即執行一次冷會話歸檔（平時由背景排程每日執行）"""
+    if history_archiver is None:
+        raise HTTPException(status_code=400, detail="未啟用對話歷史歸檔 (HISTORY_ARCHIVE_ENABLED)")
+    try:
+        return await run_blocking(history_archiver.run)
+    except Exception as e:
+        logger.error(f"❌ 對話歷史歸檔失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"歸檔失敗: {str(e)}")
+
+
 @app.get("/api/documents")
 async def list_documents(admin: bool = Depends(verify_admin)):
     """列出知識庫中的所有文檔（排除素材文件）"""
@@ -978,23 +1744,67 @@ async def get_stats():
             "collection_name": COLLECTION_NAME,
             "total_vectors": vector_count,
             "active_memory_sessions": len(memory_store),
-            "total_history_files": len(list(Path("chat_history").glob("*.json"))),
+            "total_history_sessions": chat_history_store.session_count(),
             "framework": "LangChain",
             "llm_model": llm.model,
             "embedding_model": embeddings.model_name,
             "vector_db": "Qdrant",
             "components": {
-                "agents": "✅ ReAct Agent" if agent else "❌ Agent Failed",
-                "memory": "✅ ConversationBufferMemory + FileChatMessageHistory",
-                "rag": "✅ ConversationalRetrievalChain",
+                "agents": "✅ Agent" if "public" in chat_service.agent_runtime.executors else "❌ Agent Failed",
+                "agent_modes": agent_modes,
+                "memory": "✅ TokenBudgetMemory (摘要 + 最近對話) + SQLiteChatMessageHistory",
+                "rag": "✅ RAG v2 (單次 LLM 呼叫)" if lean_rag else "✅ ConversationalRetrievalChain",
                 "tools": len(tools)
-            }
+            },
+            "answer_cache": answer_cache.stats() if answer_cache else {"enabled": False},
+            "intent_router": intent_router.stats() if intent_router else {"enabled": False},
+            "retrieval_prefetch": retrieval_prefetcher.stats() if retrieval_prefetcher else {"enabled": False},
+            "single_flight": single_flight.stats() if single_flight else {"enabled": False},
+            "session_locks": session_manager.stats(),
+            "session_cache": memory_store.stats(),
+            "chat_history_store": chat_history_store.stats(),
+            "history_archive": history_archiver.stats() if history_archiver else {"enabled": False},
+            "memory_summary": memory_summarizer.stats() if memory_summarizer else {"enabled": False},
+            "llm_cassette": llm_cassette.stats() if llm_cassette else {"mode": "off"},
+            "llm_usage": llm_usage.stats(),
+            "llm_hedging": hedge_policy.stats() if hedge_policy else {"enabled": False},
+            "llm_gateway": llm_gateway.stats() if llm_gateway else {"enabled": False},
+            "deadline": deadline_policy.stats(),
+            "admission": admission.stats() if admission else {"enabled": False},
+            "model_router": model_router.stats(),
+            "ws_chat": chat_socket_hub.stats(),
+            "rag_v2": lean_rag.stats() if lean_rag else {"enabled": False}
         }
     except Exception as e:
         logger.error(f"❌ 取得系統統計時發生錯誤: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"無法取得系統統計: {str(e)}")
 
 
+@app.get("/api/admin/llm-usage")
+async def get_llm_usage(
+    days: int = 7,
+    group_by: str = "session_id",
+    limit: int = 20,
+    admin: bool = Depends(verify_admin)
+):
+    """
+    LLM 用量報表（管理員）
+
+    回傳最近 days 天的 token 總計、估算費用，以及依 group_by
+    (session_id/route/role/day/model) 排序的前 limit 名
+    """
+    if group_by not in StaffDatabase.LLM_USAGE_GROUPS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by 只能是 {', '.join(StaffDatabase.LLM_USAGE_GROUPS)}"
+        )
+    try:
+        return await run_blocking(llm_usage.report, days, group_by, max(1, min(limit, 200)))
+    except Exception as e:
+        logger.error(f"❌ 取得 LLM 用量時發生錯誤: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"無法取得 LLM 用量: {str(e)}")
+
+
 # ==================== 訪客計數器 API ====================
 
 @app.post("/api/visitor/increment", response_model=VisitorStatsResponse)
@@ -1038,8 +1848,34 @@ async def get_visitor_stats(month: Optional[str] = None):
 
 
 # --- 啟動與關閉事件保持不變 ---
+async def sweep_idle_sessions():
+    """定期淘汰閒置會話（沒有新請求時也會釋放記憶體）"""
+    while True:
+        await asyncio.sleep(SESSION_CACHE_SWEEP_INTERVAL)
+        try:
+            memory_store.sweep()
+        except Exception as e:
+            logger.error(f"❌ 淘汰閒置會話失敗: {e}")
+
+async def archive_cold_sessions():
+    """定期將閒置會話歸檔"""
+    while True:
+        await asyncio.sleep(HISTORY_ARCHIVE_INTERVAL_HOURS * 3600)
+        try:
+            await run_blocking(history_archiver.run)
+        except Exception as e:
+            logger.error(f"❌ 對話歷史歸檔失敗: {e}", exc_info=True)
+
+session_sweeper: Optional[asyncio.Task] = None
+history_archive_job: Optional[asyncio.Task] = None
+
 @app.on_event("startup")
 async def startup_event():
+    global session_sweeper, history_archive_job
+    install_default_executor()
+    session_sweeper = asyncio.create_task(sweep_idle_sessions())
+    if history_archiver is not None:
+        history_archive_job = asyncio.create_task(archive_cold_sessions())
     Path("chat_history").mkdir(exist_ok=True)
     Path("generated_content").mkdir(exist_ok=True)
     Path("logs").mkdir(exist_ok=True)
@@ -1052,13 +1888,29 @@ async def startup_event():
     logger.info(f"📚 Qdrant 集合: {COLLECTION_NAME}")
     logger.info(f"🧠 LLM 模型: {llm.model}")
     logger.info(f"🔡 Embedding 模型: {embeddings.model_name} (維度: 768)")
-    logger.info(f"🤖 Agent 狀態: {'✅ 已啟用' if agent else '❌ 啟動失敗'}")
+    logger.info(f"🤖 Agent 狀態: {'✅ 已啟用' if 'public' in chat_service.agent_runtime.executors else '❌ 啟動失敗'}")
+    logger.info(f"🧩 Agent 模式: 公眾={agent_modes['public']}, 幕僚={agent_modes['staff']}")
     logger.info(f"🛠️ Agent 工具數量: {len(tools)}")
-    logger.info(f"💾 Memory 類型: ConversationBufferMemory + FileChatMessageHistory")
+    logger.info(f"💾 Memory 類型: TokenBudgetMemory ({MEMORY_MAX_TOKENS} tokens / {MEMORY_MAX_TURNS} 輪) + SQLite ({CHAT_HISTORY_DB})")
+    logger.info(f"🗂️ 常駐會話上限: {SESSION_CACHE_MAX_ENTRIES} 個 / {SESSION_CACHE_MAX_MB} MB, 閒置 {SESSION_CACHE_IDLE_SECONDS}s 淘汰")
     logger.info("="*50)
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    if session_sweeper is not None:
+        session_sweeper.cancel()
+    if history_archive_job is not None:
+        history_archive_job.cancel()
+    for session_id in memory_store:
+        memory = memory_store.get(session_id)
+        if memory is not None:
+            flush_evicted_memory(session_id, memory)
+    chat_history_store.close()
+    if llm_cassette is not None:
+        llm_cassette.close()
+    llm_usage.close()
+    if llm_gateway is not None:
+        llm_gateway.close()
     logger.info("="*50)
     logger.info("⏹ PAIS 系統正在關閉...")
     logger.info("="*50)
@@ -0,0 +1,4 @@
+"""
+維運腳本
+於 rag_service 目錄下以 `python -m scripts.<名稱>` 執行
+"""
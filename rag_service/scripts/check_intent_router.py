@@ -0,0 +1,71 @@
+"""
+意圖路由規則檢查
+以固定案例確認關鍵字規則不會把帶有問題的訊息誤判為招呼、致謝或敏感話題
+（只檢查規則，不載入 Embedding 模型）
+
+使用方式（於 rag_service 目錄下執行，有案例不符時以非零狀態結束）：
+    python -m scripts.check_intent_router
+"""
+
+import sys
+from typing import List, Optional, Tuple
+
+from services.intent_router import (
+    IntentRouter, ROUTE_GREETING, ROUTE_SENSITIVE, ROUTE_THANKS, TEMPLATE_ROUTES
+)
+
+# (訊息, 預期的模板路由)；None 表示應交給 RAG / Agent 回答（factual 或 agent 不在檢查範圍）
+CASES: List[Tuple[str, Optional[str]]] = [
+    ("你好", ROUTE_GREETING),
+    ("嗨！", ROUTE_GREETING),
+    ("Hello", ROUTE_GREETING),
+    ("善寶你好～", ROUTE_GREETING),
+    ("在嗎？", ROUTE_GREETING),
+    ("謝謝", ROUTE_THANKS),
+    ("好的，謝謝！", ROUTE_THANKS),
+    ("Thank you", ROUTE_THANKS),
+    ("辛苦了", ROUTE_THANKS),
+    ("謝謝，那停車費怎麼繳", None),
+    ("hiv篩檢", None),
+    ("晚安市長好", None),
+    ("你好，請問營養午餐有補助嗎", None),
+    ("選舉投票所在哪裡", None),
+    ("我想罷免里長的流程", None),
+    ("如何檢舉貪污", None),
+    ("市府支持哪些青年創業補助", None),
+    ("家門口路面很爛要找誰修", None),
+    ("網路很爛怎麼申訴", None),
+    ("公車服務爛透了要向哪裡申訴", None),
+    ("大型廢物清運怎麼預約", None),
+    ("藍綠色的垃圾桶怎麼分類", None),
+    ("哪個政黨執政時蓋的捷運", None),
+    ("請問要不要選擇線上申辦", None),
+    ("你支持哪個政黨", ROUTE_SENSITIVE),
+    ("下次選舉你會投給誰", ROUTE_SENSITIVE),
+    ("市長會不會選總統", ROUTE_SENSITIVE),
+    ("你對民進黨有什麼看法", ROUTE_SENSITIVE),
+    ("你覺得罷免會成功嗎", ROUTE_SENSITIVE),
+    ("你們是不是貪污", ROUTE_SENSITIVE),
+    ("市長支持哪一黨", ROUTE_SENSITIVE),
+    ("你覺得哪個政黨比較好", ROUTE_SENSITIVE),
+    ("市長是藍綠哪一邊", ROUTE_SENSITIVE),
+    ("市長下次要不要選", ROUTE_SENSITIVE),
+]
+
+
+def main() -> int:
+    router = IntentRouter(embeddings=None)
+    failures = 0
+    for message, expected in CASES:
+        decision = router.classify(message)
+        route = decision.route if decision.route in TEMPLATE_ROUTES else None
+        if route != expected:
+            failures += 1
+        status = "✅" if route == expected else "❌"
+        print(f"{status} {message} -> {decision.route} ({decision.reason})，預期 {expected or '非模板'}")
+    print(f"共 {len(CASES)} 個案例，{failures} 個不符")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
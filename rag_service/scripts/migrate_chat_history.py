@@ -0,0 +1,108 @@
+"""
+對話歷史遷移工具
+將舊版每個會話一個的 JSON 歷史檔（FileChatMessageHistory）與對話摘要檔（*.summary.json）
+匯入 SQLite 歷史資料庫
+
+使用方式（於 rag_service 目錄下執行，可重複執行，已匯入的會話會略過）：
+    python -m scripts.migrate_chat_history --source chat_history --db chat_history/chat_history.db
+    python -m scripts.migrate_chat_history --source chat_history/staff --db chat_history/staff/chat_history.db --archive
+"""
+
+import argparse
+import json
+import shutil
+from pathlib import Path
+from typing import Dict
+
+from langchain_core.messages import messages_from_dict
+from loguru import logger
+
+from utils.chat_history_store import ChatHistoryStore
+
+
+SUMMARY_SUFFIX = ".summary.json"
+
+
+def migrate_summary(summary_file: Path, store: ChatHistoryStore) -> bool:
+    """
+    匯入單一會話的對話摘要檔（資料庫已有摘要時略過）
+
+    Args:
+        summary_file: <session_id>.summary.json
+        store: 目標歷史資料庫
+
+    Returns:
+        是否有匯入
+    """
+    session_id = summary_file.name[:-len(SUMMARY_SUFFIX)]
+    try:
+        return store.import_summary(session_id, json.loads(summary_file.read_text(encoding="utf-8")))
+    except Exception as e:
+        logger.error(f"❌ 無法讀取 {summary_file}: {e}")
+        return False
+
+
+def migrate(source: Path, store: ChatHistoryStore, archive_dir: Path = None) -> Dict[str, int]:
+    """
+    匯入 source 目錄下的 JSON 歷史檔
+
+    Args:
+        source: 歷史檔目錄（不含子目錄）
+        store: 目標歷史資料庫
+        archive_dir: 匯入成功後移動舊檔的目錄，None 表示保留原檔
+
+    Returns:
+        統計: imported / skipped / failed / messages / summaries
+    """
+    result = {"imported": 0, "skipped": 0, "failed": 0, "messages": 0, "summaries": 0}
+    for history_file in sorted(source.glob("*.json")):
+        if history_file.name.endswith(SUMMARY_SUFFIX):
+            if migrate_summary(history_file, store):
+                result["summaries"] += 1
+            if archive_dir is not None:
+                archive_dir.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(history_file), str(archive_dir / history_file.name))
+            continue
+        session_id = history_file.stem
+        try:
+            messages = messages_from_dict(json.loads(history_file.read_text(encoding="utf-8")))
+        except Exception as e:
+            logger.error(f"❌ 無法讀取 {history_file}: {e}")
+            result["failed"] += 1
+            continue
+
+        if store.import_messages(session_id, messages):
+            result["imported"] += 1
+            result["messages"] += len(messages)
+        else:
+            result["skipped"] += 1
+            logger.info(f"⏭️ {session_id} 已存在於資料庫，略過")
+
+        if archive_dir is not None:
+            archive_dir.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(history_file), str(archive_dir / history_file.name))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="將 JSON 對話歷史檔匯入 SQLite")
+    parser.add_argument("--source", default="chat_history", help="JSON 歷史檔目錄")
+    parser.add_argument("--db", default="chat_history/chat_history.db", help="SQLite 歷史資料庫路徑")
+    parser.add_argument("--archive", action="store_true", help="匯入後將舊檔移至 <source>/migrated/")
+    args = parser.parse_args()
+
+    source = Path(args.source)
+    store = ChatHistoryStore(args.db)
+    try:
+        result = migrate(source, store, source / "migrated" if args.archive else None)
+    finally:
+        store.close()
+
+    logger.info(
+        f"✅ 遷移完成: 匯入 {result['imported']} 個會話 ({result['messages']} 則訊息, {result['summaries']} 份摘要), "
+        f"略過 {result['skipped']} 個, 失敗 {result['failed']} 個"
+    )
+
+
+if __name__ == "__main__":
+    main()
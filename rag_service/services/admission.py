@@ -0,0 +1,258 @@
+"""
+請求准入排程模組
+對話與文案生成在呼叫 ChatService / Gemini 之前先取得執行名額：
+不同優先等級嚴格依序，同一等級內依權重公平排隊（WFQ），各類別另有併發上限，
+避免幕僚的長時間工作拖慢市民的回覆
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, AsyncContextManager, AsyncIterator, Deque, Dict, Optional
+
+from loguru import logger
+
+from utils.metrics import (
+    ADMISSION_QUEUE_DEPTH,
+    ADMISSION_REJECTED_TOTAL,
+    ADMISSION_RUNNING,
+    ADMISSION_WAIT_SECONDS,
+    add_stage_time,
+)
+
+
+class AdmissionRejected(RuntimeError):
+    """排隊已滿或等待逾時，請求未被執行"""
+
+    def __init__(self, class_name: str, reason: str):
+        self.class_name = class_name
+        self.reason = reason
+        super().__init__(f"{class_name} 類別請求{'排隊已滿' if reason == 'queue_full' else '等待逾時'}")
+
+
+@dataclass
+class PriorityClass:
+    """
+    優先類別
+
+    Attributes:
+        name: 類別名稱
+        priority: 優先等級（數字越小越優先，不同等級之間嚴格依序）
+        weight: 同一等級內的權重（WFQ）
+        max_concurrency: 類別併發上限（0 表示只受總上限限制）
+    """
+    name: str
+    priority: int = 0
+    weight: float = 1.0
+    max_concurrency: int = 0
+    queue: Deque[asyncio.Future] = field(default_factory=deque, repr=False)
+    running: int = 0
+    finish_tag: float = 0.0
+    counters: Dict[str, float] = field(
+        default_factory=lambda: {"admitted": 0, "queued": 0, "rejected": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0},
+        repr=False
+    )
+
+    def has_capacity(self) -> bool:
+        return self.max_concurrency <= 0 or self.running < self.max_concurrency
+
+
+def parse_priority_classes(spec: str) -> Dict[str, PriorityClass]:
+    """
+    解析類別設定字串
+
+    Args:
+        spec: "名稱:等級:權重:併發上限" 以逗號分隔，例如 "public:0:4:10,staff:1:2:4"
+
+    Returns:
+        類別名稱 -> PriorityClass
+
+    Raises:
+        ValueError: 格式不正確時
+    """
+    classes = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        parts = entry.split(":")
+        if len(parts) != 4:
+            raise ValueError(f"類別設定格式應為 名稱:等級:權重:併發上限，收到 {entry!r}")
+        name, priority, weight, cap = parts
+        if float(weight) <= 0:
+            raise ValueError(f"類別 {name} 的權重必須大於 0")
+        classes[name] = PriorityClass(name, int(priority), float(weight), int(cap))
+    return classes
+
+
+class AdmissionScheduler:
+    """
+    准入排程器（在事件迴圈中使用）
+
+    - 總併發上限 max_concurrency，各類別另有上限
+    - 有空位時先選優先等級最高、且未達上限的類別；同等級以 start-time fair queuing 依權重輪流
+    - 各類別排隊上限 max_queue、等待上限 max_wait 秒，超過時拋出 AdmissionRejected
+
+    Attributes:
+        classes: 類別名稱 -> PriorityClass
+        max_concurrency: 總併發上限
+        max_queue: 各類別排隊上限
+        max_wait: 等待上限（秒）
+        service: 服務名稱（指標標籤）
+    """
+
+    def __init__(
+        self,
+        classes: Dict[str, PriorityClass],
+        max_concurrency: int = 12,
+        max_queue: int = 100,
+        max_wait: float = 30.0,
+        service: str = ""
+    ):
+        self.classes = classes
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.service = service
+        self._running = 0
+        self._vtime = 0.0
+
+        classes_desc = ", ".join(
+            f"{c.name}(P{c.priority}, w={c.weight:g}, 上限 {c.max_concurrency or '-'})" for c in classes.values()
+        )
+        logger.info(f"✅AdmissionScheduler初始化完成 (總上限: {self.max_concurrency}; {classes_desc})")
+
+    @asynccontextmanager
+    async def slot(self, class_name: str) -> AsyncIterator[float]:
+        """
+        取得一個執行名額，區塊結束時歸還
+
+        Args:
+            class_name: 類別名稱
+
+        Yields:
+            排隊等待的秒數
+
+        Raises:
+            KeyError: 類別不存在時
+            AdmissionRejected: 排隊已滿或等待逾時
+        """
+        cls = self.classes[class_name]
+        if len(cls.queue) >= self.max_queue:
+            self._reject(cls, "queue_full")
+
+        started_at = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        cls.queue.append(waiter)
+        self._dispatch()
+        if not waiter.done():
+            cls.counters["queued"] += 1
+            self._update_gauges(cls)
+        try:
+            await asyncio.wait_for(waiter, timeout=self.max_wait)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                self._release(cls)  # 已分配名額但呼叫端已離開
+            else:
+                waiter.cancel()
+                self._discard(cls, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(cls, "timeout")
+            raise
+
+        waited = time.perf_counter() - started_at
+        cls.counters["admitted"] += 1
+        cls.counters["wait_seconds"] += waited
+        cls.counters["max_wait_seconds"] = max(cls.counters["max_wait_seconds"], waited)
+        ADMISSION_WAIT_SECONDS.labels(service=self.service, priority_class=cls.name).observe(waited)
+        add_stage_time("admission", waited)
+        try:
+            yield waited
+        finally:
+            self._release(cls)
+
+    def _reject(self, cls: PriorityClass, reason: str):
+        cls.counters["rejected"] += 1
+        ADMISSION_REJECTED_TOTAL.labels(service=self.service, priority_class=cls.name, reason=reason).inc()
+        logger.warning(f"⚠️ 請求未獲准入 ({cls.name}, {reason})")
+        raise AdmissionRejected(cls.name, reason)
+
+    def _discard(self, cls: PriorityClass, waiter: asyncio.Future):
+        try:
+            cls.queue.remove(waiter)
+        except ValueError:
+            pass
+        self._update_gauges(cls)
+
+    def _pick(self) -> Optional[PriorityClass]:
+        """選出下一個取得名額的類別（沒有可執行的請求時為 None）"""
+        candidates = []
+        for cls in self.classes.values():
+            while cls.queue and cls.queue[0].done():
+                cls.queue.popleft()  # 已取消的等待者
+            if cls.queue and cls.has_capacity():
+                candidates.append(cls)
+        if not candidates:
+            return None
+        top = min(cls.priority for cls in candidates)
+        return min(
+            (cls for cls in candidates if cls.priority == top),
+            key=lambda cls: max(self._vtime, cls.finish_tag)
+        )
+
+    def _dispatch(self):
+        """有空位時依序分配名額"""
+        while self._running < self.max_concurrency:
+            cls = self._pick()
+            if cls is None:
+                return
+            waiter = cls.queue.popleft()
+            start = max(self._vtime, cls.finish_tag)
+            cls.finish_tag = start + 1 / cls.weight
+            self._vtime = start
+            cls.running += 1
+            self._running += 1
+            waiter.set_result(None)
+            self._update_gauges(cls)
+
+    def _release(self, cls: PriorityClass):
+        cls.running -= 1
+        self._running -= 1
+        self._update_gauges(cls)
+        self._dispatch()
+
+    def _update_gauges(self, cls: PriorityClass):
+        ADMISSION_QUEUE_DEPTH.labels(service=self.service, priority_class=cls.name).set(len(cls.queue))
+        ADMISSION_RUNNING.labels(service=self.service, priority_class=cls.name).set(cls.running)
+
+    def stats(self) -> Dict[str, Any]:
+        """取得各類別的排隊深度、執行中數量與等待時間"""
+        classes = {}
+        for cls in self.classes.values():
+            counters = cls.counters
+            admitted = counters["admitted"]
+            classes[cls.name] = {
+                "priority": cls.priority,
+                "weight": cls.weight,
+                "max_concurrency": cls.max_concurrency,
+                "queue_depth": sum(1 for waiter in cls.queue if not waiter.done()),
+                "running": cls.running,
+                "admitted": int(admitted),
+                "queued": int(counters["queued"]),
+                "rejected": int(counters["rejected"]),
+                "avg_wait_ms": round(counters["wait_seconds"] / admitted * 1000, 1) if admitted else 0.0,
+                "max_wait_ms": round(counters["max_wait_seconds"] * 1000, 1),
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": self._running,
+            "max_queue": self.max_queue,
+            "max_wait": self.max_wait,
+            "classes": classes,
+        }
+
+
+def admission_slot(scheduler: Optional[AdmissionScheduler], class_name: str) -> AsyncContextManager:
+    """有排程器時取得名額，否則直接執行"""
+    if scheduler is None:
+        return nullcontext()
+    return scheduler.slot(class_name)
@@ -0,0 +1,201 @@
+"""
+Agent 執行環境模組
+啟動時預先建立各角色的 AgentExecutor，每個請求只綁定自己的對話記憶
+"""
+
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+from langchain.agents import AgentExecutor
+from langchain.memory import ConversationBufferMemory
+from loguru import logger
+
+from utils.deadline import current_deadline
+
+
+# Agent 模式
+AGENT_MODE_REACT = "react"
+AGENT_MODE_FUNCTION_CALLING = "function_calling"
+AGENT_MODES = (AGENT_MODE_REACT, AGENT_MODE_FUNCTION_CALLING)
+
+
+class DeadlineAgentExecutor(AgentExecutor):
+    """
+    每一步之前檢查目前請求的剩餘時間的 AgentExecutor
+
+    期限由 utils.deadline.deadline_scope 以 ContextVar 傳入，共用的 Executor
+    不需要為每個請求調整 max_execution_time；時間不足時提前停止並標記 deadline.exhausted
+    """
+
+    # 事件與追蹤中的名稱維持 AgentExecutor（串流以此辨識 Agent 結束事件）
+    name: Optional[str] = "AgentExecutor"
+
+    def _should_continue(self, iterations: int, time_elapsed: float) -> bool:
+        if not super()._should_continue(iterations, time_elapsed):
+            return False
+        deadline = current_deadline()
+        return deadline is None or deadline.allows_step(iterations, time_elapsed)
+
+
+class AgentRuntime:
+    """
+    可重複使用的 Agent 執行環境
+
+    AgentExecutor 本身不持有記憶，對話歷史在每次呼叫時以
+    `chat_history` 輸入傳入，因此同一個 Executor 可以安全地被
+    多個併發請求共用。
+
+    Attributes:
+        tools: Agent 可用的工具列表（或角色 -> 工具列表）
+        modes: 角色 -> Agent 模式 ("react" 或 "function_calling")
+        executors: 角色 -> AgentExecutor 的對應表
+    """
+
+    def __init__(
+        self,
+        tools: Union[list, Dict[str, list]],
+        agents: Dict[str, Any],
+        max_iterations: int = 5,
+        modes: Optional[Dict[str, str]] = None
+    ):
+        """
+        初始化 Agent 執行環境
+
+        Args:
+            tools: Agent 工具列表；各角色工具不同時傳入 角色 -> 工具列表
+            agents: 角色 -> Agent 的對應表 (例如 {"public": agent, "staff": staff_agent})
+            max_iterations: 每次請求的最大推理步數
+            modes: 角色 -> Agent 模式，未指定的角色視為 ReAct
+        """
+        self.tools = tools
+        self.modes: Dict[str, str] = dict(modes or {})
+        self.executors: Dict[str, AgentExecutor] = {}
+
+        for role, agent in agents.items():
+            if agent is None:
+                logger.warning(f"⚠️ 角色 '{role}' 的 Agent 未初始化，略過建立 Executor")
+                continue
+            role_tools = tools.get(role, []) if isinstance(tools, dict) else tools
+            self.modes.setdefault(role, AGENT_MODE_REACT)
+            self.executors[role] = DeadlineAgentExecutor(
+                agent=agent,
+                tools=role_tools,
+                verbose=True,
+                max_iterations=max_iterations,
+                handle_parsing_errors=True,
+                return_intermediate_steps=True
+            )
+
+        roles_desc = ", ".join(f"{role}={self.modes[role]}" for role in self.executors)
+        logger.info(f"✅AgentRuntime初始化完成 (角色: {roles_desc or '無'})")
+
+    def get_executor(self, role: str) -> AgentExecutor:
+        """
+        取得角色對應的 AgentExecutor
+
+        Args:
+            role: 角色 ("public" 或 "staff")
+
+        Returns:
+            AgentExecutor 實例
+
+        Raises:
+            ValueError: 當對應的 Agent 未初始化時
+        """
+        executor = self.executors.get(role)
+        if executor is None:
+            if role == "staff":
+                raise ValueError("幕僚系統 Agent 元件未初始化")
+            raise ValueError("系統 Agent 元件未初始化")
+        return executor
+
+    def get_mode(self, role: str) -> str:
+        """
+        取得角色使用的 Agent 模式
+
+        Args:
+            role: 角色 ("public" 或 "staff")
+
+        Returns:
+            "react" 或 "function_calling"
+        """
+        return self.modes.get(role, AGENT_MODE_REACT)
+
+    @staticmethod
+    def build_inputs(
+        message: str,
+        memory: Optional[ConversationBufferMemory]
+    ) -> Dict[str, Any]:
+        """
+        組合 Agent 輸入，從記憶中載入對話歷史
+
+        Args:
+            message: 用戶訊息
+            memory: 對話記憶（None 表示無狀態請求）
+
+        Returns:
+            Agent 輸入字典
+        """
+        chat_history: List[Any] = []
+        if memory is not None:
+            chat_history = memory.load_memory_variables({}).get(memory.memory_key, [])
+        return {"input": message, "chat_history": chat_history}
+
+    async def ainvoke(
+        self,
+        role: str,
+        message: str,
+        memory: Optional[ConversationBufferMemory],
+        config: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        以非同步方式執行 Agent
+
+        Args:
+            role: 角色
+            message: 用戶訊息
+            memory: 對話記憶（只讀取，不寫入）
+            config: LangChain RunnableConfig（例如 callbacks）
+
+        Returns:
+            AgentExecutor 輸出（包含 output 與 intermediate_steps）
+        """
+        executor = self.get_executor(role)
+        return await executor.ainvoke(self.build_inputs(message, memory), config=config)
+
+    def astream_events(
+        self,
+        role: str,
+        message: str,
+        memory: Optional[ConversationBufferMemory]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        以事件串流方式執行 Agent
+
+        Args:
+            role: 角色
+            message: 用戶訊息
+            memory: 對話記憶（只讀取，不寫入）
+
+        Returns:
+            LangChain astream_events (v1) 事件迭代器
+        """
+        executor = self.get_executor(role)
+        return executor.astream_events(self.build_inputs(message, memory), version="v1")
+
+    @staticmethod
+    def save_turn(
+        memory: Optional[ConversationBufferMemory],
+        message: str,
+        reply: str
+    ):
+        """
+        將本輪對話寫入記憶
+
+        Args:
+            memory: 對話記憶
+            message: 用戶訊息
+            reply: 最終回覆
+        """
+        if memory is None:
+            return
+        memory.save_context({"input": message}, {memory.output_key or "output": reply})
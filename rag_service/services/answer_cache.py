@@ -0,0 +1,233 @@
+"""
+回答快取模組
+公眾問答的雙層快取：正規化問題的精確比對 + m3e 向量的語意比對
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from utils.text_utils import normalize_question
+
+
+@dataclass
+class CacheEntry:
+    """快取項目"""
+    key: str
+    mode: str
+    response: Dict[str, Any]
+    embedding: Optional[np.ndarray]
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class AnswerCache:
+    """
+    公眾問答回答快取
+
+    - 精確層：以正規化後的問題為鍵
+    - 語意層：以 m3e 查詢向量計算餘弦相似度，超過門檻即視為同一問題
+    - 項目具有 TTL，超過容量時以 LRU 淘汰
+    - 知識庫更新時呼叫 invalidate() 清空；進行中的請求若在清空前開始，
+      其結果不會被寫回快取（以 generation 判斷）
+
+    Attributes:
+        embeddings: LangChain Embeddings 實例（None 時僅啟用精確層）
+        max_entries: 最大項目數
+        ttl_seconds: 項目存活秒數
+        similarity_threshold: 語意層命中門檻
+    """
+
+    def __init__(
+        self,
+        embeddings=None,
+        max_entries: int = 512,
+        ttl_seconds: int = 3600,
+        similarity_threshold: float = 0.92
+    ):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+
+        self._entries: "OrderedDict[Tuple[str, str], CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+
+        self._counters = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+        logger.info(
+            f"✅AnswerCache初始化完成 (容量: {max_entries}, TTL: {ttl_seconds}s, "
+            f"語意門檻: {similarity_threshold})"
+        )
+
+    def lookup(
+        self,
+        message: str,
+        mode: str = "agent",
+        embedding: Optional[np.ndarray] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[np.ndarray]]:
+        """
+        查詢快取（同步，可能計算 embedding，請於執行緒池中呼叫）
+
+        Args:
+            message: 使用者問題
+            mode: 對話模式 ("agent" 或 "rag")，不同模式的回答分開快取
+            embedding: 已計算好的正規化查詢向量（例如意圖路由的結果），可省去重算
+
+        Returns:
+            (命中的回覆字典或 None, 查詢向量或 None)
+            查詢向量可在未命中時傳回 store() 重複使用
+        """
+        key = normalize_question(message)
+        if not key:
+            return None, None
+
+        with self._lock:
+            entry = self._entries.get((mode, key))
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end((mode, key))
+                self._counters["exact_hits"] += 1
+                logger.info(f"🎯 回答快取命中 (精確): {key}")
+                return self._hit_response(entry, "exact"), None
+
+        if self.embeddings is None:
+            with self._lock:
+                self._counters["misses"] += 1
+            return None, None
+
+        if embedding is None:
+            embedding = self._embed(message)
+
+        with self._lock:
+            best_entry, best_score = None, 0.0
+            for entry_key, entry in list(self._entries.items()):
+                if self._expired(entry):
+                    del self._entries[entry_key]
+                    self._counters["expirations"] += 1
+                    continue
+                if entry.mode != mode or entry.embedding is None:
+                    continue
+                score = float(np.dot(entry.embedding, embedding))
+                if score > best_score:
+                    best_entry, best_score = entry, score
+
+            if best_entry is not None and best_score >= self.similarity_threshold:
+                self._entries.move_to_end((best_entry.mode, best_entry.key))
+                self._counters["semantic_hits"] += 1
+                logger.info(
+                    f"🎯 回答快取命中 (語意 {best_score:.3f}): {key} ≈ {best_entry.key}"
+                )
+                return self._hit_response(best_entry, "semantic"), embedding
+
+            self._counters["misses"] += 1
+            return None, embedding
+
+    def store(
+        self,
+        message: str,
+        response: Dict[str, Any],
+        mode: str = "agent",
+        embedding: Optional[np.ndarray] = None,
+        generation: Optional[int] = None
+    ) -> bool:
+        """
+        寫入快取
+
+        Args:
+            message: 使用者問題
+            response: 回覆字典（reply、sources 等）
+            mode: 對話模式
+            embedding: lookup() 回傳的查詢向量
+            generation: 請求開始時的 generation；若期間快取已失效則不寫入
+
+        Returns:
+            是否成功寫入
+        """
+        key = normalize_question(message)
+        if not key:
+            return False
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                logger.debug(f"⏭️ 知識庫已更新，略過寫入過期回答: {key}")
+                return False
+
+            self._entries[(mode, key)] = CacheEntry(
+                key=key,
+                mode=mode,
+                response={
+                    "reply": response.get("reply", ""),
+                    "sources": list(response.get("sources") or []),
+                },
+                embedding=embedding
+            )
+            self._entries.move_to_end((mode, key))
+            self._counters["stores"] += 1
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+        return True
+
+    def invalidate(self, reason: str = ""):
+        """
+        清空所有快取（知識庫內容變更時呼叫）
+
+        Args:
+            reason: 失效原因（記錄用）
+        """
+        with self._lock:
+            cleared = len(self._entries)
+            self._entries.clear()
+            self.generation += 1
+            self._counters["invalidations"] += 1
+        logger.info(f"🧹 回答快取已清空 ({cleared} 筆) - 原因: {reason or '未指定'}")
+
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+        lookups = counters["exact_hits"] + counters["semantic_hits"] + counters["misses"]
+        hits = counters["exact_hits"] + counters["semantic_hits"]
+        return {
+            **counters,
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "similarity_threshold": self.similarity_threshold,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        """檢查項目是否過期"""
+        return time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def _embed(self, message: str) -> np.ndarray:
+        """計算正規化後的查詢向量"""
+        vector = np.asarray(self.embeddings.embed_query(message), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _hit_response(entry: CacheEntry, tier: str) -> Dict[str, Any]:
+        """組合命中時回傳的內容"""
+        return {
+            "reply": entry.response["reply"],
+            "sources": list(entry.response["sources"]),
+            "cache_tier": tier,
+        }
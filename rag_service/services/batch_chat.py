@@ -0,0 +1,193 @@
+"""
+批次問答模組
+一次送入多個問題（知識庫更新後的回歸測試、FAQ 大量產生），
+以有上限的併發透過 ChatService 處理，完成一題就回傳一題；
+同一批次內的知識庫檢索結果共用快取
+"""
+
+import asyncio
+import contextvars
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from langchain.memory import ConversationBufferMemory
+from loguru import logger
+
+from services.admission import admission_slot
+from utils.deadline import DEGRADATION_NONE
+from utils.latency_stats import summarize_latencies
+from utils.retrieval_cache import RetrievalMemo, use_retrieval_memo
+
+# 目前批次項目的追蹤資訊（由 ContextVar 傳到工具）
+_current_item: contextvars.ContextVar[Optional["BatchItemTrace"]] = contextvars.ContextVar(
+    "batch_chat_item", default=None
+)
+
+
+@dataclass
+class BatchItemTrace:
+    """單一批次項目的追蹤資訊"""
+    tool_calls: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def record_tool_use(tool: str, tool_input: str):
+    """
+    記錄批次項目使用的工具（不在批次中時不做事）
+
+    Args:
+        tool: 工具名稱
+        tool_input: 工具輸入
+    """
+    item = _current_item.get()
+    if item is not None:
+        item.tool_calls.append({"tool": tool, "input": tool_input})
+
+
+class BatchChatRunner:
+    """
+    批次問答執行器
+
+    - 以 Semaphore 限制同時處理的題數
+    - 未指定 session_id 的題目使用不寫入歷史的暫時記憶，互不影響
+    - 指定 session_id 的題目走一般的會話記憶與會話鎖（同一會話依序處理）
+
+    Attributes:
+        chat_service: ChatService 實例
+        get_memory: 取得會話記憶的非同步函數（必要時先從歸檔還原）
+        session_manager: SessionManager 實例
+        max_concurrency: 併發上限
+        admission: 准入排程器（每題以 batch 類別取得執行名額，None 表示不排程）
+    """
+
+    def __init__(
+        self,
+        chat_service,
+        get_memory: Callable[[str], Awaitable[ConversationBufferMemory]],
+        session_manager,
+        max_concurrency: int = 4,
+        admission=None
+    ):
+        self.chat_service = chat_service
+        self.get_memory = get_memory
+        self.session_manager = session_manager
+        self.max_concurrency = max_concurrency
+        self.admission = admission
+
+        logger.info(f"✅BatchChatRunner初始化完成 (併發上限: {max_concurrency})")
+
+    async def run(
+        self,
+        items: List[Dict[str, Any]],
+        role: str = "public",
+        use_agent: bool = True,
+        concurrency: Optional[int] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        執行批次問答，依完成順序逐題產出結果，最後產出一筆 summary
+
+        Args:
+            items: [{"message": str, "session_id": Optional[str]}, ...]
+            role: 角色
+            use_agent: 是否使用 Agent 模式
+            concurrency: 本批次的併發數（不超過 max_concurrency）
+
+        Yields:
+            {"type": "result", ...} 或最後的 {"type": "summary", ...}
+        """
+        limit = max(1, min(concurrency or self.max_concurrency, self.max_concurrency))
+        semaphore = asyncio.Semaphore(limit)
+        memo = RetrievalMemo()
+        started_at = time.perf_counter()
+        logger.info(f"📦 開始批次問答: {len(items)} 題 (併發: {limit}, 角色: {role})")
+
+        async def run_item(index: int, item: Dict[str, Any]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._run_item(index, item, role, use_agent, memo)
+
+        tasks = [asyncio.create_task(run_item(i, item)) for i, item in enumerate(items)]
+        latencies = []
+        errors = 0
+        degraded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                latencies.append(result["latency_ms"])
+                errors += 1 if result.get("error") else 0
+                degraded += 1 if result["degradation"] != DEGRADATION_NONE else 0
+                yield result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        elapsed = time.perf_counter() - started_at
+        summary = {
+            "type": "summary",
+            "total": len(items),
+            "errors": errors,
+            "degraded": degraded,
+            "concurrency": limit,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "throughput_qps": round(len(items) / elapsed, 3) if elapsed > 0 else 0.0,
+            "latency": summarize_latencies(latencies),
+            "retrieval_cache": memo.stats(),
+        }
+        logger.info(
+            f"📦 批次問答完成: {len(items)} 題, 錯誤 {errors} 題, {summary['elapsed_ms']:.0f} ms "
+            f"(檢索快取命中 {memo.hits}/{memo.hits + memo.misses})"
+        )
+        yield summary
+
+    async def _run_item(
+        self,
+        index: int,
+        item: Dict[str, Any],
+        role: str,
+        use_agent: bool,
+        memo: RetrievalMemo
+    ) -> Dict[str, Any]:
+        """處理單一題目（在獨立的 Task 與 contextvars 中執行）"""
+        trace = BatchItemTrace()
+        _current_item.set(trace)
+        use_retrieval_memo(memo)
+
+        message = item["message"]
+        session_id = item.get("session_id")
+        started_at = time.perf_counter()
+        try:
+            # 批次題目的優先順序低於即時對話
+            async with admission_slot(self.admission, "batch"):
+                if session_id:
+                    async with self.session_manager.lock(session_id):
+                        result = await self.chat_service.process_chat(
+                            message=message,
+                            session_id=session_id,
+                            memory=await self.get_memory(session_id),
+                            use_agent=use_agent,
+                            role=role
+                        )
+                else:
+                    result = await self.chat_service.process_chat(
+                        message=message,
+                        session_id=f"batch-{index}",
+                        memory=ConversationBufferMemory(memory_key="chat_history", return_messages=True),
+                        use_agent=use_agent,
+                        role=role
+                    )
+        except Exception as e:
+            logger.error(f"❌ 批次第 {index} 題處理失敗: {e}", exc_info=True)
+            result = {"reply": "", "sources": [], "error": True, "thought_process": str(e)}
+
+        return {
+            "type": "result",
+            "index": index,
+            "message": message,
+            "session_id": session_id,
+            "reply": result.get("reply", ""),
+            "sources": result.get("sources", []),
+            "latency_ms": round((time.perf_counter() - started_at) * 1000, 1),
+            "tool_calls": trace.tool_calls,
+            "thought_process": result.get("thought_process"),
+            "error": bool(result.get("error")),
+            "degradation": result.get("degradation", DEGRADATION_NONE),
+        }
@@ -3,13 +3,54 @@
 負責處理所有對話相關的業務邏輯
 """
 
-from typing import Dict, List, Optional, Any, Tuple
+import asyncio
+import time
+from contextlib import nullcontext
+from functools import partial
+from typing import Dict, List, Optional, Any, Tuple, AsyncIterator, Union
 from datetime import datetime
-from langchain.agents import AgentExecutor
 from langchain.chains import ConversationalRetrievalChain
 from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import BaseMessage, get_buffer_string
 from loguru import logger
 
+from utils.concurrency import run_blocking, SingleFlight
+from utils.deadline import (
+    DeadlinePolicy, DEGRADATION_NONE, DEGRADATION_RAG, DEGRADATION_EXTRACTIVE,
+    current_deadline, deadline_scope, iter_until_deadline
+)
+from utils.metrics import observe_agent_iterations
+from utils.retrieval_cache import memoized_retrieval
+from utils.stream_parser import FinalAnswerStreamParser
+from utils.text_utils import extract_key_sentences, looks_like_followup, normalize_question
+from .agent_runtime import AgentRuntime, AGENT_MODE_FUNCTION_CALLING
+from .answer_cache import AnswerCache
+from .lean_rag import LeanRAG, LeanRetrieval, FOLLOWUP_HISTORY_WINDOW
+from .intent_router import (
+    IntentRouter, RouteDecision, ROUTE_AGENT, ROUTE_FACTUAL, TEMPLATE_ROUTES
+)
+from .model_router import ModelRouter, TASK_CONDENSE, TASK_FINAL_ANSWER, TASK_SHORT_REPLY
+from .retrieval_prefetch import RetrievalPrefetcher
+
+
+# Agent 工具名稱 -> 回傳給前端的來源名稱
+# (Function Calling 模式的工具名稱須為英文，對外仍顯示原本的中文名稱)
+KNOWLEDGE_TOOL_SOURCES = {
+    "搜尋知識庫": "搜尋知識庫",
+    "查詢特定政策名稱": "查詢特定政策名稱",
+    "search_knowledge_base": "搜尋知識庫",
+    "get_policy_info": "查詢特定政策名稱",
+}
+
+# AgentExecutor 達到步數或時間上限時回傳的固定輸出（不是 Agent 的回答）
+AGENT_STOPPED_OUTPUT = "Agent stopped due to"
+# 回覆中出現即表示仍夾帶 ReAct 思考過程
+REACT_MARKERS = ("Thought:", "Action:", "Observation:")
+
+# 擷取式回答使用的段落數與每段摘錄長度
+EXTRACTIVE_TOP_K = 3
+EXTRACTIVE_CHARS_PER_DOC = 160
+
 
 class ChatService:
     """
@@ -19,20 +60,36 @@ class ChatService:
     Attributes:
         llm: LangChain LLM 實例
         vectorstore: 向量資料庫實例
-        tools: Agent 可用的工具列表
+        tools: Agent 可用的工具列表（或角色 -> 工具列表）
         agent: 公眾版 Agent (善寶)
         staff_agent: 幕僚版 Agent (校稿助理)
         rag_prompt: RAG Chain 使用的 Prompt
+        agent_runtime: 預先建立的各角色 AgentExecutor
+        answer_cache: 公眾問答回答快取
+        intent_router: 公眾問答意圖路由器
+        retrieval_prefetcher: 公眾 Agent 的知識庫預先檢索器
+        single_flight: 相同問題併發請求的合併器
+        deadline_policy: 各角色的請求期限（逾時前降級為單次 RAG 或擷取式回答）
+        model_router: 依任務類型選擇 lite / full 模型的路由器
+        lean_rag: use_agent=false 的精簡 RAG 檢索器（None 時使用 ConversationalRetrievalChain）
     """
 
     def __init__(
         self,
         llm,
         vectorstore,
-        tools: list,
+        tools: Union[list, Dict[str, list]],
         agent=None,
         staff_agent=None,
-        rag_prompt=None
+        rag_prompt=None,
+        answer_cache: Optional[AnswerCache] = None,
+        intent_router: Optional[IntentRouter] = None,
+        agent_modes: Optional[Dict[str, str]] = None,
+        retrieval_prefetcher: Optional[RetrievalPrefetcher] = None,
+        single_flight: Optional[SingleFlight] = None,
+        deadline_policy: Optional[DeadlinePolicy] = None,
+        model_router: Optional[ModelRouter] = None,
+        lean_rag: Optional[LeanRAG] = None
     ):
         """
         初始化聊天服務
@@ -40,10 +97,18 @@ class ChatService:
         Args:
             llm: LangChain LLM 實例
             vectorstore: Qdrant 向量資料庫
-            tools: Agent 工具列表
+            tools: Agent 工具列表；各角色工具不同時傳入 角色 -> 工具列表
             agent: 公眾版 Agent
             staff_agent: 幕僚版 Agent
             rag_prompt: RAG Prompt 模板
+            answer_cache: 公眾問答回答快取（None 表示停用）
+            intent_router: 公眾問答意圖路由器（None 表示一律使用 Agent）
+            agent_modes: 角色 -> Agent 模式 ("react" 或 "function_calling")
+            retrieval_prefetcher: 知識庫預先檢索器（None 表示停用）
+            single_flight: 請求合併器（None 表示停用）
+            deadline_policy: 請求期限設定（None 表示不限時）
+            model_router: 模型分級路由器（None 表示一律使用 llm）
+            lean_rag: 精簡 RAG 檢索器（None 表示 RAG 模式使用 ConversationalRetrievalChain）
         """
         self.llm = llm
         self.vectorstore = vectorstore
@@ -51,6 +116,18 @@ class ChatService:
         self.agent = agent
         self.staff_agent = staff_agent
         self.rag_prompt = rag_prompt
+        self.answer_cache = answer_cache
+        self.intent_router = intent_router
+        self.retrieval_prefetcher = retrieval_prefetcher
+        self.single_flight = single_flight
+        self.deadline_policy = deadline_policy
+        self.model_router = model_router
+        self.lean_rag = lean_rag
+        self.agent_runtime = AgentRuntime(
+            tools=tools,
+            agents={"public": agent, "staff": staff_agent},
+            modes=agent_modes
+        )
 
         logger.info("✅ChatService初始化完成")
 
@@ -79,7 +156,8 @@ class ChatService:
                 "sources": List[str],
                 "session_id": str,
                 "timestamp": str,
-                "thought_process": Optional[str]
+                "thought_process": Optional[str],
+                "degradation": str  # 降級層級 none/rag/extractive（未降級時可能省略）
             }
 
         Raises:
@@ -87,15 +165,68 @@ class ChatService:
         """
         logger.info(f"💬 [{session_id}] 收到問題 (角色: {role}): {message}")
 
+        started_at = time.perf_counter()
+        deadline = self.deadline_policy.start(role) if self.deadline_policy else None
+
         try:
-            if use_agent:
-                return await self._handle_agent_mode(
-                    message, session_id, memory, role
+            # 公眾問答先判斷意圖，招呼與敏感話題直接以模板回覆
+            decision = await self._route(message, role, use_agent)
+            if decision is not None and decision.route in TEMPLATE_ROUTES:
+                result = self._build_template_response(
+                    decision, message, session_id, memory
+                )
+                self._record_route(decision.route, session_id, started_at)
+                return result
+
+            # 再查回答快取
+            cache_mode = "agent" if use_agent else "rag"
+            cache_embedding = decision.embedding if decision else None
+            cache_generation = None
+            use_cache = self._is_cacheable(message, memory, role)
+            if use_cache:
+                cache_generation = self.answer_cache.generation
+                cached, cache_embedding = await run_blocking(
+                    self.answer_cache.lookup, message, cache_mode, cache_embedding
                 )
+                if cached is not None:
+                    result = self._build_cached_response(
+                        cached, message, session_id, memory, cache_mode
+                    )
+                    if decision is not None:
+                        self._record_route("cache", session_id, started_at)
+                    return result
+
+            # 相同問題的併發請求共用同一次執行
+            shared = False
+            if self.single_flight is not None and self._is_shareable(message, memory, role):
+                flight_key = (role, cache_mode, normalize_question(message))
+                result, shared = await self.single_flight.do(
+                    flight_key,
+                    lambda: self._dispatch(decision, message, session_id, memory, use_agent, role, deadline)
+                )
+                if shared:
+                    result = self._adopt_shared_result(
+                        result, message, session_id, memory, cache_mode
+                    )
             else:
-                return await self._handle_rag_mode(
-                    message, session_id, memory
+                result = await self._dispatch(
+                    decision, message, session_id, memory, use_agent, role, deadline
+                )
+
+            if decision is not None:
+                self._record_route(decision.route, session_id, started_at)
+
+            # 後備回覆或未通過品質檢查的回覆只回給本次請求，不寫入快取
+            result = dict(result)
+            reply_ok = result.pop("reply_ok", True)
+            degraded = result.get("degradation", DEGRADATION_NONE) != DEGRADATION_NONE
+            if use_cache and not shared and reply_ok and not result.get("error") and not degraded:
+                self.answer_cache.store(
+                    message, result, cache_mode,
+                    embedding=cache_embedding, generation=cache_generation
                 )
+
+            return result
         except Exception as e:
             logger.error(
                 f"❌ 對話處理失敗 ({session_id}): {str(e)}",
@@ -105,6 +236,51 @@ class ChatService:
                 session_id, role, error=e
             )
 
+    async def _dispatch(
+        self,
+        decision: Optional[RouteDecision],
+        message: str,
+        session_id: str,
+        memory: ConversationBufferMemory,
+        use_agent: bool,
+        role: str,
+        deadline=None
+    ) -> Dict[str, Any]:
+        """
+        依路由與模式執行對應的處理流程
+
+        單次 RAG 與 RAG Chain 超過期限或 LLM 呼叫失敗時改用擷取式回答；
+        Agent 模式的降級在 _handle_agent_mode 中處理
+
+        Args:
+            decision: 路由判斷結果（未啟用路由時為 None）
+            message: 用戶訊息
+            session_id: 會話 ID
+            memory: 對話記憶
+            use_agent: 是否使用 Agent 模式
+            role: 角色
+            deadline: 本次請求的期限（None 表示不限時）
+
+        Returns:
+            對話結果字典
+        """
+        with deadline_scope(deadline):
+            if use_agent and not (decision is not None and decision.route == ROUTE_FACTUAL):
+                return await self._handle_agent_mode(message, session_id, memory, role)
+            try:
+                if use_agent:
+                    return await self._within_deadline(
+                        self._handle_quick_rag(message, session_id, memory, role)
+                    )
+                return await self._within_deadline(
+                    self._handle_rag_mode(message, session_id, memory, role)
+                )
+            except Exception as e:
+                logger.error(f"❌ [{session_id}] RAG 執行失敗: {type(e).__name__}: {e}")
+                return await self._handle_extractive(
+                    message, session_id, memory, role, self._degradation_reason(e)
+                )
+
     async def _handle_agent_mode(
         self,
         message: str,
@@ -129,63 +305,53 @@ class ChatService:
         """
         memory.output_key = "output"
 
-        # 根據角色選擇 Agent
-        if role == "staff":
-            if not self.staff_agent:
-                logger.error(
-                    f"❌ Staff Agent 未初始化，無法處理幕僚請求 ({session_id})"
-                )
-                raise ValueError("幕僚系統 Agent 元件未初始化")
-            current_agent = self.staff_agent
-            logger.info(f"🎭 [{session_id}] 使用幕僚助理模式")
-        else:
-            if not self.agent:
-                logger.error(
-                    f"❌ Agent 未初始化，無法處理公眾請求 ({session_id})"
-                )
-                raise ValueError("系統 Agent 元件未初始化")
-            current_agent = self.agent
-            logger.info(f"🎭 [{session_id}] 使用善寶模式")
+        self._log_agent_role(role, session_id)
 
-        # 創建 AgentExecutor
-        agent_executor = AgentExecutor(
-            agent=current_agent,
-            tools=self.tools,
-            memory=memory,
-            verbose=True,
-            max_iterations=5,
-            handle_parsing_errors=True
-        )
+        deadline = current_deadline()
+        if deadline is not None and not deadline.allows_step():
+            return await self._degrade(
+                message, session_id, memory, role,
+                f"剩餘 {deadline.remaining():.1f}s，不足以執行 Agent"
+            )
 
-        # 執行 Agent
+        # 執行 Agent（共用預建的 Executor，只綁定本次請求的記憶）
         logger.info(f"🚀 [{session_id}] 開始執行 Agent...")
         try:
-            result = agent_executor.invoke({"input": message})
-            raw_output = result.get("output", "")
+            with self._prefetch_scope(message, role):
+                result = await self._within_deadline(
+                    self.agent_runtime.ainvoke(role, message, memory)
+                )
+            observe_agent_iterations(role, self.agent_runtime.get_mode(role), result)
+
+            # 每一步之前都會檢查剩餘時間，不足時 Agent 提前停止
+            if deadline is not None and deadline.exhausted:
+                steps = len(result.get("intermediate_steps") or [])
+                return await self._degrade(
+                    message, session_id, memory, role,
+                    f"Agent 執行 {steps} 步後剩餘時間不足"
+                )
+
+            raw_output = self._coerce_output(result.get("output", ""))
 
             # 調試：記錄原始輸出
             logger.debug(f"📝 [{session_id}] Raw output: {raw_output[:500]}...")
 
-            # 提取 Final Answer
-            reply = self._extract_final_answer(raw_output)
+            # 提取並驗證最終回覆
+            reply, reply_ok = self._finalize_agent_reply(raw_output, role, session_id)
 
-            # 調試：記錄提取結果
-            logger.debug(f"✂️ [{session_id}] Extracted reply: {reply[:200] if reply else '(empty)'}")
-
-            # 驗證回覆品質
-            if not self._is_valid_reply(reply, raw_output):
-                logger.warning(
-                    f"⚠️ Final Answer 品質不佳 ({session_id})"
-                )
-                reply = self._get_fallback_reply(raw_output, role)
+            # 寫入本輪對話
+            self.agent_runtime.save_turn(memory, message, reply)
 
             # 提取來源
             sources = self._extract_agent_sources(result)
 
             # 構建思考過程字符串（用於調試）
-            thought_process = self._build_thought_process(
-                raw_output, result
-            )
+            if self.agent_runtime.get_mode(role) == AGENT_MODE_FUNCTION_CALLING:
+                thought_process = self._build_tool_call_trace(result)
+            else:
+                thought_process = self._build_thought_process(
+                    raw_output, result
+                )
 
             logger.info(
                 f"✅ [{session_id}] Agent 執行完成 (回覆長度: {len(reply)})"
@@ -196,28 +362,370 @@ class ChatService:
                 "sources": sources,
                 "session_id": session_id,
                 "timestamp": datetime.now().isoformat(),
-                "thought_process": thought_process
+                "thought_process": thought_process,
+                "reply_ok": reply_ok
             }
 
         except Exception as e:
             logger.error(
-                f"❌ AgentExecutor 執行失敗 ({session_id}): {str(e)}",
-                exc_info=True
+                f"❌ AgentExecutor 執行失敗 ({session_id}): {type(e).__name__}: {str(e)}",
+                exc_info=not isinstance(e, asyncio.TimeoutError)
             )
-            return self._build_error_response(
-                session_id, role, error=e, include_error_detail=True
+            return await self._handle_extractive(
+                message, session_id, memory, role, self._degradation_reason(e)
             )
 
-    async def _handle_rag_mode(
+    async def stream_chat(
         self,
         message: str,
         session_id: str,
+        memory: ConversationBufferMemory,
+        role: str = "public"
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        以串流方式執行 Agent，逐步產生事件
+
+        ReAct 模式只有 Agent 輸出 `Final Answer:` 之後的文字會以 token 事件送出；
+        Function Calling 模式則送出不含工具呼叫的模型文字。
+        工具執行期間送出 progress 事件讓前端顯示進度。
+
+        Args:
+            message: 用戶訊息
+            session_id: 會話 ID
+            memory: 對話記憶
+            role: 角色 ("public" 或 "staff")
+
+        Yields:
+            事件字典 {"event": "progress" | "token" | "done", "data": {...}}
+            done 事件包含完整回覆與 ttft_ms（首個 token 延遲），降級時另含 degradation
+        """
+        logger.info(f"💬 [{session_id}] 收到串流問題 (角色: {role}): {message}")
+
+        started_at = time.perf_counter()
+        deadline = self.deadline_policy.start(role) if self.deadline_policy else None
+        first_token_at: Optional[float] = None
+        parser = FinalAnswerStreamParser()
+        streamed_answer = False
+        raw_output = ""
+        sources: List[str] = []
+
+        def elapsed_ms(since: float) -> int:
+            return int((time.perf_counter() - since) * 1000)
+
+        try:
+            decision = await self._route(message, role, True)
+            if decision is not None and decision.route in TEMPLATE_ROUTES:
+                result = self._build_template_response(
+                    decision, message, session_id, memory
+                )
+                self._record_route(decision.route, session_id, started_at)
+                ttft_ms = elapsed_ms(started_at)
+                yield {"event": "token", "data": {"text": result["reply"]}}
+                yield {
+                    "event": "done",
+                    "data": {**result, "ttft_ms": ttft_ms, "total_ms": ttft_ms}
+                }
+                return
+
+            cache_embedding = decision.embedding if decision else None
+            cache_generation = None
+            use_cache = self._is_cacheable(message, memory, role)
+            if use_cache:
+                cache_generation = self.answer_cache.generation
+                cached, cache_embedding = await run_blocking(
+                    self.answer_cache.lookup, message, "agent", cache_embedding
+                )
+                if cached is not None:
+                    result = self._build_cached_response(
+                        cached, message, session_id, memory, "agent"
+                    )
+                    if decision is not None:
+                        self._record_route("cache", session_id, started_at)
+                    ttft_ms = elapsed_ms(started_at)
+                    yield {"event": "token", "data": {"text": result["reply"]}}
+                    yield {
+                        "event": "done",
+                        "data": {**result, "ttft_ms": ttft_ms, "total_ms": ttft_ms}
+                    }
+                    return
+
+            if decision is not None and decision.route == ROUTE_FACTUAL:
+                # 單次 RAG：直接串流 LLM 輸出，沒有 ReAct 標記需要過濾
+                yield {"event": "progress", "data": {"stage": "retrieving"}}
+                prompt_text, sources = await self._prepare_quick_rag(message, memory)
+                reply = ""
+                try:
+                    async for chunk in iter_until_deadline(
+                        self._llm_for(TASK_SHORT_REPLY, prompt_text).astream(prompt_text), deadline, lambda: not reply
+                    ):
+                        if not chunk:
+                            continue
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        reply += chunk
+                        yield {"event": "token", "data": {"text": chunk}}
+                except Exception as e:
+                    # 已開始輸出回覆時不再降級，交給外層錯誤處理
+                    if reply:
+                        raise
+                    logger.error(f"❌ [{session_id}] 單次 RAG 串流失敗: {type(e).__name__}: {e}")
+                    degraded = await self._handle_extractive(
+                        message, session_id, memory, role, self._degradation_reason(e)
+                    )
+                    for event in self._degraded_events(degraded, started_at):
+                        yield event
+                    return
+
+                reply = reply.strip()
+                reply_ok = bool(reply)
+                if not reply_ok:
+                    reply = self._get_fallback_reply("", role)
+                memory.output_key = "output"
+                self.agent_runtime.save_turn(memory, message, reply)
+                self._record_route(decision.route, session_id, started_at)
+
+                if use_cache and reply_ok:
+                    self.answer_cache.store(
+                        message, {"reply": reply, "sources": sources}, "agent",
+                        embedding=cache_embedding, generation=cache_generation
+                    )
+
+                ttft_ms = int((first_token_at - started_at) * 1000) if first_token_at else None
+                yield {
+                    "event": "done",
+                    "data": {
+                        "reply": reply,
+                        "sources": sources,
+                        "session_id": session_id,
+                        "timestamp": datetime.now().isoformat(),
+                        "ttft_ms": ttft_ms,
+                        "total_ms": elapsed_ms(started_at)
+                    }
+                }
+                return
+
+            memory.output_key = "output"
+            self._log_agent_role(role, session_id)
+            function_calling = self.agent_runtime.get_mode(role) == AGENT_MODE_FUNCTION_CALLING
+
+            if deadline is not None and not deadline.allows_step():
+                with deadline_scope(deadline):
+                    degraded = await self._degrade(
+                        message, session_id, memory, role,
+                        f"剩餘 {deadline.remaining():.1f}s，不足以執行 Agent"
+                    )
+                for event in self._degraded_events(degraded, started_at):
+                    yield event
+                return
+
+            yield {"event": "progress", "data": {"stage": "thinking"}}
+
+            degraded = None
+            try:
+                with self._prefetch_scope(message, role), deadline_scope(deadline):
+                    # 尚未輸出回覆前，等待下一個事件超過剩餘時間即視為逾時
+                    events = iter_until_deadline(
+                        self.agent_runtime.astream_events(role, message, memory),
+                        deadline,
+                        enforce=lambda: not (parser.has_answer or streamed_answer)
+                    )
+                    async for event in events:
+                        kind = event["event"]
+
+                        if kind == "on_llm_start":
+                            parser.start_generation()
+
+                        elif kind == "on_llm_stream":
+                            chunk = event["data"].get("chunk")
+                            text = chunk if isinstance(chunk, str) else getattr(chunk, "text", "")
+                            visible = parser.feed(text)
+                            if visible:
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                yield {"event": "token", "data": {"text": visible}}
+
+                        elif kind == "on_llm_end":
+                            visible = parser.finish()
+                            if visible:
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                yield {"event": "token", "data": {"text": visible}}
+
+                        elif kind == "on_chat_model_stream" and function_calling:
+                            # 工具呼叫的片段不顯示，只送出回覆文字
+                            chunk = event["data"].get("chunk")
+                            if chunk is None or getattr(chunk, "tool_call_chunks", None):
+                                continue
+                            visible = self._coerce_output(chunk.content)
+                            if visible:
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                streamed_answer = True
+                                yield {"event": "token", "data": {"text": visible}}
+
+                        elif kind == "on_tool_start":
+                            tool_name = event.get("name", "")
+                            yield {
+                                "event": "progress",
+                                "data": {"stage": "tool_start", "tool": tool_name}
+                            }
+
+                        elif kind == "on_tool_end":
+                            yield {
+                                "event": "progress",
+                                "data": {"stage": "tool_end", "tool": event.get("name", "")}
+                            }
+
+                        elif kind == "on_chain_end" and event.get("name") == "AgentExecutor":
+                            output = event["data"].get("output") or {}
+                            if isinstance(output, dict):
+                                raw_output = self._coerce_output(output.get("output", ""))
+                                sources = self._extract_agent_sources(output)
+                                observe_agent_iterations(role, self.agent_runtime.get_mode(role), output)
+            except Exception as e:
+                # 已開始輸出回覆時不再降級，交給外層錯誤處理
+                if parser.has_answer or streamed_answer:
+                    raise
+                logger.error(f"❌ [{session_id}] 串流 Agent 執行失敗: {type(e).__name__}: {e}")
+                degraded = await self._handle_extractive(
+                    message, session_id, memory, role, self._degradation_reason(e)
+                )
+            else:
+                if deadline is not None and deadline.exhausted and not (parser.has_answer or streamed_answer):
+                    with deadline_scope(deadline):
+                        degraded = await self._degrade(
+                            message, session_id, memory, role, "Agent 執行中剩餘時間不足"
+                        )
+
+            if degraded is not None:
+                for event in self._degraded_events(degraded, started_at):
+                    yield event
+                return
+
+            # 與非串流模式相同的品質檢查，確保最終回覆一致
+            reply, reply_ok = self._finalize_agent_reply(raw_output, role, session_id)
+
+            self.agent_runtime.save_turn(memory, message, reply)
+
+            # 沒有串流出任何回覆文字時（無 Final Answer 標記或使用後備回覆），一次補送完整回覆
+            if not (parser.has_answer or streamed_answer) and reply:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                yield {"event": "token", "data": {"text": reply}}
+
+            if decision is not None:
+                self._record_route(decision.route, session_id, started_at)
+
+            if use_cache and reply_ok:
+                self.answer_cache.store(
+                    message, {"reply": reply, "sources": sources}, "agent",
+                    embedding=cache_embedding, generation=cache_generation
+                )
+
+            ttft_ms = int((first_token_at - started_at) * 1000) if first_token_at else None
+            logger.info(
+                f"✅ [{session_id}] 串流 Agent 執行完成 "
+                f"(TTFT: {ttft_ms} ms, 總耗時: {elapsed_ms(started_at)} ms)"
+            )
+
+            yield {
+                "event": "done",
+                "data": {
+                    "reply": reply,
+                    "sources": sources,
+                    "session_id": session_id,
+                    "timestamp": datetime.now().isoformat(),
+                    "ttft_ms": ttft_ms,
+                    "total_ms": elapsed_ms(started_at)
+                }
+            }
+
+        except Exception as e:
+            logger.error(
+                f"❌ 串流對話處理失敗 ({session_id}): {str(e)}",
+                exc_info=True
+            )
+            error_response = self._build_error_response(session_id, role, error=e)
+            ttft_ms = int((first_token_at - started_at) * 1000) if first_token_at else None
+            yield {
+                "event": "done",
+                "data": {
+                    **error_response,
+                    "ttft_ms": ttft_ms,
+                    "total_ms": elapsed_ms(started_at)
+                }
+            }
+
+    async def _route(
+        self,
+        message: str,
+        role: str,
+        use_agent: bool
+    ) -> Optional[RouteDecision]:
+        """
+        以意圖路由器判斷處理路徑（僅公眾 Agent 模式）
+
+        Args:
+            message: 用戶訊息
+            role: 角色
+            use_agent: 是否使用 Agent 模式
+
+        Returns:
+            RouteDecision，未啟用路由時為 None
+        """
+        if self.intent_router is None or role != "public" or not use_agent:
+            return None
+        try:
+            decision = await run_blocking(self.intent_router.classify, message)
+        except Exception as e:
+            logger.warning(f"⚠️ 意圖路由失敗，改用 Agent: {e}")
+            return None
+        logger.info(f"🧭 路由判斷: {decision.route} ({decision.reason})")
+        return decision
+
+    def _prefetch_scope(self, message: str, role: str):
+        """
+        公眾 Agent 請求開始預先檢索，讓第一次工具呼叫可以直接取用結果
+
+        Args:
+            message: 用戶訊息
+            role: 角色
+
+        Returns:
+            預先檢索的 context manager（未啟用時為空的 context）
+        """
+        if self.retrieval_prefetcher is None or role != "public":
+            return nullcontext()
+        return self.retrieval_prefetcher.scope(message)
+
+    def _record_route(self, route: str, session_id: str, started_at: float):
+        """
+        記錄路由耗時與相較 Agent 路徑節省的時間
+
+        Args:
+            route: 路由名稱
+            session_id: 會話 ID
+            started_at: 請求開始時間 (perf_counter)
+        """
+        latency_ms = (time.perf_counter() - started_at) * 1000
+        saved_ms = self.intent_router.record(route, latency_ms)
+        logger.info(
+            f"🧭 [{session_id}] 路由 {route} 耗時 {latency_ms:.0f} ms"
+            + (f"，預估節省 {saved_ms:.0f} ms" if route != ROUTE_AGENT else "")
+        )
+
+    def _build_template_response(
+        self,
+        decision: RouteDecision,
+        message: str,
+        session_id: str,
         memory: ConversationBufferMemory
     ) -> Dict[str, Any]:
         """
-        處理 RAG Chain 模式的對話
+        以模板組合回覆（招呼、致謝、敏感話題），並寫入會話記憶
 
         Args:
+            decision: 路由判斷結果
             message: 用戶訊息
             session_id: 會話 ID
             memory: 對話記憶
@@ -225,11 +733,297 @@ class ChatService:
         Returns:
             對話結果字典
         """
+        reply = self.intent_router.template_reply(decision.route)
+        memory.output_key = "output"
+        self.agent_runtime.save_turn(memory, message, reply)
+
+        return {
+            "reply": reply,
+            "sources": [],
+            "session_id": session_id,
+            "timestamp": datetime.now().isoformat(),
+            "thought_process": f"意圖路由: {decision.route} ({decision.reason})，使用模板回覆。"
+        }
+
+    def _is_cacheable(
+        self,
+        message: str,
+        memory: ConversationBufferMemory,
+        role: str
+    ) -> bool:
+        """
+        判斷本次請求是否可使用回答快取
+
+        只快取公眾問答；已有對話歷史且訊息像是追問時，
+        回答依賴前文，不適合共用。
+
+        Args:
+            message: 用戶訊息
+            memory: 對話記憶
+            role: 角色
+
+        Returns:
+            是否使用快取
+        """
+        if self.answer_cache is None or role != "public":
+            return False
+        if not normalize_question(message):
+            return False
+        return not self._has_history(memory) or not looks_like_followup(message)
+
+    def _is_shareable(
+        self,
+        message: str,
+        memory: ConversationBufferMemory,
+        role: str
+    ) -> bool:
+        """
+        判斷是否可與進行中的相同問題合併執行
+
+        只合併沒有對話歷史的公眾請求（無狀態），回答不會受個人前文影響
+
+        Args:
+            message: 用戶訊息
+            memory: 對話記憶
+            role: 角色
+
+        Returns:
+            是否可合併
+        """
+        if role != "public" or not normalize_question(message):
+            return False
+        return not self._has_history(memory)
+
+    @staticmethod
+    def _has_history(memory: ConversationBufferMemory) -> bool:
+        """
+        判斷會話是否已有對話歷史
+
+        對話歷史支援 get_recent_messages（SQLite）時只查詢訊息數，不讀取完整歷史
+        """
+        chat_memory = memory.chat_memory
+        if hasattr(chat_memory, "get_recent_messages"):
+            total, _ = chat_memory.get_recent_messages(0)
+            return total > 0
+        return bool(chat_memory.messages)
+
+    @staticmethod
+    def _recent_messages(memory: ConversationBufferMemory, limit: int) -> List[BaseMessage]:
+        """
+        取得最近 limit 則訊息
+
+        對話歷史支援 get_recent_messages（SQLite）時只讀取這幾則，不載入完整歷史
+        """
+        chat_memory = memory.chat_memory
+        if hasattr(chat_memory, "get_recent_messages"):
+            _, messages = chat_memory.get_recent_messages(limit)
+            return messages
+        return list(chat_memory.messages[-limit:])
+
+    def _adopt_shared_result(
+        self,
+        shared_result: Dict[str, Any],
+        message: str,
+        session_id: str,
+        memory: ConversationBufferMemory,
+        mode: str
+    ) -> Dict[str, Any]:
+        """
+        採用其他請求的執行結果，並寫入本次會話記憶
+
+        Args:
+            shared_result: 共用的執行結果
+            message: 用戶訊息
+            session_id: 會話 ID
+            memory: 對話記憶
+            mode: 對話模式 ("agent" 或 "rag")
+
+        Returns:
+            對話結果字典
+        """
+        if not shared_result.get("error"):
+            memory.output_key = "output" if mode == "agent" else "answer"
+            self.agent_runtime.save_turn(memory, message, shared_result["reply"])
+
+        logger.info(f"🔗 [{session_id}] 與進行中的相同問題合併執行")
+
+        return {
+            **shared_result,
+            "sources": list(shared_result.get("sources") or []),
+            "session_id": session_id,
+            "timestamp": datetime.now().isoformat()
+        }
+
+    def _build_cached_response(
+        self,
+        cached: Dict[str, Any],
+        message: str,
+        session_id: str,
+        memory: ConversationBufferMemory,
+        mode: str
+    ) -> Dict[str, Any]:
+        """
+        以快取內容組合回覆，並寫入本次會話記憶
+
+        Args:
+            cached: 快取命中的內容
+            message: 用戶訊息
+            session_id: 會話 ID
+            memory: 對話記憶
+            mode: 對話模式 ("agent" 或 "rag")
+
+        Returns:
+            對話結果字典
+        """
+        memory.output_key = "output" if mode == "agent" else "answer"
+        self.agent_runtime.save_turn(memory, message, cached["reply"])
+
+        logger.info(f"⚡ [{session_id}] 使用快取回答 ({cached['cache_tier']})")
+
+        return {
+            "reply": cached["reply"],
+            "sources": cached["sources"],
+            "session_id": session_id,
+            "timestamp": datetime.now().isoformat(),
+            "thought_process": f"命中回答快取 ({cached['cache_tier']})，未執行 Agent。"
+        }
+
+    def _log_agent_role(self, role: str, session_id: str):
+        """
+        記錄本次請求使用的 Agent 角色
+
+        Args:
+            role: 角色 ("public" 或 "staff")
+            session_id: 會話 ID
+
+        Raises:
+            ValueError: 當對應的 Agent 未初始化時
+        """
+        try:
+            self.agent_runtime.get_executor(role)
+        except ValueError:
+            if role == "staff":
+                logger.error(
+                    f"❌ Staff Agent 未初始化，無法處理幕僚請求 ({session_id})"
+                )
+            else:
+                logger.error(
+                    f"❌ Agent 未初始化，無法處理公眾請求 ({session_id})"
+                )
+            raise
+
+        if role == "staff":
+            logger.info(f"🎭 [{session_id}] 使用幕僚助理模式")
+        else:
+            logger.info(f"🎭 [{session_id}] 使用善寶模式")
+
+    async def _handle_quick_rag(
+        self,
+        message: str,
+        session_id: str,
+        memory: ConversationBufferMemory,
+        role: str = "public"
+    ) -> Dict[str, Any]:
+        """
+        單次 RAG：檢索後只呼叫一次 LLM（意圖路由判定為單純查詢、或 Agent 時間不足時使用）
+
+        Args:
+            message: 用戶訊息
+            session_id: 會話 ID
+            memory: 對話記憶
+            role: 角色
+
+        Returns:
+            對話結果字典
+        """
+        prompt_text, sources = await self._prepare_quick_rag(message, memory)
+
+        logger.info(f"🚀 [{session_id}] 開始執行單次 RAG...")
+        reply = (await self._llm_for(TASK_SHORT_REPLY, prompt_text).ainvoke(prompt_text)).strip()
+        logger.info(f"✅ [{session_id}] 單次 RAG 執行完成 (回覆長度: {len(reply)})")
+
+        reply_ok = bool(reply)
+        if not reply_ok:
+            reply = self._get_fallback_reply("", role)
+
+        memory.output_key = "output"
+        self.agent_runtime.save_turn(memory, message, reply)
+
+        return {
+            "reply": reply,
+            "sources": sources,
+            "session_id": session_id,
+            "timestamp": datetime.now().isoformat(),
+            "thought_process": "意圖路由: factual，使用單次 RAG，無 ReAct 思考過程。",
+            "reply_ok": reply_ok
+        }
+
+    def _llm_for(self, task: str, text: str = ""):
+        """取得任務使用的 LLM（有模型路由器時依任務類型與輸入長度選擇等級）"""
+        if self.model_router is None:
+            return self.llm
+        return self.model_router.llm_for(task, text)
+
+    async def _prepare_quick_rag(
+        self,
+        message: str,
+        memory: ConversationBufferMemory
+    ) -> Tuple[str, List[str]]:
+        """
+        檢索知識庫並組合單次 RAG 的 Prompt
+
+        Args:
+            message: 用戶訊息
+            memory: 對話記憶
+
+        Returns:
+            (Prompt 文字, 來源檔名列表)
+        """
+        docs = await run_blocking(
+            memoized_retrieval,
+            ("similarity", message, 3),
+            partial(self.vectorstore.similarity_search, message, 3)
+        )
+        context = "\n\n".join(doc.page_content for doc in docs) or "（知識庫中沒有相關資料）"
+        history = memory.load_memory_variables({}).get(memory.memory_key, [])
+        chat_history = get_buffer_string(history) if isinstance(history, list) else history
+
+        prompt_text = self.rag_prompt.format(
+            context=context,
+            chat_history=chat_history,
+            question=message
+        )
+        sources = self._extract_rag_sources({"source_documents": docs})
+        return prompt_text, sources
+
+    async def _handle_rag_mode(
+        self,
+        message: str,
+        session_id: str,
+        memory: ConversationBufferMemory,
+        role: str = "public"
+    ) -> Dict[str, Any]:
+        """
+        處理 RAG 模式的對話（有精簡 RAG 時使用 v2 流程）
+
+        Args:
+            message: 用戶訊息
+            session_id: 會話 ID
+            memory: 對話記憶
+            role: 角色
+
+        Returns:
+            對話結果字典
+        """
+        if self.lean_rag is not None:
+            return await self._handle_lean_rag(message, session_id, memory, role)
+
         memory.output_key = "answer"
 
         # 創建 RAG Chain
         qa_chain = ConversationalRetrievalChain.from_llm(
-            llm=self.llm,
+            llm=self._llm_for(TASK_FINAL_ANSWER),
+            condense_question_llm=self._llm_for(TASK_CONDENSE),
             retriever=self.vectorstore.as_retriever(search_kwargs={"k": 3}),
             memory=memory,
             combine_docs_chain_kwargs={"prompt": self.rag_prompt},
@@ -239,11 +1033,11 @@ class ChatService:
 
         # 執行 RAG Chain
         logger.info(f"🚀 [{session_id}] 開始執行 RAG Chain...")
-        result = qa_chain.invoke({"question": message})
+        result = await qa_chain.ainvoke({"question": message})
         logger.info(f"✅ [{session_id}] RAG Chain 執行完成")
 
         # 提取回覆和來源
-        reply = result.get("answer", "抱歉，我無法回答這個問題。")
+        reply = result.get("answer") or "抱歉，我無法回答這個問題。"
         sources = self._extract_rag_sources(result)
 
         return {
@@ -251,8 +1045,313 @@ class ChatService:
             "sources": sources,
             "session_id": session_id,
             "timestamp": datetime.now().isoformat(),
-            "thought_process": "使用 RAG Chain 模式，無 ReAct 思考過程。"
+            "thought_process": "使用 RAG Chain 模式，無 ReAct 思考過程。",
+            "reply_ok": bool(result.get("answer"))
+        }
+
+    async def _handle_lean_rag(
+        self,
+        message: str,
+        session_id: str,
+        memory: ConversationBufferMemory,
+        role: str = "public"
+    ) -> Dict[str, Any]:
+        """
+        精簡 RAG (v2)：不經 LLM 改寫問題，依分數門檻檢索後只呼叫一次 LLM
+
+        Args:
+            message: 用戶訊息
+            session_id: 會話 ID
+            memory: 對話記憶
+            role: 角色
+
+        Returns:
+            對話結果字典
+        """
+        def retrieve() -> LeanRetrieval:
+            return self.lean_rag.retrieve(message, self._recent_messages(memory, FOLLOWUP_HISTORY_WINDOW))
+
+        retrieval = await run_blocking(retrieve)
+        context = "\n\n".join(doc.page_content for doc in retrieval.docs) or "（知識庫中沒有相關資料）"
+        history = memory.load_memory_variables({}).get(memory.memory_key, [])
+        chat_history = get_buffer_string(history) if isinstance(history, list) else history
+        prompt_text = self.rag_prompt.format(context=context, chat_history=chat_history, question=message)
+
+        logger.info(
+            f"🚀 [{session_id}] 開始執行 RAG v2 (追問判斷: {retrieval.followup}, "
+            f"段落: {len(retrieval.docs)}/{len(retrieval.docs) + retrieval.dropped})"
+        )
+        reply = (await self._llm_for(TASK_FINAL_ANSWER, prompt_text).ainvoke(prompt_text)).strip()
+        logger.info(f"✅ [{session_id}] RAG v2 執行完成 (回覆長度: {len(reply)})")
+
+        reply_ok = bool(reply)
+        if not reply_ok:
+            reply = self._get_fallback_reply("", role)
+
+        memory.output_key = "output"
+        self.agent_runtime.save_turn(memory, message, reply)
+
+        return {
+            "reply": reply,
+            "sources": self._extract_rag_sources({"source_documents": retrieval.docs}),
+            "session_id": session_id,
+            "timestamp": datetime.now().isoformat(),
+            "thought_process": (
+                f"使用 RAG v2 模式（單次 LLM 呼叫，追問判斷: {retrieval.followup}，"
+                f"檢索查詢: {retrieval.query}），無 ReAct 思考過程。"
+            ),
+            "reply_ok": reply_ok
+        }
+
+    async def _within_deadline(self, awaitable):
+        """
+        在目前請求的剩餘時間內等待結果
+
+        Args:
+            awaitable: 要等待的 coroutine
+
+        Returns:
+            awaitable 的結果
+
+        Raises:
+            asyncio.TimeoutError: 超過期限時
+        """
+        deadline = current_deadline()
+        if deadline is None:
+            return await awaitable
+        return await asyncio.wait_for(awaitable, timeout=deadline.remaining())
+
+    @staticmethod
+    def _degradation_reason(error: Exception) -> str:
+        """將例外轉為降級原因說明"""
+        if isinstance(error, asyncio.TimeoutError):
+            return "超過請求期限"
+        return f"LLM 無法使用 ({type(error).__name__})"
+
+    async def _degrade(
+        self,
+        message: str,
+        session_id: str,
+        memory: ConversationBufferMemory,
+        role: str,
+        reason: str
+    ) -> Dict[str, Any]:
+        """
+        Agent 時間不足時的降級：剩餘時間足夠時改用單次 RAG，否則使用擷取式回答
+
+        Args:
+            message: 用戶訊息
+            session_id: 會話 ID
+            memory: 對話記憶
+            role: 角色
+            reason: 降級原因
+
+        Returns:
+            對話結果字典（包含 degradation）
+        """
+        deadline = current_deadline()
+        if deadline is None or deadline.allows_rag():
+            logger.warning(f"⏱️ [{session_id}] {reason}，改用單次 RAG")
+            try:
+                result = await self._within_deadline(
+                    self._handle_quick_rag(message, session_id, memory, role)
+                )
+                return self._mark_degraded(result, role, DEGRADATION_RAG, reason)
+            except Exception as e:
+                logger.error(f"❌ [{session_id}] 單次 RAG 降級失敗: {type(e).__name__}: {e}")
+                reason = f"{reason}；單次 RAG {self._degradation_reason(e)}"
+
+        return await self._handle_extractive(message, session_id, memory, role, reason)
+
+    async def _handle_extractive(
+        self,
+        message: str,
+        session_id: str,
+        memory: ConversationBufferMemory,
+        role: str,
+        reason: str
+    ) -> Dict[str, Any]:
+        """
+        擷取式回答：不呼叫 LLM，直接摘錄最相關的知識庫段落
+        （LLM 無法使用或已超過期限時使用）
+
+        Args:
+            message: 用戶訊息
+            session_id: 會話 ID
+            memory: 對話記憶
+            role: 角色
+            reason: 降級原因
+
+        Returns:
+            對話結果字典（包含 degradation）；檢索也失敗時回傳錯誤響應
+        """
+        logger.warning(f"⏱️ [{session_id}] {reason}，改用擷取式回答")
+        try:
+            docs = await run_blocking(
+                memoized_retrieval,
+                ("similarity", message, EXTRACTIVE_TOP_K),
+                partial(self.vectorstore.similarity_search, message, EXTRACTIVE_TOP_K)
+            )
+        except Exception as e:
+            logger.error(f"❌ [{session_id}] 擷取式回答檢索失敗: {e}", exc_info=True)
+            return self._build_error_response(
+                session_id, role, error=e, include_error_detail=True
+            )
+
+        reply = self._build_extractive_reply(message, docs, role)
+        memory.output_key = "output"
+        self.agent_runtime.save_turn(memory, message, reply)
+
+        result = {
+            "reply": reply,
+            "sources": self._extract_rag_sources({"source_documents": docs}),
+            "session_id": session_id,
+            "timestamp": datetime.now().isoformat()
         }
+        return self._mark_degraded(result, role, DEGRADATION_EXTRACTIVE, reason)
+
+    def _build_extractive_reply(self, message: str, docs: List[Any], role: str) -> str:
+        """
+        以檢索到的段落組合擷取式回答（每段只取與問題最相關的句子）
+
+        Args:
+            message: 用戶訊息
+            docs: 檢索到的文件
+            role: 角色
+
+        Returns:
+            回覆文字
+        """
+        excerpts = []
+        for doc in docs:
+            excerpt = extract_key_sentences(doc.page_content, message, EXTRACTIVE_CHARS_PER_DOC)
+            if excerpt and excerpt not in excerpts:
+                excerpts.append(excerpt)
+        if not excerpts:
+            return self._get_fallback_reply("", role)
+
+        if role == "staff":
+            header = "系統目前忙碌，以下為知識庫中最相關的資料摘錄："
+        else:
+            header = "善寶現在有點忙，先幫您整理知識庫裡最相關的資料："
+        lines = [f"{i}. {excerpt}" for i, excerpt in enumerate(excerpts, 1)]
+        return "\n\n".join([header, *lines])
+
+    def _mark_degraded(
+        self,
+        result: Dict[str, Any],
+        role: str,
+        tier: str,
+        reason: str
+    ) -> Dict[str, Any]:
+        """
+        標記結果的降級層級並記錄統計
+
+        Args:
+            result: 對話結果字典
+            role: 角色
+            tier: 降級層級 (rag/extractive)
+            reason: 降級原因
+
+        Returns:
+            同一個結果字典
+        """
+        description = "改用單次 RAG" if tier == DEGRADATION_RAG else "直接摘錄知識庫內容，未呼叫 LLM"
+        result.pop("reply_ok", None)  # 降級結果一律不寫入快取
+        result["degradation"] = tier
+        result["thought_process"] = f"降級 ({tier}): {reason}，{description}。"
+        if self.deadline_policy is not None:
+            self.deadline_policy.record(role, tier)
+        return result
+
+    @staticmethod
+    def _degraded_events(result: Dict[str, Any], started_at: float) -> List[Dict[str, Any]]:
+        """
+        將降級結果轉為串流事件（一次送出完整回覆）
+
+        Args:
+            result: 對話結果字典
+            started_at: 請求開始時間 (perf_counter)
+
+        Returns:
+            token 與 done 事件
+        """
+        elapsed_ms = int((time.perf_counter() - started_at) * 1000)
+        return [
+            {"event": "token", "data": {"text": result["reply"]}},
+            {"event": "done", "data": {**result, "ttft_ms": elapsed_ms, "total_ms": elapsed_ms}}
+        ]
+
+    def _finalize_agent_reply(
+        self,
+        raw_output: str,
+        role: str,
+        session_id: str
+    ) -> Tuple[str, bool]:
+        """
+        從 Agent 輸出取得最終回覆，品質不佳時改用後備回覆
+
+        Function Calling 模式的輸出即為回覆本身，不需要解析 Final Answer 標記。
+        AgentExecutor 正常結束時的輸出已去除 Final Answer 標記；達到步數上限的固定輸出、
+        或仍夾帶思考過程的原始 LLM 輸出只回給本次請求，不視為有效回覆
+
+        Args:
+            raw_output: Agent 原始輸出
+            role: 角色
+            session_id: 會話 ID
+
+        Returns:
+            (最終回覆, 是否為可快取的有效回覆；後備回覆或原始 LLM 輸出時為 False)
+        """
+        if raw_output.lstrip().startswith(AGENT_STOPPED_OUTPUT):
+            logger.warning(f"⚠️ Agent 達到步數或時間上限，未產生回答 ({session_id})")
+            return self._get_fallback_reply("", role), False
+
+        if self.agent_runtime.get_mode(role) == AGENT_MODE_FUNCTION_CALLING:
+            reply = raw_output.strip()
+            if reply:
+                return reply, True
+            logger.warning(f"⚠️ Function Calling Agent 未產生回覆 ({session_id})")
+            return self._get_fallback_reply("", role), False
+
+        # 提取 Final Answer
+        reply = self._extract_final_answer(raw_output)
+
+        # 調試：記錄提取結果
+        logger.debug(f"✂️ [{session_id}] Extracted reply: {reply[:200] if reply else '(empty)'}")
+
+        # 驗證回覆品質
+        if not self._is_valid_reply(reply, raw_output):
+            logger.warning(f"⚠️ Final Answer 品質不佳 ({session_id})")
+            return self._get_fallback_reply(raw_output, role), False
+
+        # 從原始 LLM 輸出擷取（仍帶有 ReAct 標記）的回覆可以回給用戶，但不寫入快取
+        return reply, not any(marker in raw_output for marker in REACT_MARKERS)
+
+    @staticmethod
+    def _coerce_output(output: Any) -> str:
+        """
+        將 Agent / 聊天模型輸出轉為字串
+
+        Gemini 聊天模型的 content 可能是多段內容的列表
+
+        Args:
+            output: 原始輸出
+
+        Returns:
+            文字內容
+        """
+        if isinstance(output, str):
+            return output
+        if isinstance(output, list):
+            parts = []
+            for part in output:
+                if isinstance(part, str):
+                    parts.append(part)
+                elif isinstance(part, dict) and part.get("type", "text") == "text":
+                    parts.append(part.get("text", ""))
+            return "".join(parts)
+        return str(output) if output else ""
 
     def _extract_final_answer(self, raw_output: str) -> str:
         """
@@ -286,9 +1385,9 @@ class ChatService:
             return answer
 
         # 如果沒有 Final Answer 標記，直接使用原始輸出
-        # 只要內容長度合理就接受
+        # （AgentExecutor 正常結束時的輸出已去除標記）只要內容長度合理就接受
         if len(raw_output.strip()) > 10:
-            logger.warning(f"⚠️ 沒有找到 Final Answer 標記，使用原始輸出")
+            logger.debug("📝 輸出沒有 Final Answer 標記，直接使用")
             return raw_output.lstrip()
 
         logger.error(f"❌ 無法從輸出中提取有效回答")
@@ -359,8 +1458,8 @@ class ChatService:
             tool_name = getattr(action, 'tool', '未知工具')
 
             # 只記錄知識庫相關工具
-            if tool_name in ["搜尋知識庫", "查詢特定政策名稱"]:
-                sources.append(tool_name)
+            if tool_name in KNOWLEDGE_TOOL_SOURCES:
+                sources.append(KNOWLEDGE_TOOL_SOURCES[tool_name])
 
         logger.info(
             f"📚 從 Agent 中間步驟提取到 {len(sources)} 個工具使用記錄"
@@ -413,6 +1512,33 @@ class ChatService:
 
         return "Agent 未成功產生輸出。"
 
+    def _build_tool_call_trace(self, result: Dict[str, Any]) -> str:
+        """
+        構建 Function Calling 模式的工具呼叫紀錄（用於調試）
+
+        Args:
+            result: 執行結果
+
+        Returns:
+            工具呼叫紀錄字符串（限制長度）
+        """
+        steps = result.get("intermediate_steps") or []
+        if not steps:
+            return "Function Calling 模式，未呼叫工具。"
+
+        lines = []
+        for action, observation in steps:
+            tool_name = getattr(action, "tool", "未知工具")
+            tool_input = getattr(action, "tool_input", "")
+            lines.append(f"Tool Call: {tool_name}({tool_input})")
+            lines.append(f"Observation: {str(observation)[:300]}")
+        trace = "\n".join(lines)
+
+        max_length = 2000
+        if len(trace) > max_length:
+            return trace[:max_length] + "..."
+        return trace
+
     def _build_error_response(
         self,
         session_id: str,
@@ -453,5 +1579,6 @@ class ChatService:
             "sources": [],
             "session_id": session_id,
             "timestamp": datetime.now().isoformat(),
-            "thought_process": thought_process
+            "thought_process": thought_process,
+            "error": True
         }
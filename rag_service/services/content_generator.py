@@ -9,6 +9,11 @@ from langchain_community.embeddings import HuggingFaceEmbeddings
 from loguru import logger
 
 from .memory_manager import StaffMemoryManager
+from utils.llm_cassette import Cassette, CassetteEmbeddings, wrap_llm
+from utils.llm_hedging import HedgePolicy, wrap_hedged_llm
+from utils.llm_gateway import LLMGateway, wrap_gateway_llm
+from .model_router import ModelRouter, TIER_FULL, TIER_LITE, TASK_CONTENT, content_length_chars
+from utils.metrics import InstrumentedEmbeddings, instrument_qdrant_client
 
 
 class ContentGenerator:
@@ -19,26 +24,52 @@ class ContentGenerator:
         memory_manager: StaffMemoryManager,
         gemini_api_key: Optional[str] = None,
         qdrant_host: str = "qdrant",
-        qdrant_port: int = 6333
+        qdrant_port: int = 6333,
+        cassette: Optional[Cassette] = None,
+        callbacks: Optional[list] = None,
+        max_output_tokens: int = 1024,
+        hedge_policy: Optional[HedgePolicy] = None,
+        gateway: Optional[LLMGateway] = None,
+        model: str = "gemini-2.0-flash",
+        lite_model: Optional[str] = None
     ):
         self.memory_manager = memory_manager
         
-        # 初始化 LLM
+        # 初始化 LLM（有 gateway 時經過共用限流與重試，有 cassette 時錄製或重播 Gemini 呼叫，
+        # 有 hedge_policy 時對慢回應送出避險請求）
         api_key = gemini_api_key or os.getenv("GEMINI_API_KEY")
-        self.llm = GoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            google_api_key=api_key,
-            temperature=0.7,
-            max_output_tokens=1024
-        )
+
+        def build_llm(model_name: str):
+            return wrap_hedged_llm(wrap_llm(wrap_gateway_llm(GoogleGenerativeAI(
+                model=model_name,
+                google_api_key=api_key,
+                temperature=0.7,
+                max_output_tokens=max_output_tokens,
+                max_retries=1 if gateway else 6,
+                callbacks=callbacks
+            ), gateway), cassette), hedge_policy)
+
+        self.llm = build_llm(model)
+        # 有 lite_model 時短文案（short）改用 lite 模型
+        self.model_router = ModelRouter({
+            TIER_FULL: self.llm,
+            TIER_LITE: build_llm(lite_model) if lite_model else None
+        })
         
         # 初始化向量資料庫 (共用知識庫)
-        embeddings = HuggingFaceEmbeddings(
-            model_name="moka-ai/m3e-base",
-            model_kwargs={'device': 'cpu'}
-        )
+        def load_embeddings():
+            return HuggingFaceEmbeddings(
+                model_name="moka-ai/m3e-base",
+                model_kwargs={'device': 'cpu'}
+            )
+
+        if cassette is not None:
+            embeddings = CassetteEmbeddings(load_embeddings, cassette, model_name="moka-ai/m3e-base")
+        else:
+            embeddings = load_embeddings()
+        embeddings = InstrumentedEmbeddings(embeddings)
         
-        qdrant_client = QdrantClient(host=qdrant_host, port=qdrant_port)
+        qdrant_client = instrument_qdrant_client(QdrantClient(host=qdrant_host, port=qdrant_port))
         self.vectorstore = Qdrant(
             client=qdrant_client,
             collection_name="pais_knowledge_base",
@@ -138,43 +169,45 @@ class ContentGenerator:
             # 從知識庫檢索相關資料
             context = self._retrieve_context(topic)
 
-            # 取得記憶並手動提取 chat_history
-            memory = self.memory_manager.get_memory(task_id)
-            chat_history = memory.load_memory_variables({}).get("chat_history", "")
-
-            # 建立 Chain（不使用自動 memory，手動傳入 chat_history）
-            chain = LLMChain(
-                llm=self.llm,
-                prompt=self.prompt,
-                verbose=True
-            )
-
-            # 生成文案
-            logger.info(f"開始生成文案: {task_id} - {topic}")
-            result = await chain.ainvoke({
-                "topic": topic,
-                "style": style,
-                "length": length,
-                "context": context,
-                "chat_history": chat_history
-            })
-
-            content = result["text"].strip()
-
-            # 手動保存到記憶
-            memory.save_context(
-                {"input": f"生成文案 - 主題: {topic}, 風格: {style}, 長度: {length}"},
-                {"text": content}
-            )
+            # 生成期間保留任務記憶，避免被淘汰後另外載入一份
+            with self.memory_manager.hold(task_id):
+                # 取得記憶並手動提取 chat_history
+                memory = self.memory_manager.get_memory(task_id)
+                chat_history = memory.load_memory_variables({}).get("chat_history", "")
+
+                # 建立 Chain（不使用自動 memory，手動傳入 chat_history）
+                chain = LLMChain(
+                    llm=self.model_router.llm_for(TASK_CONTENT, context, output_chars=content_length_chars(length)),
+                    prompt=self.prompt,
+                    verbose=True
+                )
+
+                # 生成文案
+                logger.info(f"開始生成文案: {task_id} - {topic}")
+                result = await chain.ainvoke({
+                    "topic": topic,
+                    "style": style,
+                    "length": length,
+                    "context": context,
+                    "chat_history": chat_history
+                })
+
+                content = result["text"].strip()
+
+                # 手動保存到記憶
+                memory.save_context(
+                    {"input": f"生成文案 - 主題: {topic}, 風格: {style}, 長度: {length}"},
+                    {"text": content}
+                )
+
+                # 記錄生成結果到記憶
+                self.memory_manager.add_generation_record(
+                    task_id, topic, style, content
+                )
+
+                logger.info(f"✅文案生成完成: {task_id} ({len(content)} 字)")
+                return content
 
-            # 記錄生成結果到記憶
-            self.memory_manager.add_generation_record(
-                task_id, topic, style, content
-            )
-
-            logger.info(f"✅文案生成完成: {task_id} ({len(content)} 字)")
-            return content
-            
         except Exception as e:
             logger.error(f"❌文案生成失敗: {task_id} - {e}")
             raise
@@ -8,6 +8,8 @@ from typing import Optional
 import httpx
 from loguru import logger
 
+from utils.metrics import observe_external
+
 
 class ElevenLabsService:
     """ElevenLabs 語音克隆服務"""
@@ -22,6 +24,7 @@ class ElevenLabsService:
         if not self.voice_id:
             logger.warning("⚠️ MAYOR_VOICE_ID 未設定")
     
+    @observe_external("elevenlabs")
     async def generate_voice(
         self, 
         text: str, 
@@ -87,6 +90,7 @@ class ElevenLabsService:
             logger.error(f"❌ 語音生成失敗: {e}")
             raise
     
+    @observe_external("elevenlabs")
     async def get_available_voices(self) -> list:
         """取得可用的語音列表"""
         if not self.api_key:
@@ -10,6 +10,8 @@ import requests  # 用於文件上傳（同步）
 import asyncio
 from loguru import logger
 
+from utils.metrics import observe_external
+
 
 class HeyGenService:
     """HeyGen 數位分身影片服務"""
@@ -22,6 +24,7 @@ class HeyGenService:
         if not self.api_key:
             logger.warning("⚠️ HEYGEN_API_KEY 未設定")
 
+    @observe_external("heygen")
     async def upload_audio(self, audio_path: str) -> str:
         """
         上傳音頻到 HeyGen（使用 Upload Asset API）
@@ -87,6 +90,7 @@ class HeyGenService:
             logger.error(f"❌ 音頻上傳失敗: {e}")
             raise
 
+    @observe_external("heygen")
     async def upload_image(self, image_path: str) -> str:
         """
         上傳圖片到 HeyGen（使用 Upload Asset API）
@@ -225,6 +229,7 @@ class HeyGenService:
             logger.error(f"❌ Avatar Video 生成失敗: {e}")
             raise
 
+    @observe_external("heygen")
     async def _create_video_with_urls(self, image_url: str, audio_url: str) -> str:
         """創建 Avatar Video 任務（使用公開 URL）"""
         url = f"{self.base_url}/video/generate"
@@ -282,6 +287,7 @@ class HeyGenService:
             logger.info(f"🎬 Video 任務創建: {video_id}")
             return video_id
 
+    @observe_external("heygen")
     async def _create_video(self, image_asset_id: str, audio_asset_id: str) -> str:
         """創建 Avatar Video 任務（使用 Asset ID）- 舊方法，保留以供兼容"""
         url = f"{self.base_url}/video/generate"
@@ -328,6 +334,7 @@ class HeyGenService:
             logger.info(f"🎬 Video 任務創建: {video_id}")
             return video_id
 
+    @observe_external("heygen")
     async def _poll_video_status(self, video_id: str, max_wait: int = 600) -> str:
         """
         輪詢影片生成狀態
@@ -372,6 +379,7 @@ class HeyGenService:
                 logger.info(f"⏳ 影片生成中... ({status})")
                 await asyncio.sleep(10)  # 每 10 秒檢查一次
 
+    @observe_external("heygen")
     async def _download_video(self, video_url: str, output_path: Path):
         """下載影片"""
         async with httpx.AsyncClient(timeout=120.0) as client:
@@ -383,6 +391,7 @@ class HeyGenService:
 
             logger.info(f"📥 影片下載完成: {output_path}")
 
+    @observe_external("heygen")
     async def get_avatar_list(self) -> list:
         """獲取已創建的 Avatar 列表"""
         if not self.api_key:
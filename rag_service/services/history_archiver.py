@@ -0,0 +1,359 @@
+"""
+對話歷史歸檔模組
+將閒置超過 N 天的會話從熱資料庫移到每日一個的壓縮 JSONL 段落檔，
+需要時再透明地還原回熱資料庫
+"""
+
+import gzip
+import io
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from langchain_core.messages import messages_from_dict
+from loguru import logger
+
+from utils.chat_history_store import ChatHistoryStore
+
+try:
+    import zstandard
+except ImportError:  # 未安裝時改用 gzip
+    zstandard = None
+
+
+# 索引中記錄會話位置的欄位: frame 在段落檔中的位移與長度、該行在解壓後 frame 中的位移與長度
+LOCATION_COLUMNS = ("frame_offset", "frame_length", "record_offset", "record_length")
+
+
+class HistoryArchiver:
+    """
+    冷會話歸檔器
+
+    - 段落檔: archive/YYYY-MM-DD.jsonl.zst（未安裝 zstandard 時為 .jsonl.gz），
+      每行一個會話 {"session_id", "archived_at", "last_active", "summary", "messages", "created_at"}
+      （summary 為熱資料庫中的滾動摘要，created_at 為各訊息原本的建立時間，還原時一併寫回）；
+      同一天多次執行會附加新的壓縮 frame / member
+    - 索引: archive/index.db 記錄會話所在的段落檔、frame 的位置與長度，以及該行在解壓後 frame 內的位置，
+      還原時只需讀取並解壓單一 frame，不必掃描目錄或整個段落檔
+    - 超過 retention_days 的段落檔會被刪除（0 表示永久保留）
+
+    Attributes:
+        store: 熱資料庫
+        archive_dir: 歸檔目錄
+        idle_days: 閒置幾天後歸檔
+        retention_days: 段落檔保留天數
+        can_archive: 判斷會話目前是否可歸檔的函數（例如仍常駐記憶體時不歸檔）
+    """
+
+    def __init__(
+        self,
+        store: ChatHistoryStore,
+        archive_dir: str = "chat_history/archive",
+        idle_days: int = 30,
+        retention_days: int = 0,
+        can_archive: Optional[Callable[[str], bool]] = None,
+        batch_size: int = 500,
+        max_sessions_per_run: int = 20000
+    ):
+        self.store = store
+        self.archive_dir = Path(archive_dir)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.idle_days = idle_days
+        self.retention_days = retention_days
+        self.can_archive = can_archive
+        self.batch_size = batch_size
+        self.max_sessions_per_run = max_sessions_per_run
+        self.suffix = ".jsonl.zst" if zstandard is not None else ".jsonl.gz"
+
+        self._lock = threading.Lock()
+        self._index = sqlite3.connect(str(self.archive_dir / "index.db"), check_same_thread=False)
+        self._index.execute("""
+            CREATE TABLE IF NOT EXISTS archived_sessions (
+                session_id TEXT PRIMARY KEY,
+                segment TEXT NOT NULL,
+                message_count INTEGER NOT NULL,
+                archived_at TEXT NOT NULL
+            )
+        """)
+        # 舊索引補上位置欄位（舊資料為 NULL，還原時改為掃描段落檔）
+        columns = {row[1] for row in self._index.execute("PRAGMA table_info(archived_sessions)")}
+        for column in LOCATION_COLUMNS:
+            if column not in columns:
+                self._index.execute(f"ALTER TABLE archived_sessions ADD COLUMN {column} INTEGER")
+        self._index.commit()
+        self._counters = {
+            "runs": 0,
+            "archived": 0,
+            "rehydrated": 0,
+            "segments_removed": 0,
+        }
+        self._last_run: Optional[Dict[str, Any]] = None
+
+        codec = "zstd" if zstandard is not None else "gzip"
+        logger.info(f"✅HistoryArchiver初始化完成: {self.archive_dir} (閒置 {idle_days} 天歸檔, {codec})")
+
+    def run(self) -> Dict[str, Any]:
+        """
+        執行一次歸檔：搬移閒置會話、刪除過期段落檔、整理熱資料庫
+
+        Returns:
+            本次執行結果
+        """
+        started_at = time.perf_counter()
+        cutoff = datetime.now() - timedelta(days=self.idle_days)
+        archived = 0
+
+        with self._lock:
+            segment = self.archive_dir / f"{datetime.now():%Y-%m-%d}{self.suffix}"
+            candidates = [
+                sid for sid in self.store.idle_sessions(cutoff, limit=self.max_sessions_per_run)
+                if self._archivable(sid)
+            ]
+            for i in range(0, len(candidates), self.batch_size):
+                archived += self._archive_batch(segment, candidates[i:i + self.batch_size])
+
+            removed_segments = self._remove_expired_segments()
+            if archived:
+                self.store.compact()
+
+            self._counters["runs"] += 1
+            self._counters["archived"] += archived
+            self._counters["segments_removed"] += removed_segments
+            self._last_run = {
+                "finished_at": datetime.now().isoformat(),
+                "archived": archived,
+                "segments_removed": removed_segments,
+                "elapsed_ms": round((time.perf_counter() - started_at) * 1000, 1),
+            }
+
+        logger.info(
+            f"🗄️ 對話歷史歸檔完成: 歸檔 {archived} 個會話, 刪除 {removed_segments} 個過期段落檔 "
+            f"({self._last_run['elapsed_ms']:.0f} ms)"
+        )
+        return dict(self._last_run)
+
+    def is_archived(self, session_id: str) -> bool:
+        """
+        檢查會話是否已歸檔
+
+        Args:
+            session_id: 會話 ID
+
+        Returns:
+            是否在歸檔中
+        """
+        with self._lock:
+            return self._lookup(session_id) is not None
+
+    def rehydrate(self, session_id: str) -> bool:
+        """
+        將歸檔的會話還原回熱資料庫
+
+        讀檔與解壓在鎖外進行，寫回前再確認索引未被其他執行緒變更
+
+        Args:
+            session_id: 會話 ID
+
+        Returns:
+            是否有還原
+        """
+        with self._lock:
+            location = self._lookup(session_id)
+        if location is None:
+            return False
+
+        record = self._read_record(session_id, location)
+
+        with self._lock:
+            if self._lookup(session_id) != location:
+                # 期間已被其他請求還原、移除或重新歸檔
+                return False
+            segment = location[0]
+            if record is None:
+                logger.warning(f"⚠️ 歸檔索引指向 {segment}，但找不到會話 {session_id}（段落檔可能已過期）")
+                self._forget(session_id)
+                return False
+
+            created_at = record.get("created_at")
+            if created_at is None and record.get("last_active"):
+                # 舊段落檔沒有逐則時間，以最後活動時間代替
+                created_at = [record["last_active"]] * len(record["messages"])
+            self.store.import_messages(session_id, messages_from_dict(record["messages"]), created_at)
+            self.store.import_summary(session_id, record.get("summary"))
+            self._forget(session_id)
+            self._counters["rehydrated"] += 1
+
+        logger.info(f"♻️ 已從歸檔還原會話: {session_id} ({len(record['messages'])} 則, {segment})")
+        return True
+
+    def remove(self, session_id: str) -> bool:
+        """
+        移除會話的歸檔索引（段落檔內的資料於保留期限到期時一併刪除）
+
+        Args:
+            session_id: 會話 ID
+
+        Returns:
+            是否原本有歸檔
+        """
+        with self._lock:
+            if self._lookup(session_id) is None:
+                return False
+            self._forget(session_id)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        """取得歸檔統計"""
+        with self._lock:
+            archived_sessions = self._index.execute("SELECT COUNT(*) FROM archived_sessions").fetchone()[0]
+            segments = list(self.archive_dir.glob(f"*{self.suffix}"))
+            return {
+                "archived_sessions": archived_sessions,
+                "segments": len(segments),
+                "archive_bytes": sum(p.stat().st_size for p in segments),
+                "idle_days": self.idle_days,
+                "retention_days": self.retention_days,
+                "codec": "zstd" if zstandard is not None else "gzip",
+                "last_run": self._last_run,
+                **self._counters,
+            }
+
+    # ==================== 內部 ====================
+
+    def _archivable(self, session_id: str) -> bool:
+        """判斷會話是否可歸檔"""
+        return self.can_archive is None or self.can_archive(session_id)
+
+    def _archive_batch(self, segment: Path, session_ids: list) -> int:
+        """將一批會話寫入段落檔後自熱資料庫刪除（先寫檔再刪除，中斷時不會遺失）"""
+        archived_at = datetime.now().isoformat()
+        records = []
+        for sid in session_ids:
+            exported = self.store.export_session(sid)
+            if not exported["messages"]:
+                continue
+            records.append({
+                "session_id": sid,
+                "archived_at": archived_at,
+                "last_active": exported["last_active"],
+                "summary": exported["summary"],
+                "messages": exported["messages"],
+                "created_at": exported["created_at"],
+            })
+        if not records:
+            return 0
+
+        lines = [(json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8") for r in records]
+        frame = self._compress(b"".join(lines))
+        with open(segment, "ab") as f:
+            f.seek(0, io.SEEK_END)
+            frame_offset = f.tell()
+            f.write(frame)
+            f.flush()
+
+        rows = []
+        record_offset = 0
+        for r, line in zip(records, lines):
+            rows.append((
+                r["session_id"], segment.name, len(r["messages"]), archived_at,
+                frame_offset, len(frame), record_offset, len(line)
+            ))
+            record_offset += len(line)
+        self._index.executemany(
+            "INSERT OR REPLACE INTO archived_sessions "
+            f"(session_id, segment, message_count, archived_at, {', '.join(LOCATION_COLUMNS)}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        self._index.commit()
+
+        archived = 0
+        for r in records:
+            sid = r["session_id"]
+            if not self._archivable(sid) or not self.store.delete_if_unchanged(sid, len(r["messages"])):
+                # 歸檔期間會話又有新訊息，保留在熱資料庫
+                self._forget(sid)
+                continue
+            archived += 1
+        return archived
+
+    def _remove_expired_segments(self) -> int:
+        """刪除超過保留天數的段落檔與其索引"""
+        if self.retention_days <= 0:
+            return 0
+        cutoff = f"{datetime.now() - timedelta(days=self.retention_days):%Y-%m-%d}"
+        removed = 0
+        for path in self.archive_dir.glob(f"*{self.suffix}"):
+            if path.name[:10] < cutoff:
+                path.unlink()
+                self._index.execute("DELETE FROM archived_sessions WHERE segment = ?", (path.name,))
+                removed += 1
+        self._index.commit()
+        return removed
+
+    def _lookup(self, session_id: str) -> Optional[Tuple]:
+        """查詢會話所在的段落檔與位置: (segment, frame_offset, frame_length, record_offset, record_length)"""
+        return self._index.execute(
+            f"SELECT segment, {', '.join(LOCATION_COLUMNS)} FROM archived_sessions WHERE session_id = ?",
+            (session_id,)
+        ).fetchone()
+
+    def _forget(self, session_id: str):
+        """移除索引"""
+        self._index.execute("DELETE FROM archived_sessions WHERE session_id = ?", (session_id,))
+        self._index.commit()
+
+    def _compress(self, payload: bytes) -> bytes:
+        """壓縮成一個獨立的 frame / member"""
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(level=10).compress(payload)
+        return gzip.compress(payload)
+
+    def _decompress(self, frame: bytes, path: Path) -> bytes:
+        """解壓單一 frame / member"""
+        if path.name.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"讀取 {path.name} 需要安裝 zstandard")
+            return zstandard.ZstdDecompressor().decompress(frame)
+        return gzip.decompress(frame)
+
+    def _read_record(self, session_id: str, location: Tuple) -> Optional[Dict[str, Any]]:
+        """依索引位置讀取會話（舊索引沒有位置時掃描整個段落檔），找不到時回傳 None"""
+        segment, frame_offset, frame_length, record_offset, record_length = location
+        path = self.archive_dir / segment
+        try:
+            if frame_offset is None:
+                record = None
+                for item in self._read_segment(path):
+                    if item.get("session_id") == session_id:
+                        record = item  # 同一段落檔內以最後一筆為準
+                return record
+
+            with open(path, "rb") as f:
+                f.seek(frame_offset)
+                frame = f.read(frame_length)
+            payload = self._decompress(frame, path)
+            item = json.loads(payload[record_offset:record_offset + record_length])
+        except FileNotFoundError:
+            return None
+        return item if item.get("session_id") == session_id else None
+
+    def _read_segment(self, path: Path) -> Iterator[Dict[str, Any]]:
+        """逐行讀取段落檔（支援多個 frame / member 串接）"""
+        if path.name.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"讀取 {path.name} 需要安裝 zstandard")
+            with open(path, "rb") as raw:
+                reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+                for line in io.TextIOWrapper(reader, encoding="utf-8"):
+                    if line.strip():
+                        yield json.loads(line)
+        else:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
@@ -0,0 +1,308 @@
+"""
+意圖路由模組
+在進入 ReAct Agent 前以本地規則 + m3e 向量判斷意圖，
+招呼、致謝、敏感話題直接以模板回覆，單純查詢改走單次 RAG
+"""
+
+import random
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import numpy as np
+from loguru import logger
+
+from utils.text_utils import normalize_question
+
+
+ROUTE_GREETING = "greeting"
+ROUTE_THANKS = "thanks"
+ROUTE_SENSITIVE = "sensitive"
+ROUTE_FACTUAL = "factual"
+ROUTE_AGENT = "agent"
+
+# 可直接以模板回覆的路由
+TEMPLATE_ROUTES = (ROUTE_GREETING, ROUTE_THANKS, ROUTE_SENSITIVE)
+
+
+@dataclass
+class RouteDecision:
+    """路由判斷結果"""
+    route: str
+    reason: str
+    score: float = 0.0
+    embedding: Optional[np.ndarray] = None
+
+
+class IntentRouter:
+    """
+    公眾問答意圖路由器（僅使用 CPU）
+
+    判斷順序：
+    1. 規則：整句（去除標點後）即為招呼或致謝用語；詢問立場、要求表態或謾罵的敏感話題
+    2. m3e 向量與敏感話題範例中心點的相似度
+    3. 其餘問題依結構區分為單純查詢 (factual) 或多步驟問題 (agent)
+
+    招呼與致謝只接受整句比對，「謝謝，那停車費怎麼繳」「hiv篩檢」等帶有問題的訊息一律往下判斷；
+    敏感話題只看詢問立場的說法，「選舉投票所在哪裡」「罷免的流程」等市政問題照常回答
+
+    Attributes:
+        embeddings: LangChain Embeddings 實例（None 時僅使用關鍵字規則）
+        agent_latency_ms: Agent 路徑的平均延遲估計，用於計算節省時間
+    """
+
+    # 整句比對用（連同 EXEMPLARS 的範例一起正規化後比對）
+    GREETING_KEYWORDS = (
+        "你好", "您好", "哈囉", "嗨", "hi", "hello", "hey", "早安", "午安", "晚安",
+        "安安", "善寶你好", "善寶您好", "嗨善寶", "在嗎"
+    )
+    THANKS_KEYWORDS = (
+        "謝謝", "謝謝您", "謝謝善寶", "感謝", "感謝你", "非常感謝", "多謝", "謝啦",
+        "thank you", "thanks", "3q", "辛苦了", "感恩"
+    )
+    # 出現即視為敏感話題：要求表態、拉票或人身攻擊（只收完整說法，不收「很爛」等一般抱怨）
+    SENSITIVE_KEYWORDS = (
+        "投給誰", "投給哪", "投票給", "拉票", "支持哪一黨", "支持哪個黨", "支持哪個政黨",
+        "支持哪一個政黨", "支持哪位候選人", "支持哪個候選人", "哪一黨", "統獨",
+        "選總統", "會不會連任", "要不要連任", "會不會參選", "要不要參選",
+        "是不是貪污", "是不是收賄", "下台", "笨蛋", "去死"
+    )
+    # 表態用語須搭配詢問對象才視為敏感（單獨出現可能是「哪個政黨執政時蓋的」「藍綠色的垃圾桶」）
+    STANCE_KEYWORDS = ("哪個政黨", "藍綠", "要不要選")
+    STANCE_TARGETS = ("你", "您", "善寶", "市長", "張善政")
+    # 政治話題須搭配詢問看法的用語才視為敏感（單獨出現多半是市政問題，例如投票所、罷免流程）
+    SENSITIVE_TOPICS = (
+        "政黨", "國民黨", "民進黨", "民眾黨", "時代力量", "選舉", "大選", "總統", "連任",
+        "參選", "罷免", "黨主席", "貪污", "收賄", "弊案"
+    )
+    OPINION_CUES = ("看法", "怎麼看", "覺得", "認為", "支持", "立場", "評價", "喜歡", "討厭")
+
+    # 多步驟問題的結構特徵
+    MULTI_STEP_MARKERS = (
+        "比較", "差別", "差異", "相比", "分別", "以及", "並且", "同時", "步驟",
+        "流程", "如何申請", "怎麼申請", "規劃"
+    )
+
+    EXEMPLARS = {
+        ROUTE_GREETING: ["你好", "哈囉善寶", "嗨你好啊", "早安", "你是誰", "在嗎"],
+        ROUTE_THANKS: ["謝謝你", "感謝回答", "辛苦了謝謝", "好的謝謝", "了解感謝"],
+        ROUTE_SENSITIVE: [
+            "你支持哪個政黨", "市長會不會選總統", "下次選舉你會投給誰",
+            "你對民進黨有什麼看法", "市長偏藍還是偏綠", "你們是不是貪污"
+        ],
+    }
+
+    TEMPLATES = {
+        ROUTE_GREETING: [
+            "嗨！我是善寶，桃園市長張善政的AI分身😊 想了解哪些市政資訊呢？",
+            "你好呀！善寶在這裡，有任何桃園市政的問題都可以問我喔！",
+            "市民您好！我是善寶，很高興為您服務，今天想聊聊什麼呢？",
+        ],
+        ROUTE_THANKS: [
+            "不客氣！能幫上忙善寶很開心😊 還有其他問題隨時問我喔！",
+            "不用客氣～有任何市政問題，歡迎再來找善寶聊聊！",
+            "很高興能幫到您！祝您有美好的一天😊",
+        ],
+        ROUTE_SENSITIVE: [
+            "這個話題善寶不方便回應喔，建議您關注市府官網或撥打1999專線😊",
+            "關於這類議題，建議您關注市府官網或撥打1999專線😊 如果有市政服務上的問題，善寶很樂意協助！",
+        ],
+    }
+
+    # 以向量中心點判斷的意圖與門檻（招呼與致謝只用整句比對；敏感話題誤判代價高，門檻較嚴）
+    CENTROID_THRESHOLDS = {
+        ROUTE_SENSITIVE: 0.90,
+    }
+
+    # 超過此長度的問題視為複雜問題
+    LONG_QUESTION_LENGTH = 60
+
+    def __init__(
+        self,
+        embeddings=None,
+        agent_latency_ms: float = 8000.0
+    ):
+        """
+        初始化意圖路由器
+
+        Args:
+            embeddings: LangChain Embeddings 實例
+            agent_latency_ms: Agent 路徑延遲的初始估計（毫秒）
+        """
+        self.embeddings = embeddings
+        self.agent_latency_ms = agent_latency_ms
+        self._phrases = {
+            ROUTE_GREETING: self._normalized_phrases(self.GREETING_KEYWORDS + tuple(self.EXEMPLARS[ROUTE_GREETING])),
+            ROUTE_THANKS: self._normalized_phrases(self.THANKS_KEYWORDS + tuple(self.EXEMPLARS[ROUTE_THANKS])),
+        }
+
+        self._centroids: Optional[Dict[str, np.ndarray]] = None
+        self._centroid_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._route_stats: Dict[str, Dict[str, float]] = {}
+
+        logger.info("✅IntentRouter初始化完成")
+
+    def classify(self, message: str) -> RouteDecision:
+        """
+        判斷訊息意圖（同步，可能計算 embedding，請於執行緒池中呼叫）
+
+        Args:
+            message: 使用者訊息
+
+        Returns:
+            RouteDecision
+        """
+        normalized = normalize_question(message)
+        if not normalized:
+            return RouteDecision(ROUTE_GREETING, "empty")
+
+        # 1. 規則：招呼與致謝須整句相符，敏感話題看表態用語
+        for route in (ROUTE_THANKS, ROUTE_GREETING):
+            if normalized in self._phrases[route]:
+                return RouteDecision(route, "phrase", 1.0)
+
+        sensitive_reason = self._match_sensitive(normalized)
+        if sensitive_reason:
+            return RouteDecision(ROUTE_SENSITIVE, sensitive_reason, 1.0)
+
+        # 2. 向量中心點相似度（僅敏感話題）
+        embedding = None
+        if self.embeddings is not None:
+            try:
+                embedding = self._embed(message)
+                route, score = self._nearest_centroid(embedding)
+                if route is not None:
+                    return RouteDecision(route, "centroid", score, embedding)
+            except Exception as e:
+                logger.warning(f"⚠️ 意圖路由向量計算失敗，改用規則判斷: {e}")
+
+        # 3. 單純查詢 vs 多步驟問題
+        question_marks = message.count("？") + message.count("?")
+        multi_marker = next((m for m in self.MULTI_STEP_MARKERS if m in normalized), None)
+        if multi_marker:
+            return RouteDecision(ROUTE_AGENT, f"multi_step:{multi_marker}", embedding=embedding)
+        if question_marks >= 2:
+            return RouteDecision(ROUTE_AGENT, "multiple_questions", embedding=embedding)
+        if len(normalized) > self.LONG_QUESTION_LENGTH:
+            return RouteDecision(ROUTE_AGENT, "long_question", embedding=embedding)
+
+        return RouteDecision(ROUTE_FACTUAL, "single_question", embedding=embedding)
+
+    def template_reply(self, route: str) -> str:
+        """
+        取得模板回覆（隨機挑選，讓開場詞多樣化）
+
+        Args:
+            route: 路由名稱
+
+        Returns:
+            回覆字串
+        """
+        return random.choice(self.TEMPLATES[route])
+
+    def record(self, route: str, latency_ms: float) -> float:
+        """
+        記錄路由結果並估算節省的延遲
+
+        Args:
+            route: 路由名稱
+            latency_ms: 本次請求實際耗時（毫秒）
+
+        Returns:
+            相較於 Agent 路徑預估節省的毫秒數
+        """
+        with self._stats_lock:
+            if route == ROUTE_AGENT:
+                # 指數移動平均，讓估計值跟上實際負載
+                self.agent_latency_ms = 0.8 * self.agent_latency_ms + 0.2 * latency_ms
+                saved_ms = 0.0
+            else:
+                saved_ms = max(self.agent_latency_ms - latency_ms, 0.0)
+
+            stats = self._route_stats.setdefault(
+                route, {"count": 0, "total_latency_ms": 0.0, "saved_ms": 0.0}
+            )
+            stats["count"] += 1
+            stats["total_latency_ms"] += latency_ms
+            stats["saved_ms"] += saved_ms
+
+        return saved_ms
+
+    def stats(self) -> Dict[str, Any]:
+        """取得各路由統計"""
+        with self._stats_lock:
+            routes = {
+                route: {
+                    "count": int(data["count"]),
+                    "avg_latency_ms": round(data["total_latency_ms"] / data["count"], 1),
+                    "estimated_saved_ms": round(data["saved_ms"], 1),
+                }
+                for route, data in self._route_stats.items()
+            }
+            agent_latency_ms = round(self.agent_latency_ms, 1)
+        return {"agent_latency_estimate_ms": agent_latency_ms, "routes": routes}
+
+    @staticmethod
+    def _normalized_phrases(phrases) -> frozenset:
+        """將整句比對用語正規化（與 classify 的訊息使用相同規則）"""
+        return frozenset(filter(None, (normalize_question(phrase) for phrase in phrases)))
+
+    def _match_sensitive(self, normalized: str) -> Optional[str]:
+        """
+        判斷正規化後的訊息是否為敏感話題
+
+        Args:
+            normalized: 正規化後的訊息
+
+        Returns:
+            命中原因（keyword:...、stance:對象+用語 或 opinion:話題+用語），未命中時為 None
+        """
+        keyword = next((k for k in self.SENSITIVE_KEYWORDS if k in normalized), None)
+        if keyword:
+            return f"keyword:{keyword}"
+        stance = next((k for k in self.STANCE_KEYWORDS if k in normalized), None)
+        if stance:
+            target = next((t for t in self.STANCE_TARGETS if t in normalized), None)
+            if target:
+                return f"stance:{target}+{stance}"
+        topic = next((t for t in self.SENSITIVE_TOPICS if t in normalized), None)
+        if topic:
+            cue = next((c for c in self.OPINION_CUES if c in normalized), None)
+            if cue:
+                return f"opinion:{topic}+{cue}"
+        return None
+
+    def _embed(self, message: str) -> np.ndarray:
+        """計算正規化後的查詢向量"""
+        vector = np.asarray(self.embeddings.embed_query(message), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _nearest_centroid(self, embedding: np.ndarray):
+        """找出最接近且超過門檻的意圖中心點"""
+        centroids = self._get_centroids()
+        best_route, best_score = None, 0.0
+        for route, centroid in centroids.items():
+            score = float(np.dot(centroid, embedding))
+            if score >= self.CENTROID_THRESHOLDS[route] and score > best_score:
+                best_route, best_score = route, score
+        return best_route, best_score
+
+    def _get_centroids(self) -> Dict[str, np.ndarray]:
+        """延遲計算各意圖範例的向量中心點"""
+        if self._centroids is None:
+            with self._centroid_lock:
+                if self._centroids is None:
+                    centroids = {}
+                    for route in self.CENTROID_THRESHOLDS:
+                        examples = self.EXEMPLARS[route]
+                        vectors = np.asarray(
+                            self.embeddings.embed_documents(examples), dtype=np.float32
+                        )
+                        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                        centroid = vectors.mean(axis=0)
+                        centroids[route] = centroid / np.linalg.norm(centroid)
+                    self._centroids = centroids
+                    logger.info(f"🧭 意圖中心點計算完成: {', '.join(centroids)}")
+        return self._centroids
@@ -0,0 +1,131 @@
+"""
+精簡 RAG 模組（use_agent=false 的 v2 流程）
+不使用 ConversationalRetrievalChain 的 LLM 問題改寫：追問以啟發式規則或向量分數判斷，
+直接把前一個問題併入檢索查詢；檢索結果依相似度門檻過濾，整個流程只呼叫一次 LLM
+"""
+
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage, HumanMessage
+from loguru import logger
+
+from utils.retrieval_cache import memoized_retrieval
+from utils.text_utils import looks_like_followup
+
+# 追問判斷方式
+FOLLOWUP_NONE = "none"
+FOLLOWUP_HEURISTIC = "heuristic"  # 追問用語或缺少主題的短問句
+FOLLOWUP_EMBEDDING = "embedding"  # 單獨檢索分數不足，併入前一問題後分數較高
+
+# 追問判斷只需要前一個問題，呼叫端只讀取最近幾則訊息
+FOLLOWUP_HISTORY_WINDOW = 6
+
+
+@dataclass
+class LeanRetrieval:
+    """單次檢索結果"""
+    query: str
+    followup: str
+    docs: List[Document] = field(default_factory=list)
+    top_score: Optional[float] = None
+    dropped: int = 0
+
+
+class LeanRAG:
+    """
+    精簡 RAG 檢索器
+
+    - 有對話歷史且訊息像追問時，以「前一個問題 + 本次訊息」檢索
+    - 不像追問但單獨檢索的最高分低於門檻時，再以合併查詢檢索一次，分數較高者採用
+    - 只保留相似度不低於 score_threshold 的段落（最多 top_k 段）
+
+    Attributes:
+        vectorstore: Qdrant 向量資料庫
+        top_k: 最多保留的段落數
+        score_threshold: 段落相似度門檻（Qdrant cosine 分數）
+    """
+
+    def __init__(self, vectorstore, top_k: int = 4, score_threshold: float = 0.5):
+        self.vectorstore = vectorstore
+        self.top_k = top_k
+        self.score_threshold = score_threshold
+
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0,
+            "followup_heuristic": 0,
+            "followup_embedding": 0,
+            "docs_kept": 0,
+            "docs_dropped": 0,
+            "empty_context": 0,
+        }
+
+        logger.info(f"✅LeanRAG初始化完成 (top_k: {top_k}, 分數門檻: {score_threshold})")
+
+    def retrieve(self, message: str, history: List[BaseMessage]) -> LeanRetrieval:
+        """
+        依訊息與對話歷史檢索知識庫（同步，於執行緒池中呼叫）
+
+        Args:
+            message: 用戶訊息
+            history: 最近的對話訊息（最多 FOLLOWUP_HISTORY_WINDOW 則即可）
+
+        Returns:
+            LeanRetrieval
+        """
+        previous = self._previous_question(history)
+        if previous and looks_like_followup(message):
+            result = self._search(f"{previous} {message}", FOLLOWUP_HEURISTIC)
+        else:
+            result = self._search(message, FOLLOWUP_NONE)
+            if previous and not result.docs:
+                combined = self._search(f"{previous} {message}", FOLLOWUP_EMBEDDING)
+                if (combined.top_score or 0.0) > (result.top_score or 0.0) and combined.docs:
+                    result = combined
+
+        with self._lock:
+            self._counters["requests"] += 1
+            if result.followup != FOLLOWUP_NONE:
+                self._counters[f"followup_{result.followup}"] += 1
+            self._counters["docs_kept"] += len(result.docs)
+            self._counters["docs_dropped"] += result.dropped
+            if not result.docs:
+                self._counters["empty_context"] += 1
+        return result
+
+    def _search(self, query: str, followup: str) -> LeanRetrieval:
+        scored: List[Tuple[Document, float]] = memoized_retrieval(
+            ("similarity_score", query, self.top_k),
+            lambda: self.vectorstore.similarity_search_with_score(query, k=self.top_k)
+        )
+        docs = [doc for doc, score in scored if score >= self.score_threshold]
+        return LeanRetrieval(
+            query=query,
+            followup=followup,
+            docs=docs,
+            top_score=max((score for _, score in scored), default=None),
+            dropped=len(scored) - len(docs)
+        )
+
+    @staticmethod
+    def _previous_question(history: List[BaseMessage]) -> str:
+        """取得最近一則使用者訊息"""
+        for message in reversed(history):
+            if isinstance(message, HumanMessage):
+                return str(message.content)
+        return ""
+
+    def stats(self) -> Dict[str, Any]:
+        """取得追問判斷與段落過濾統計"""
+        with self._lock:
+            counters = dict(self._counters)
+        requests = counters["requests"]
+        return {
+            "top_k": self.top_k,
+            "score_threshold": self.score_threshold,
+            **counters,
+            "avg_docs": round(counters["docs_kept"] / requests, 2) if requests else 0.0,
+        }
@@ -0,0 +1,283 @@
+"""
+LLM 用量統計模組
+以 LangChain Callback 記錄每次 Gemini 呼叫的 prompt / completion token 數，
+依「日期 × 路由 × 角色 × 會話 × 模型」彙總後定期寫入 StaffDatabase，並估算費用
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from loguru import logger
+
+from utils.concurrency import submit_blocking
+from utils.db_helper import StaffDatabase
+from utils.metrics import LLM_TOKENS_TOTAL, llm_model_name
+from utils.token_counter import count_message_tokens, count_tokens
+
+
+# 不在任何請求範圍內的呼叫（例如背景摘要）歸到這個路由
+BACKGROUND_ROUTE = "background"
+
+UsageKey = Tuple[str, str, str, str, str]  # (day, route, role, session_id, model)
+
+
+@dataclass
+class UsageScope:
+    """一次請求的歸屬資訊與累計用量（usage 會放進回應的 trace）"""
+    route: str
+    role: str
+    session_id: str
+    usage: Dict[str, int] = field(
+        default_factory=lambda: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    )
+
+
+_current_scope: ContextVar[Optional[UsageScope]] = ContextVar("llm_usage_scope", default=None)
+
+
+class LLMUsageTracker(BaseCallbackHandler):
+    """
+    LLM 用量統計 Callback
+
+    - 模型有回傳 usage_metadata（ChatGoogleGenerativeAI）時使用實際數字，
+      否則（GoogleGenerativeAI、錄製重播）以 token_counter 估算，並計入 estimated_calls
+    - 呼叫當下所在的 scope() 決定用量歸屬；同一請求的用量同時累加到 scope.usage
+    - 彙總結果先留在記憶體，每 flush_interval 秒在背景寫入資料庫一次
+
+    Attributes:
+        db: 儲存彙總結果的資料庫
+        flush_interval: 寫入資料庫的間隔（秒）
+        price_input_per_mtok: 每百萬 prompt token 的價格（美元）
+        price_output_per_mtok: 每百萬 completion token 的價格（美元）
+    """
+
+    run_inline = True
+
+    def __init__(
+        self,
+        db: StaffDatabase,
+        flush_interval: float = 5.0,
+        price_input_per_mtok: float = 0.0,
+        price_output_per_mtok: float = 0.0
+    ):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.price_input_per_mtok = price_input_per_mtok
+        self.price_output_per_mtok = price_output_per_mtok
+        self._started: Dict[UUID, Tuple[float, str, int, Optional[UsageScope]]] = {}
+        self._pending: Dict[UsageKey, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._counters = {"calls": 0, "estimated_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "flush_errors": 0}
+        logger.info("✅LLM 用量統計初始化完成")
+
+    # ==================== 請求歸屬 ====================
+
+    @contextmanager
+    def scope(self, route: str, role: str, session_id: Optional[str] = None) -> Iterator[Dict[str, int]]:
+        """
+        在區塊內的 LLM 呼叫歸屬到指定路由 / 角色 / 會話
+
+        Args:
+            route: 路由（例如 "/api/chat"）
+            role: 角色
+            session_id: 會話 ID（沒有時為空字串）
+
+        Yields:
+            本次請求的用量 {"calls", "prompt_tokens", "completion_tokens"}（區塊結束後仍可讀取）
+        """
+        current = UsageScope(route=route, role=role, session_id=session_id or "")
+        token = _current_scope.set(current)
+        try:
+            yield current.usage
+        finally:
+            try:
+                _current_scope.reset(token)
+            except ValueError:
+                pass  # 串流中斷時產生器可能在其他 context 中被關閉
+
+    # ==================== Callback ====================
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any):
+        self._start(run_id, kwargs, sum(count_tokens(prompt) for prompt in prompts))
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, **kwargs: Any
+    ):
+        self._start(run_id, kwargs, sum(count_message_tokens(batch) for batch in messages))
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        started_at, model, prompt_estimate, scope = started
+
+        prompt_tokens, completion_tokens, estimated = self._usage_from_response(response)
+        if estimated:
+            prompt_tokens = prompt_estimate
+        self._record(
+            scope, model, prompt_tokens, completion_tokens, estimated,
+            (time.perf_counter() - started_at) * 1000
+        )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        # 失敗的呼叫不一定有計費，只記錄 prompt 估算值，避免低估用量
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        started_at, model, prompt_estimate, scope = started
+        self._record(scope, model, prompt_estimate, 0, True, (time.perf_counter() - started_at) * 1000)
+
+    def _start(self, run_id: UUID, kwargs: Dict[str, Any], prompt_estimate: int):
+        with self._lock:
+            self._started[run_id] = (
+                time.perf_counter(), llm_model_name(kwargs), prompt_estimate, _current_scope.get()
+            )
+
+    @staticmethod
+    def _usage_from_response(response: Any) -> Tuple[int, int, bool]:
+        """
+        從 LLMResult 取得實際用量
+
+        Returns:
+            (prompt_tokens, completion_tokens, 是否為估算值)
+        """
+        prompt_tokens = completion_tokens = 0
+        reported = False
+        texts = []
+        for generations in response.generations:
+            for generation in generations:
+                texts.append(generation.text)
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+                    reported = True
+        if reported:
+            return prompt_tokens, completion_tokens, False
+        return 0, sum(count_tokens(text) for text in texts), True
+
+    def _record(
+        self,
+        scope: Optional[UsageScope],
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        estimated: bool,
+        latency_ms: float
+    ):
+        if scope is None:
+            scope = UsageScope(route=BACKGROUND_ROUTE, role="", session_id="")
+        key = (datetime.now().strftime("%Y-%m-%d"), scope.route, scope.role, scope.session_id, model)
+
+        with self._lock:
+            scope.usage["calls"] += 1
+            scope.usage["prompt_tokens"] += prompt_tokens
+            scope.usage["completion_tokens"] += completion_tokens
+
+            pending = self._pending.setdefault(key, {
+                "calls": 0, "estimated_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency_ms": 0.0
+            })
+            pending["calls"] += 1
+            pending["estimated_calls"] += int(estimated)
+            pending["prompt_tokens"] += prompt_tokens
+            pending["completion_tokens"] += completion_tokens
+            pending["latency_ms"] += latency_ms
+
+            self._counters["calls"] += 1
+            self._counters["estimated_calls"] += int(estimated)
+            self._counters["prompt_tokens"] += prompt_tokens
+            self._counters["completion_tokens"] += completion_tokens
+
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+            if due:
+                self._last_flush = time.monotonic()
+
+        LLM_TOKENS_TOTAL.labels(model=model, kind="prompt").inc(prompt_tokens)
+        LLM_TOKENS_TOTAL.labels(model=model, kind="completion").inc(completion_tokens)
+        if due:
+            submit_blocking(self.flush)
+
+    # ==================== 寫入與查詢 ====================
+
+    def flush(self):
+        """將記憶體中的彙總結果寫入資料庫（失敗時保留到下次再寫）"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            rows = [
+                {"day": day, "route": route, "role": role, "session_id": session_id, "model": model, **values}
+                for (day, route, role, session_id, model), values in pending.items()
+            ]
+            try:
+                self.db.add_llm_usage(rows)
+            except Exception as e:
+                logger.error(f"❌ 寫入 LLM 用量失敗: {e}")
+                with self._lock:
+                    self._counters["flush_errors"] += 1
+                    for key, values in pending.items():
+                        merged = self._pending.setdefault(key, {name: 0 for name in values})
+                        for name, value in values.items():
+                            merged[name] += value
+
+    def estimate_cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        """依設定的單價估算費用（美元）"""
+        return round(
+            prompt_tokens / 1_000_000 * self.price_input_per_mtok
+            + completion_tokens / 1_000_000 * self.price_output_per_mtok,
+            6
+        )
+
+    def report(self, days: int = 7, group_by: str = "session_id", limit: int = 20) -> Dict[str, Any]:
+        """
+        取得最近 N 天的用量總計與用量最高的前幾名
+
+        Args:
+            days: 統計天數（含今天）
+            group_by: 排行依據 (session_id/route/role/day/model)
+            limit: 排行筆數
+
+        Returns:
+            {"since", "group_by", "totals", "top"}，皆附上估算費用 cost_usd
+
+        Raises:
+            ValueError: group_by 不支援時
+        """
+        self.flush()
+        since = (datetime.now() - timedelta(days=max(days, 1) - 1)).strftime("%Y-%m-%d")
+        totals = self.db.get_llm_usage_totals(since)
+        top = self.db.get_llm_usage_top(since, group_by=group_by, limit=limit)
+        totals["cost_usd"] = self.estimate_cost(totals["prompt_tokens"], totals["completion_tokens"])
+        for row in top:
+            row["cost_usd"] = self.estimate_cost(row["prompt_tokens"], row["completion_tokens"])
+        return {"since": since, "group_by": group_by, "totals": totals, "top": top}
+
+    def stats(self) -> Dict[str, Any]:
+        """取得本次啟動以來的用量統計"""
+        with self._lock:
+            counters = dict(self._counters)
+            pending = len(self._pending)
+        return {
+            **counters,
+            "pending_rows": pending,
+            "cost_usd": self.estimate_cost(counters["prompt_tokens"], counters["completion_tokens"]),
+            "price_input_per_mtok": self.price_input_per_mtok,
+            "price_output_per_mtok": self.price_output_per_mtok,
+        }
+
+    def close(self):
+        """寫入尚未儲存的用量"""
+        self.flush()
@@ -4,19 +4,39 @@
 目的：讓 LLM 學習市長的用字遣詞
 """
 from pathlib import Path
-from typing import Dict
+from typing import Any, ContextManager, Dict, Optional
 from langchain.memory import ConversationBufferMemory
-from langchain_community.chat_message_histories import FileChatMessageHistory
 from loguru import logger
 
+from utils.chat_history_store import ChatHistoryStore, SQLiteChatMessageHistory
+from utils.session_cache import SessionCache, estimate_chat_memory_bytes
+from .session_manager import SessionManager
+
 
 class StaffMemoryManager:
     """幕僚系統記憶管理器"""
     
-    def __init__(self, base_path: str = "chat_history/staff"):
-        self.memory_store: Dict[str, ConversationBufferMemory] = {}
+    def __init__(
+        self,
+        base_path: str = "chat_history/staff",
+        max_entries: int = 200,
+        max_bytes: int = 32 * 1024 * 1024,
+        idle_ttl_seconds: int = 1800,
+        session_manager: Optional[SessionManager] = None
+    ):
+        # 任務記憶保存在歷史資料庫，移出記憶體後可重新載入；生成中的任務（hold）不會被淘汰
+        self.session_manager = session_manager or SessionManager()
+        self.memory_store: SessionCache[ConversationBufferMemory] = SessionCache(
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            idle_ttl_seconds=idle_ttl_seconds,
+            size_func=estimate_chat_memory_bytes,
+            can_evict=lambda memory_key: not self.session_manager.is_active(memory_key),
+            name="staff"
+        )
         self.base_path = Path(base_path)
         self.base_path.mkdir(parents=True, exist_ok=True)
+        self.history_store = ChatHistoryStore(str(self.base_path / "chat_history.db"))
         logger.info(f"記憶管理器初始化: {self.base_path}")
     
     def get_memory(self, task_id: str) -> ConversationBufferMemory:
@@ -25,20 +45,27 @@ class StaffMemoryManager:
         讓 LLM 能夠學習並保持一致的語氣風格
         """
         memory_key = f"content_task_{task_id}"
-        
-        if memory_key not in self.memory_store:
-            history_file = self.base_path / f"{memory_key}.json"
-            message_history = FileChatMessageHistory(str(history_file))
-            
-            self.memory_store[memory_key] = ConversationBufferMemory(
+
+        def load_memory() -> ConversationBufferMemory:
+            message_history = SQLiteChatMessageHistory(memory_key, self.history_store)
+            logger.info(f"🆕 載入記憶: {memory_key}")
+            return ConversationBufferMemory(
                 chat_memory=message_history,
                 memory_key="chat_history",
                 return_messages=True,
                 output_key="text"  # 指定輸出鍵
             )
-            logger.info(f"🆕 建立記憶: {memory_key}")
-        
-        return self.memory_store[memory_key]
+
+        return self.memory_store.get_or_create(memory_key, load_memory)
+
+    def hold(self, task_id: str) -> ContextManager[None]:
+        """
+        在區塊內將任務記憶標記為使用中，避免生成途中被淘汰後重新載入成另一份記憶
+
+        Args:
+            task_id: 任務 ID
+        """
+        return self.session_manager.hold(f"content_task_{task_id}")
     
     def save_feedback(self, task_id: str, original: str, edited: str):
         """
@@ -123,15 +150,27 @@ class StaffMemoryManager:
         """清除特定任務的記憶"""
         memory_key = f"content_task_{task_id}"
 
-        if memory_key in self.memory_store:
-            del self.memory_store[memory_key]
+        # 已被移出記憶體的任務也要刪除歷史
+        self.memory_store.pop(memory_key)
+        self.history_store.delete(memory_key)
+
+        # 尚未遷移的舊版 JSON 歷史檔
+        legacy_file = self.base_path / f"{memory_key}.json"
+        if legacy_file.exists():
+            legacy_file.unlink()
+
+        logger.info(f"清除記憶: {memory_key}")
 
-            # 刪除檔案
-            history_file = self.base_path / f"{memory_key}.json"
-            if history_file.exists():
-                history_file.unlink()
+    def stats(self) -> Dict[str, Any]:
+        """取得常駐記憶快取與歷史資料庫統計"""
+        return {
+            **self.memory_store.stats(),
+            "history_store": self.history_store.stats(),
+        }
 
-            logger.info(f"清除記憶: {memory_key}")
+    def close(self):
+        """提交尚未寫入的歷史並關閉資料庫"""
+        self.history_store.close()
 
     def get_learning_summary(self, task_id: str) -> dict:
         """
@@ -0,0 +1,161 @@
+"""
+模型分級路由模組
+依任務類型與輸入 / 輸出長度在設定的模型等級間選擇：
+問題改寫、對話摘要與簡短回覆使用 lite 模型，Agent 推理、最終回答與長篇文案使用 full 模型
+"""
+
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from loguru import logger
+
+from utils.metrics import LLM_TIER_SELECTIONS_TOTAL
+from utils.token_counter import count_tokens
+
+
+TIER_LITE = "lite"
+TIER_FULL = "full"
+TIER_AUTO = "auto"  # 依輸入與預期輸出長度決定
+
+TASK_CONDENSE = "condense"          # RAG Chain 的問題改寫
+TASK_SUMMARY = "summary"            # 對話摘要
+TASK_SHORT_REPLY = "short_reply"    # 單次 RAG 的簡短回覆
+TASK_AGENT_STEP = "agent_step"      # ReAct 推理步驟（含最終回答）
+TASK_FINAL_ANSWER = "final_answer"  # RAG Chain 的最終回答
+TASK_CONTENT = "content"            # 文案生成
+
+DEFAULT_TASK_TIERS = {
+    TASK_CONDENSE: TIER_LITE,
+    TASK_SUMMARY: TIER_LITE,
+    TASK_SHORT_REPLY: TIER_AUTO,
+    TASK_AGENT_STEP: TIER_FULL,
+    TASK_FINAL_ANSWER: TIER_FULL,
+    TASK_CONTENT: TIER_AUTO,
+}
+
+# 文案篇幅 -> 預期輸出字數上限（public 的 短/中/長 與 staff 的 short/medium/long）
+CONTENT_LENGTH_CHARS = {
+    "短": 100, "short": 100,
+    "中": 300, "medium": 300,
+    "長": 600, "long": 600,
+}
+
+
+def parse_task_tiers(spec: str) -> Dict[str, str]:
+    """
+    解析任務等級設定（未列出的任務使用預設值）
+
+    Args:
+        spec: "任務:等級" 以逗號分隔，例如 "short_reply:full,content:auto"
+
+    Returns:
+        任務 -> 等級 (lite/full/auto)
+
+    Raises:
+        ValueError: 格式或等級不正確時
+    """
+    task_tiers = dict(DEFAULT_TASK_TIERS)
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        task, _, tier = entry.partition(":")
+        if tier not in (TIER_LITE, TIER_FULL, TIER_AUTO):
+            raise ValueError(f"任務等級設定應為 任務:lite|full|auto，收到 {entry!r}")
+        task_tiers[task.strip()] = tier
+    return task_tiers
+
+
+def content_length_chars(length: str) -> int:
+    """文案篇幅對應的預期輸出字數（未知篇幅視為長篇）"""
+    return CONTENT_LENGTH_CHARS.get(length, CONTENT_LENGTH_CHARS["long"])
+
+
+class ModelRouter:
+    """
+    模型分級路由器
+
+    - 任務等級為 lite / full 時直接使用該等級
+    - auto：輸入不超過 lite_max_input_tokens 且預期輸出不超過 lite_max_output_chars 時用 lite，否則用 full
+    - 沒有設定 lite 模型時一律使用 full
+
+    Attributes:
+        tiers: 等級 -> LLM
+        task_tiers: 任務 -> 等級
+        lite_max_input_tokens: lite 模型處理的輸入 token 上限
+        lite_max_output_chars: lite 模型處理的預期輸出字數上限
+    """
+
+    def __init__(
+        self,
+        tiers: Dict[str, Any],
+        task_tiers: Optional[Dict[str, str]] = None,
+        lite_max_input_tokens: int = 2000,
+        lite_max_output_chars: int = 150
+    ):
+        self.tiers = {tier: model for tier, model in tiers.items() if model is not None}
+        if TIER_FULL not in self.tiers:
+            raise ValueError("ModelRouter 必須設定 full 等級的模型")
+        self.task_tiers = dict(task_tiers or DEFAULT_TASK_TIERS)
+        self.lite_max_input_tokens = lite_max_input_tokens
+        self.lite_max_output_chars = lite_max_output_chars
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+        models_desc = ", ".join(f"{tier}={getattr(model, 'model', '?')}" for tier, model in self.tiers.items())
+        logger.info(f"✅ModelRouter初始化完成 ({models_desc})")
+
+    def choose(self, task: str, input_tokens: int = 0, output_chars: int = 0) -> Tuple[str, str]:
+        """
+        決定任務使用的等級
+
+        Args:
+            task: 任務類型
+            input_tokens: 輸入 token 數
+            output_chars: 預期輸出字數（未知時為 0）
+
+        Returns:
+            (等級, 原因)
+        """
+        tier = self.task_tiers.get(task, TIER_FULL)
+        reason = "task"
+        if tier == TIER_AUTO:
+            if input_tokens > self.lite_max_input_tokens:
+                tier, reason = TIER_FULL, "long_input"
+            elif output_chars > self.lite_max_output_chars:
+                tier, reason = TIER_FULL, "long_output"
+            else:
+                tier, reason = TIER_LITE, "short"
+        if tier not in self.tiers:
+            tier, reason = TIER_FULL, "no_lite_model"
+        return tier, reason
+
+    def llm_for(self, task: str, text: str = "", output_chars: int = 0, record: bool = True):
+        """
+        取得任務使用的 LLM
+
+        Args:
+            task: 任務類型
+            text: 輸入文字（用於估算 token 數）
+            output_chars: 預期輸出字數
+            record: 是否計入統計（建立長期使用的 Agent / 摘要器時不計入）
+
+        Returns:
+            該等級的 LLM
+        """
+        tier, reason = self.choose(task, count_tokens(text) if text else 0, output_chars)
+        if record:
+            with self._lock:
+                counts = self._counts.setdefault(task, {})
+                counts[tier] = counts.get(tier, 0) + 1
+            LLM_TIER_SELECTIONS_TOTAL.labels(task=task, tier=tier, reason=reason).inc()
+        return self.tiers[tier]
+
+    def stats(self) -> Dict[str, Any]:
+        """取得各等級模型與各任務的選擇次數"""
+        with self._lock:
+            counts = {task: dict(c) for task, c in self._counts.items()}
+        return {
+            "models": {tier: getattr(model, "model", "") for tier, model in self.tiers.items()},
+            "task_tiers": dict(self.task_tiers),
+            "lite_max_input_tokens": self.lite_max_input_tokens,
+            "lite_max_output_chars": self.lite_max_output_chars,
+            "selections": counts,
+        }
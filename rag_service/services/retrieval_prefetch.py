@@ -0,0 +1,144 @@
+"""
+預先檢索模組
+請求進來時即以原始問題搜尋知識庫，與 Agent 第一次 LLM 推理並行；
+Agent 呼叫「搜尋知識庫」時若查詢與原始問題夠接近，直接使用預先檢索的結果
+"""
+
+import contextvars
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from loguru import logger
+
+from utils.concurrency import submit_blocking
+from utils.text_utils import char_bigram_overlap
+
+
+@dataclass
+class PrefetchHandle:
+    """單一請求的預先檢索狀態"""
+    query: str
+    future: Future
+    used: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+# 目前請求的預先檢索（以 contextvars 隔離，工具在執行緒池中也讀得到）
+_current_prefetch: contextvars.ContextVar[Optional[PrefetchHandle]] = contextvars.ContextVar(
+    "current_prefetch", default=None
+)
+
+
+class RetrievalPrefetcher:
+    """
+    知識庫預先檢索器
+
+    scope() 在請求開始時提交檢索並綁定到目前的 context；
+    工具函數以 consume() 取用，查詢相似度不足時回傳 None 讓工具照常檢索。
+
+    Attributes:
+        search_func: 實際執行檢索的同步函數，回傳工具輸出字串
+        min_similarity: 工具查詢與原始問題的字元 bigram 重疊係數門檻
+        wait_timeout: 等待預先檢索完成的最長秒數
+    """
+
+    def __init__(
+        self,
+        search_func: Callable[[str], str],
+        min_similarity: float = 0.6,
+        wait_timeout: float = 10.0
+    ):
+        self.search_func = search_func
+        self.min_similarity = min_similarity
+        self.wait_timeout = wait_timeout
+
+        self._lock = threading.Lock()
+        self._counters = {
+            "started": 0,
+            "hits": 0,
+            "mismatches": 0,
+            "failures": 0,
+            "unused": 0,
+        }
+
+        logger.info(f"✅RetrievalPrefetcher初始化完成 (相似度門檻: {min_similarity})")
+
+    @contextmanager
+    def scope(self, message: str) -> Iterator[Optional[PrefetchHandle]]:
+        """
+        開始預先檢索，並在區塊內讓工具可以取用結果
+
+        Args:
+            message: 使用者原始問題
+
+        Yields:
+            PrefetchHandle
+        """
+        handle = PrefetchHandle(query=message, future=submit_blocking(self.search_func, message))
+        self._count("started")
+        token = _current_prefetch.set(handle)
+        try:
+            yield handle
+        finally:
+            try:
+                _current_prefetch.reset(token)
+            except ValueError:
+                # 非同步產生器可能在不同的 context 中結束
+                _current_prefetch.set(None)
+            if not handle.used:
+                handle.future.cancel()
+                self._count("unused")
+
+    def consume(self, query: str) -> Optional[str]:
+        """
+        取用目前請求的預先檢索結果
+
+        Args:
+            query: Agent 傳給工具的查詢
+
+        Returns:
+            預先檢索的工具輸出；沒有預先檢索、查詢差異過大或檢索失敗時為 None
+        """
+        handle = _current_prefetch.get()
+        if handle is None:
+            return None
+
+        score = char_bigram_overlap(query, handle.query)
+        if score < self.min_similarity:
+            self._count("mismatches")
+            logger.debug(f"🔮 預先檢索未採用 (相似度 {score:.2f}): {query}")
+            return None
+
+        try:
+            result = handle.future.result(timeout=self.wait_timeout)
+        except Exception as e:
+            self._count("failures")
+            logger.warning(f"⚠️ 預先檢索失敗，改為即時檢索: {e}")
+            return None
+
+        with handle.lock:
+            first_use = not handle.used
+            handle.used = True
+        if first_use:
+            self._count("hits")
+        logger.info(f"🔮 使用預先檢索結果 (相似度 {score:.2f}): {query}")
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """取得預先檢索統計"""
+        with self._lock:
+            counters = dict(self._counters)
+        started = counters["started"]
+        return {
+            **counters,
+            "min_similarity": self.min_similarity,
+            "hit_rate": round(counters["hits"] / started, 4) if started else 0.0,
+        }
+
+    def _count(self, name: str):
+        """累加計數器"""
+        with self._lock:
+            self._counters[name] += 1
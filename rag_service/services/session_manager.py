@@ -0,0 +1,187 @@
+"""
+會話管理模組
+由伺服器核發 session ID，並以每個會話一把 asyncio.Lock 讓同一會話的對話依序處理
+"""
+
+import asyncio
+import re
+import secrets
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from loguru import logger
+
+
+# session ID 只允許英數字、底線與連字號（同時作為歷史檔名，避免路徑穿越）
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+# 舊版前端未帶 session_id 時使用的共用值，一律改發新的 ID
+LEGACY_SHARED_SESSION_IDS = ("default",)
+
+
+class SessionManager:
+    """
+    會話 ID 核發與會話鎖
+
+    - 未帶 session_id（或帶舊版共用的 "default"）的請求一律核發新的隨機 ID
+    - 帶入的 session_id 必須符合 SESSION_ID_PATTERN
+    - 同一會話的請求以 asyncio.Lock 排隊，依序讀寫對話記憶與歷史檔
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._waiters: Dict[str, int] = {}
+        self._holds: Dict[str, int] = {}
+        self._counters = {
+            "issued": 0,
+            "acquisitions": 0,
+            "contended": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+        }
+
+        logger.info("✅SessionManager初始化完成")
+
+    def issue(self, prefix: str = "user") -> str:
+        """
+        核發新的 session ID
+
+        Args:
+            prefix: ID 前綴（例如 "user"、"staff"）
+
+        Returns:
+            新的 session ID
+        """
+        self._counters["issued"] += 1
+        return f"{prefix}_{secrets.token_urlsafe(16)}"
+
+    def resolve(
+        self,
+        session_id: Optional[str],
+        prefix: str = "user"
+    ) -> Tuple[str, bool]:
+        """
+        取得本次請求使用的 session ID
+
+        Args:
+            session_id: 用戶端帶入的 session ID
+            prefix: 核發新 ID 時使用的前綴
+
+        Returns:
+            (session ID, 是否為新核發)
+
+        Raises:
+            ValueError: session ID 格式不正確時
+        """
+        if not session_id or session_id in LEGACY_SHARED_SESSION_IDS:
+            new_id = self.issue(prefix)
+            logger.info(f"🆔 核發新的 session ID: {new_id}")
+            return new_id, True
+        if not self.is_valid(session_id):
+            raise ValueError("session_id 格式不正確，只允許英數字、底線與連字號 (最長 128 字元)")
+        return session_id, False
+
+    @staticmethod
+    def is_valid(session_id: str) -> bool:
+        """
+        檢查 session ID 格式
+
+        Args:
+            session_id: session ID
+
+        Returns:
+            是否合法
+        """
+        return bool(session_id) and SESSION_ID_PATTERN.match(session_id) is not None
+
+    @asynccontextmanager
+    async def lock(self, session_id: str) -> AsyncIterator[None]:
+        """
+        取得會話鎖，同一會話的請求依到達順序處理
+
+        Args:
+            session_id: session ID
+        """
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        self._waiters[session_id] = self._waiters.get(session_id, 0) + 1
+
+        contended = lock.locked()
+        started_at = time.perf_counter()
+        try:
+            await lock.acquire()
+        except BaseException:
+            self._release_waiter(session_id)
+            raise
+
+        wait_ms = (time.perf_counter() - started_at) * 1000
+        self._counters["acquisitions"] += 1
+        if contended:
+            self._counters["contended"] += 1
+            self._counters["total_wait_ms"] += wait_ms
+            self._counters["max_wait_ms"] = max(self._counters["max_wait_ms"], wait_ms)
+            logger.info(f"⏳ [{session_id}] 等待同一會話的前一個請求 {wait_ms:.0f} ms")
+
+        try:
+            yield
+        finally:
+            lock.release()
+            self._release_waiter(session_id)
+
+    @contextmanager
+    def hold(self, session_id: str) -> Iterator[None]:
+        """
+        在區塊內將會話標記為使用中（例如 WebSocket 連線期間），
+        常駐記憶不會被淘汰、也不會被歸檔；不影響會話鎖
+
+        Args:
+            session_id: session ID
+        """
+        self._holds[session_id] = self._holds.get(session_id, 0) + 1
+        try:
+            yield
+        finally:
+            remaining = self._holds.get(session_id, 1) - 1
+            if remaining <= 0:
+                self._holds.pop(session_id, None)
+            else:
+                self._holds[session_id] = remaining
+
+    def is_active(self, session_id: str) -> bool:
+        """
+        檢查會話是否有請求正在處理、等待中或被連線保留
+
+        Args:
+            session_id: session ID
+
+        Returns:
+            是否使用中
+        """
+        return session_id in self._locks or session_id in self._holds
+
+    def stats(self) -> Dict[str, Any]:
+        """取得會話鎖統計"""
+        counters = dict(self._counters)
+        contended = counters["contended"]
+        return {
+            "issued": counters["issued"],
+            "acquisitions": counters["acquisitions"],
+            "contended": contended,
+            "contention_rate": round(contended / counters["acquisitions"], 4)
+            if counters["acquisitions"] else 0.0,
+            "avg_wait_ms": round(counters["total_wait_ms"] / contended, 1) if contended else 0.0,
+            "max_wait_ms": round(counters["max_wait_ms"], 1),
+            "active_locks": len(self._locks),
+            "held_sessions": len(self._holds),
+        }
+
+    def _release_waiter(self, session_id: str):
+        """沒有請求在使用時移除會話鎖，避免字典無限成長"""
+        remaining = self._waiters.get(session_id, 1) - 1
+        if remaining <= 0:
+            self._waiters.pop(session_id, None)
+            self._locks.pop(session_id, None)
+        else:
+            self._waiters[session_id] = remaining
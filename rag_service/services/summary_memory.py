@@ -0,0 +1,318 @@
+"""
+摘要式對話記憶模組
+在 token 預算內保留最近幾輪原文，較早的對話由背景工作折疊成滾動摘要，
+摘要與對話歷史存放在同一個 SQLite 資料庫（對話歷史支援 load_summary / save_summary 時）
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import BaseMessage, SystemMessage, get_buffer_string
+from langchain_core.pydantic_v1 import PrivateAttr
+from loguru import logger
+
+from utils.concurrency import submit_blocking
+from utils.token_counter import count_message_tokens, count_tokens
+
+
+SUMMARY_PROMPT = """你是對話紀錄整理助理。請將「先前摘要」與「新的對話」整合成一段新的摘要。
+
+要求：
+- 使用繁體中文，{max_chars} 字以內
+- 保留使用者關心的主題、提到的政策名稱、數字與尚未解決的問題
+- 不要加入對話中沒有出現的內容
+
+先前摘要：
+{summary}
+
+新的對話：
+{conversation}
+
+新的摘要："""
+
+
+class TokenBudgetMemory(ConversationBufferMemory):
+    """
+    有 token 預算的對話記憶
+
+    - 完整對話仍寫入 chat_memory（/api/memory 可看到全部內容）
+    - 送進 Prompt 的只有「滾動摘要 + 預算內最近 max_turns 輪原文」
+    - 超出預算的舊對話交給 MemorySummarizer 在背景折疊進摘要，不佔用請求時間
+    - summary / summarized_messages 由每份記憶自己的鎖保護：背景摘要套用前確認期間沒有被
+      重設或由其他摘要更新，否則捨棄本次結果
+    """
+
+    max_token_limit: int = 1500
+    max_turns: int = 6
+    summarizer: Any = None
+    summary: str = ""
+    summarized_messages: int = 0
+    summary_pending: bool = False
+
+    _summary_lock: Any = PrivateAttr(default_factory=threading.RLock)
+    # 每次重設摘要時遞增，背景摘要以此判斷期間是否被清除
+    _summary_epoch: int = PrivateAttr(default=0)
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._load_summary()
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """回傳摘要 + 預算內的最近對話"""
+        offset, messages = self._recent_window()
+        with self._summary_lock:
+            prompt_messages = self._prompt_messages(messages, offset)
+        return {self.memory_key: self._format(prompt_messages)}
+
+    async def aload_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """回傳摘要 + 預算內的最近對話（非同步）"""
+        if hasattr(self.chat_memory, "get_recent_messages"):
+            return self.load_memory_variables(inputs)
+        messages = await self.chat_memory.aget_messages()
+        with self._summary_lock:
+            prompt_messages = self._prompt_messages(messages)
+        return {self.memory_key: self._format(prompt_messages)}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """寫入本輪對話，超出預算時排程背景摘要"""
+        super().save_context(inputs, outputs)
+        self._maybe_schedule_summary()
+
+    def clear(self) -> None:
+        """清除對話與摘要"""
+        with self._summary_lock:
+            # SQLite 對話歷史清除時一併刪除摘要
+            super().clear()
+            self._reset_summary()
+
+    def flush(self) -> None:
+        """將摘要寫回資料庫（會話被移出記憶體前呼叫）"""
+        with self._summary_lock:
+            if self.summary:
+                self._write_summary()
+
+    def fold_history(self, summarize: Callable[[str, List[BaseMessage]], str]) -> bool:
+        """
+        將超出預算的舊對話折疊進摘要（由背景執行緒呼叫）
+
+        Args:
+            summarize: (先前摘要, 待折疊訊息) -> 新摘要
+
+        Returns:
+            是否更新了摘要（期間摘要被重設或已由其他工作更新時捨棄結果，回傳 False）
+        """
+        messages = self.chat_memory.messages
+        with self._summary_lock:
+            keep_from = self._keep_from(messages)
+            previous_summary = self.summary
+            summarized_from = self.summarized_messages
+            epoch = self._summary_epoch
+        if keep_from <= summarized_from:
+            return False
+
+        # 呼叫 LLM 期間不持鎖，請求路徑照常讀取記憶
+        new_summary = summarize(previous_summary, messages[summarized_from:keep_from])
+        if not new_summary:
+            return False
+
+        with self._summary_lock:
+            if self._summary_epoch != epoch or self.summarized_messages != summarized_from:
+                logger.info("📝 摘要期間對話記憶已變更，捨棄本次摘要")
+                return False
+            self.summary = new_summary.strip()
+            self.summarized_messages = keep_from
+            self._write_summary()
+        return True
+
+    def _recent_window(self) -> Tuple[int, List[BaseMessage]]:
+        """
+        取得計算 Prompt 所需的最近訊息
+
+        對話歷史支援 get_recent_messages（例如 SQLiteChatMessageHistory）時
+        只讀取最近 max_turns 輪多一點，否則讀取完整歷史。
+
+        Returns:
+            (第一則訊息在完整歷史中的位置, 訊息列表)
+        """
+        if hasattr(self.chat_memory, "get_recent_messages"):
+            total, messages = self.chat_memory.get_recent_messages(self.max_turns * 2 + 2)
+            return total - len(messages), messages
+        return 0, self.chat_memory.messages
+
+    def _prompt_messages(self, messages: List[BaseMessage], offset: int = 0) -> List[BaseMessage]:
+        """組合送進 Prompt 的訊息"""
+        recent = messages[self._keep_from(messages, offset) - offset:]
+        if not self.summary:
+            return recent
+        return [SystemMessage(content=f"先前對話摘要：{self.summary}")] + recent
+
+    def _keep_from(self, messages: List[BaseMessage], offset: int = 0) -> int:
+        """
+        計算保留原文的起始位置（完整歷史中的索引）
+
+        從最新的訊息往前累加，直到超過 token 預算或 max_turns 輪；
+        至少保留最近一輪，且不會從 AI 回覆中間開始。
+
+        Args:
+            messages: 完整歷史，或從 offset 開始的最近訊息
+            offset: messages[0] 在完整歷史中的位置
+        """
+        total = offset + len(messages)
+        if self.summarized_messages > total:
+            # 歷史被清除或取代，舊摘要已不適用
+            self._reset_summary()
+
+        budget = self.max_token_limit - count_tokens(self.summary)
+        start = total
+        used = 0
+        while start > max(self.summarized_messages, offset):
+            cost = count_message_tokens([messages[start - 1 - offset]])
+            kept = total - start
+            if kept >= 2 and (used + cost > budget or kept >= self.max_turns * 2):
+                break
+            used += cost
+            start -= 1
+
+        # 保留的部分從使用者訊息開始，避免出現沒有問題的回答
+        while start < total - 1 and messages[start - offset].type != "human":
+            start += 1
+        return max(start, self.summarized_messages)
+
+    def _reset_summary(self):
+        """清除摘要狀態（呼叫端需持有 _summary_lock）"""
+        self.summary = ""
+        self.summarized_messages = 0
+        self._summary_epoch += 1
+
+    def _format(self, messages: List[BaseMessage]) -> Any:
+        """依 return_messages 回傳訊息列表或字串"""
+        if self.return_messages:
+            return messages
+        return get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+
+    def _maybe_schedule_summary(self):
+        """有超出預算且尚未摘要的舊對話時排程背景摘要"""
+        if self.summarizer is None or self.summary_pending:
+            return
+        offset, messages = self._recent_window()
+        with self._summary_lock:
+            needs_summary = self._keep_from(messages, offset) > self.summarized_messages
+        if needs_summary:
+            self.summarizer.schedule(self)
+
+    def _load_summary(self):
+        """從對話歷史的資料庫載入既有摘要"""
+        load_summary = getattr(self.chat_memory, "load_summary", None)
+        if load_summary is None:
+            return
+        try:
+            data = load_summary()
+        except Exception as e:
+            logger.warning(f"⚠️ 讀取對話摘要失敗: {e}")
+            return
+        if data:
+            self.summary = data.get("summary", "")
+            self.summarized_messages = int(data.get("summarized_messages", 0))
+
+    def _write_summary(self):
+        """寫入摘要（對話歷史不支援摘要時只保留在記憶體）"""
+        save_summary = getattr(self.chat_memory, "save_summary", None)
+        if save_summary is not None:
+            save_summary(self.summary, self.summarized_messages)
+
+
+class MemorySummarizer:
+    """
+    背景對話摘要器
+
+    在共用執行緒池中呼叫 LLM，同一份記憶同時只會有一個摘要工作
+
+    Attributes:
+        llm: LangChain LLM 實例
+        max_summary_chars: 摘要字數上限
+    """
+
+    def __init__(self, llm, max_summary_chars: int = 300):
+        self.llm = llm
+        self.max_summary_chars = max_summary_chars
+
+        self._lock = threading.Lock()
+        self._counters = {
+            "scheduled": 0,
+            "completed": 0,
+            "failures": 0,
+            "total_ms": 0.0,
+        }
+
+        logger.info(f"✅MemorySummarizer初始化完成 (摘要上限: {max_summary_chars} 字)")
+
+    def schedule(self, memory: TokenBudgetMemory) -> bool:
+        """
+        排程背景摘要
+
+        Args:
+            memory: 對話記憶
+
+        Returns:
+            是否排程成功（已有進行中的摘要時為 False）
+        """
+        with self._lock:
+            if memory.summary_pending:
+                return False
+            memory.summary_pending = True
+            self._counters["scheduled"] += 1
+        submit_blocking(self._run, memory)
+        return True
+
+    def summarize(self, previous_summary: str, messages: List[BaseMessage]) -> str:
+        """
+        以 LLM 產生新的滾動摘要
+
+        Args:
+            previous_summary: 先前摘要
+            messages: 待折疊的訊息
+
+        Returns:
+            新摘要
+        """
+        prompt = SUMMARY_PROMPT.format(
+            max_chars=self.max_summary_chars,
+            summary=previous_summary or "（無）",
+            conversation=get_buffer_string(messages, human_prefix="市民", ai_prefix="善寶")
+        )
+        result = self.llm.invoke(prompt)
+        return getattr(result, "content", result)
+
+    def stats(self) -> Dict[str, Any]:
+        """取得摘要統計"""
+        with self._lock:
+            counters = dict(self._counters)
+        completed = counters["completed"]
+        return {
+            "scheduled": counters["scheduled"],
+            "completed": completed,
+            "failures": counters["failures"],
+            "avg_ms": round(counters["total_ms"] / completed, 1) if completed else 0.0,
+        }
+
+    def _run(self, memory: TokenBudgetMemory):
+        """背景執行摘要"""
+        started_at = time.perf_counter()
+        try:
+            updated = memory.fold_history(self.summarize)
+            elapsed_ms = (time.perf_counter() - started_at) * 1000
+            with self._lock:
+                self._counters["completed"] += 1
+                self._counters["total_ms"] += elapsed_ms
+            if updated:
+                logger.info(
+                    f"📝 對話摘要已更新 (折疊至第 {memory.summarized_messages} 則, {elapsed_ms:.0f} ms)"
+                )
+        except Exception as e:
+            with self._lock:
+                self._counters["failures"] += 1
+            logger.warning(f"⚠️ 背景對話摘要失敗: {e}")
+        finally:
+            memory.summary_pending = False
@@ -0,0 +1,258 @@
+"""
+WebSocket 對話模組
+一條連線對應一個會話：連線期間會話記憶常駐、依序處理每則訊息，
+串流送出 token 與工具進度，收到 cancel 訊框時中止進行中的 LLM 呼叫；
+送出端以有上限的緩衝區做背壓，客戶端長時間不讀取時關閉連線
+"""
+
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from loguru import logger
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+# 關閉代碼：1008 違反協定、1013 稍後再試（伺服器忙碌或客戶端讀取過慢）
+WS_CLOSE_POLICY_VIOLATION = 1008
+WS_CLOSE_TRY_AGAIN = 1013
+
+# 一則訊息的串流事件：(事件類型, 資料)，事件類型為 progress / token / done
+TurnRunner = Callable[[Dict[str, Any]], AsyncIterator[Tuple[str, Dict[str, Any]]]]
+
+
+class ChatSocketStalled(RuntimeError):
+    """客戶端超過時限未讀取，送出緩衝區持續滿載"""
+
+
+class ChatSocketHub:
+    """
+    WebSocket 對話連線管理（連線數上限與統計）
+
+    Attributes:
+        max_connections: 同時連線上限
+        send_buffer: 每條連線的送出緩衝訊框上限
+        send_timeout: 緩衝區滿載時等待客戶端讀取的時限（秒）
+        max_message_chars: 單則訊息字數上限
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 200,
+        send_buffer: int = 64,
+        send_timeout: float = 10.0,
+        max_message_chars: int = 2000
+    ):
+        self.max_connections = max_connections
+        self.send_buffer = max(send_buffer, 1)
+        self.send_timeout = send_timeout
+        self.max_message_chars = max_message_chars
+        self.connections = 0
+        self._counters = {
+            "accepted": 0,
+            "rejected": 0,
+            "messages": 0,
+            "completed": 0,
+            "cancelled": 0,
+            "busy": 0,
+            "coalesced_tokens": 0,
+            "stalled": 0,
+        }
+
+        logger.info(
+            f"✅ChatSocketHub初始化完成 (連線上限: {max_connections}, 緩衝: {self.send_buffer} 訊框, "
+            f"讀取時限: {send_timeout}s)"
+        )
+
+    def open(self) -> bool:
+        """登記新連線，超過上限時回傳 False"""
+        if self.connections >= self.max_connections:
+            self._counters["rejected"] += 1
+            return False
+        self.connections += 1
+        self._counters["accepted"] += 1
+        return True
+
+    def close(self):
+        """登記連線結束"""
+        self.connections -= 1
+
+    def count(self, name: str, amount: int = 1):
+        self._counters[name] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        """取得連線數與訊息統計"""
+        return {
+            "connections": self.connections,
+            "max_connections": self.max_connections,
+            "send_buffer": self.send_buffer,
+            "send_timeout": self.send_timeout,
+            **self._counters,
+        }
+
+
+class ChatSocket:
+    """
+    單一 WebSocket 對話連線
+
+    客戶端訊框（JSON）：
+    - {"type": "chat", "message": "...", "id": "可選的訊息 ID", "use_agent": true, "include_trace": false}
+    - {"type": "cancel"}：中止進行中的訊息
+    - {"type": "ping"}
+
+    伺服器訊框：
+    - {"type": "progress" | "token" | "done", "id": ..., ...}：與 SSE 相同的事件內容
+    - {"type": "cancelled", "id": ...}、{"type": "error", "id": ..., "detail": ...}、{"type": "pong"}
+
+    同一時間只處理一則訊息；緩衝區滿載時相鄰的 token 訊框合併，其他訊框等待客戶端讀取，
+    超過 send_timeout 仍無法送出時關閉連線
+    """
+
+    def __init__(self, websocket: WebSocket, hub: ChatSocketHub, session_id: str):
+        self.websocket = websocket
+        self.hub = hub
+        self.session_id = session_id
+        self._frames: Deque[Dict[str, Any]] = deque()
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._turn: Optional[asyncio.Task] = None
+        self._closing = False
+        self._stalled = False
+        self._stop = asyncio.Event()
+
+    async def serve(self, run_turn: TurnRunner):
+        """
+        處理連線直到客戶端離開
+
+        Args:
+            run_turn: 處理一則訊息的函數，傳入 chat 訊框，逐一產生 (事件類型, 資料)
+        """
+        sender = asyncio.create_task(self._send_loop())
+        stopper = asyncio.create_task(self._stop.wait())
+        try:
+            while True:
+                receiver = asyncio.create_task(self.websocket.receive_json())
+                await asyncio.wait({receiver, sender, stopper}, return_when=asyncio.FIRST_COMPLETED)
+                if not receiver.done():
+                    # 送出端停止（客戶端讀取過慢）
+                    receiver.cancel()
+                    break
+                try:
+                    frame = receiver.result()
+                except (ValueError, KeyError):
+                    await self.send({"type": "error", "detail": "訊框必須是 JSON 物件"})
+                    continue
+                await self._handle(frame, run_turn)
+        except WebSocketDisconnect:
+            pass
+        except ChatSocketStalled:
+            self._stalled = True
+        finally:
+            await self._cancel_turn()
+            for task in (sender, stopper):
+                task.cancel()
+            results = await asyncio.gather(sender, stopper, return_exceptions=True)
+            if self._stalled or isinstance(results[0], ChatSocketStalled):
+                self.hub.count("stalled")
+                logger.warning(f"⚠️ [{self.session_id}] 客戶端讀取過慢，關閉 WebSocket 連線")
+                try:
+                    await asyncio.wait_for(
+                        self.websocket.close(code=WS_CLOSE_TRY_AGAIN, reason="client too slow"), timeout=1.0
+                    )
+                except (asyncio.TimeoutError, RuntimeError):
+                    pass  # 連線已關閉或無法送出關閉訊框
+
+    async def _handle(self, frame: Any, run_turn: TurnRunner):
+        kind = frame.get("type") if isinstance(frame, dict) else None
+        if kind == "ping":
+            await self.send({"type": "pong"})
+        elif kind == "cancel":
+            if self._turn is not None and not self._turn.done():
+                self._turn.cancel()
+        elif kind == "chat":
+            message = str(frame.get("message") or "").strip()
+            if self._turn is not None and not self._turn.done():
+                self.hub.count("busy")
+                await self.send({"type": "error", "id": frame.get("id"), "detail": "上一則訊息仍在處理中"})
+            elif not message or len(message) > self.hub.max_message_chars:
+                await self.send({
+                    "type": "error",
+                    "id": frame.get("id"),
+                    "detail": f"訊息不可為空且不得超過 {self.hub.max_message_chars} 字"
+                })
+            else:
+                self.hub.count("messages")
+                self._turn = asyncio.create_task(self._run_turn(frame, run_turn))
+        else:
+            await self.send({"type": "error", "detail": f"不支援的訊框類型: {kind}"})
+
+    async def _run_turn(self, frame: Dict[str, Any], run_turn: TurnRunner):
+        turn_id = frame.get("id")
+        try:
+            async for event, data in run_turn(frame):
+                await self.send({"type": event, "id": turn_id, **data})
+            self.hub.count("completed")
+        except asyncio.CancelledError:
+            if self._closing:
+                raise
+            self.hub.count("cancelled")
+            logger.info(f"🛑 [{self.session_id}] 客戶端取消訊息 {turn_id}")
+            await self.send({"type": "cancelled", "id": turn_id})
+        except ChatSocketStalled:
+            self._stalled = True
+            self._stop.set()
+        except Exception as e:
+            logger.error(f"❌ [{self.session_id}] WebSocket 對話處理失敗: {e}", exc_info=True)
+            await self.send({"type": "error", "id": turn_id, "detail": f"對話處理失敗: {e}"})
+
+    async def _cancel_turn(self):
+        """連線結束時中止進行中的訊息"""
+        self._closing = True
+        if self._turn is not None and not self._turn.done():
+            self._turn.cancel()
+            try:
+                await self._turn
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    async def send(self, frame: Dict[str, Any]):
+        """
+        放入送出緩衝區
+
+        Args:
+            frame: 訊框
+
+        Raises:
+            ChatSocketStalled: 緩衝區滿載超過 send_timeout
+        """
+        last = self._frames[-1] if self._frames else None
+        if (
+            frame.get("type") == "token" and last is not None and last.get("type") == "token"
+            and last.get("id") == frame.get("id") and len(self._frames) >= self.hub.send_buffer
+        ):
+            # 客戶端讀取較慢時合併 token，不阻塞 LLM 串流
+            last["text"] += frame.get("text", "")
+            self.hub.count("coalesced_tokens")
+            return
+
+        while len(self._frames) >= self.hub.send_buffer:
+            self._writable.clear()
+            try:
+                await asyncio.wait_for(self._writable.wait(), timeout=self.hub.send_timeout)
+            except asyncio.TimeoutError:
+                raise ChatSocketStalled(f"客戶端超過 {self.hub.send_timeout}s 未讀取") from None
+        self._frames.append(frame)
+        self._readable.set()
+
+    async def _send_loop(self):
+        """依序送出緩衝區的訊框（單次送出超過 send_timeout 視為客戶端停止讀取）"""
+        while True:
+            while not self._frames:
+                self._readable.clear()
+                await self._readable.wait()
+            frame = self._frames.popleft()
+            self._writable.set()
+            try:
+                await asyncio.wait_for(self.websocket.send_json(frame), timeout=self.hub.send_timeout)
+            except asyncio.TimeoutError:
+                raise ChatSocketStalled(f"客戶端超過 {self.hub.send_timeout}s 未讀取") from None
@@ -1,6 +1,7 @@
 import os
 from fastapi import FastAPI, HTTPException, Depends, Header, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from loguru import logger
 from dotenv import load_dotenv
 
@@ -12,8 +13,14 @@ from services.content_generator import ContentGenerator
 from services.memory_manager import StaffMemoryManager
 from services.elevenlabs_service import ElevenLabsService
 from services.heygen_service import HeyGenService
+from services.llm_usage import LLMUsageTracker
+from services.admission import AdmissionScheduler, AdmissionRejected, PriorityClass
 from utils.db_helper import StaffDatabase
 from utils.task_manager import TaskManager
+from utils.llm_cassette import open_cassette
+from utils.llm_hedging import HedgePolicy
+from utils.llm_gateway import LLMGateway
+from utils.metrics import MetricsMiddleware, LLMMetricsCallback, render_metrics
 
 # 載入環境變數
 load_dotenv()
@@ -38,6 +45,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 各路由耗時（/metrics）
+app.add_middleware(MetricsMiddleware, service="staff")
+
 # ==================== 服務初始化 ====================
 
 # 資料庫與任務管理
@@ -45,8 +55,59 @@ db = StaffDatabase()
 task_mgr = TaskManager(db)
 
 # 記憶與文案生成
-memory_mgr = StaffMemoryManager()
-content_gen = ContentGenerator(memory_mgr)
+memory_mgr = StaffMemoryManager(
+    max_entries=int(os.getenv("STAFF_SESSION_CACHE_MAX_ENTRIES", 200)),
+    max_bytes=int(os.getenv("STAFF_SESSION_CACHE_MAX_MB", 32)) * 1024 * 1024,
+    idle_ttl_seconds=int(os.getenv("SESSION_CACHE_IDLE_SECONDS", 1800))
+)
+llm_cassette = open_cassette(
+    os.getenv("LLM_CASSETTE_MODE", "off").lower(),
+    os.path.join(os.getenv("LLM_CASSETTE_DIR", "cassettes"), "staff.jsonl"),
+    replay_latency=os.getenv("LLM_CASSETTE_REPLAY_LATENCY", "original").lower()
+)
+llm_metrics = LLMMetricsCallback()
+llm_usage = LLMUsageTracker(
+    db,
+    flush_interval=float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", 5)),
+    price_input_per_mtok=float(os.getenv("LLM_PRICE_INPUT_PER_MTOK", 0.10)),
+    price_output_per_mtok=float(os.getenv("LLM_PRICE_OUTPUT_PER_MTOK", 0.40))
+)
+# 與公眾服務共用同一個限流資料庫（./shared），兩邊合計不超過 Gemini 額度
+llm_gateway = LLMGateway(
+    os.getenv("LLM_GATEWAY_DB", "shared/llm_gateway.db"),
+    rpm=int(os.getenv("LLM_RPM_LIMIT", 2000)),
+    tpm=int(os.getenv("LLM_TPM_LIMIT", 4000000)),
+    service="staff",
+    max_attempts=int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", 4)),
+    base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", 0.5)),
+    max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", 8)),
+    max_wait=float(os.getenv("LLM_QUEUE_MAX_WAIT", 30))
+) if os.getenv("LLM_GATEWAY_ENABLED", "true").lower() == "true" else None
+hedge_policy = HedgePolicy(
+    pct=float(os.getenv("LLM_HEDGE_PERCENTILE", 90)),
+    budget=float(os.getenv("LLM_HEDGE_BUDGET", 0.05)),
+    min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+) if os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true" and llm_cassette is None else None
+content_gen = ContentGenerator(
+    memory_mgr,
+    cassette=llm_cassette,
+    callbacks=[llm_metrics, llm_usage],
+    max_output_tokens=int(os.getenv("STAFF_LLM_MAX_OUTPUT_TOKENS", 1024)),
+    hedge_policy=hedge_policy,
+    gateway=llm_gateway,
+    model=os.getenv("LLM_MODEL_FULL", "gemini-2.0-flash"),
+    lite_model=os.getenv("LLM_MODEL_LITE", "gemini-2.0-flash-lite")
+    if os.getenv("MODEL_ROUTER_ENABLED", "true").lower() == "true" else None
+)
+
+# 文案生成的准入排程（同時生成的篇數上限，超過時排隊）
+admission = AdmissionScheduler(
+    {"content": PriorityClass("content", max_concurrency=0)},
+    max_concurrency=int(os.getenv("STAFF_ADMISSION_MAX_CONCURRENCY", 2)),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 100)),
+    max_wait=float(os.getenv("STAFF_ADMISSION_MAX_WAIT", 120)),
+    service="staff"
+)
 
 # 多媒體服務
 voice_service = ElevenLabsService()
@@ -84,12 +145,19 @@ async def health_check():
     # 檢查 API keys 配置狀態
     elevenlabs_configured = bool(voice_service.api_key and voice_service.voice_id)
     heygen_configured = bool(heygen_service.api_key)
+    llm_status = llm_metrics.status()
 
     return {
-        "status": "healthy",
+        "status": "healthy" if llm_status["healthy"] else "degraded",
         "database": "✅ connected",
         "memory": "✅ active",
-        "llm": "✅ ready",
+        "llm": "✅ ready" if llm_status["healthy"] else "❌ last call failed",
+        "llm_status": llm_status,
+        "memory_cache": memory_mgr.stats(),
+        "llm_hedging": hedge_policy.stats() if hedge_policy else {"enabled": False},
+        "llm_gateway": llm_gateway.stats() if llm_gateway else {"enabled": False},
+        "admission": admission.stats(),
+        "model_router": content_gen.model_router.stats(),
         "services": {
             "elevenlabs": "✅ configured" if elevenlabs_configured else "⚠️ not configured",
             "heygen": "✅ configured" if heygen_configured else "⚠️ not configured"
@@ -97,6 +165,32 @@ async def health_check():
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 指標（文字格式）"""
+    rendered = render_metrics()
+    if rendered is None:
+        raise HTTPException(status_code=503, detail="未安裝 prometheus_client，無法輸出指標")
+    content, content_type = rendered
+    return Response(content=content, headers={"Content-Type": content_type})
+
+
+@app.get("/api/staff/llm-usage")
+async def get_llm_usage(
+    days: int = 7,
+    group_by: str = "session_id",
+    limit: int = 20,
+    authorized: bool = Depends(verify_password)
+):
+    """LLM 用量報表（group_by 為 session_id 時即各文案任務的用量）"""
+    if group_by not in StaffDatabase.LLM_USAGE_GROUPS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by 只能是 {', '.join(StaffDatabase.LLM_USAGE_GROUPS)}"
+        )
+    return llm_usage.report(days, group_by, max(1, min(limit, 200)))
+
+
 # ==================== 文案生成相關 ====================
 
 @app.post("/api/staff/content/generate", response_model=GenerateResponse)
@@ -122,13 +216,15 @@ async def generate_content(
             length=request.length.value
         )
         
-        # 生成文案
-        content = await content_gen.generate(
-            task_id=task_id,
-            topic=request.topic,
-            style=request.style.value,
-            length=request.length.value
-        )
+        # 生成文案（取得執行名額後進行，用量以任務 ID 作為會話歸屬）
+        async with admission.slot("content"):
+            with llm_usage.scope("/api/staff/content/generate", "staff", task_id):
+                content = await content_gen.generate(
+                    task_id=task_id,
+                    topic=request.topic,
+                    style=request.style.value,
+                    length=request.length.value
+                )
         
         # 儲存內容
         task_mgr.update_content(task_id, content, editor="system")
@@ -141,6 +237,9 @@ async def generate_content(
             message="文案生成完成，請審核"
         )
         
+    except AdmissionRejected as e:
+        logger.warning(f"⚠️ 文案生成未獲准入: {e}")
+        raise HTTPException(status_code=503, detail="文案生成排隊中的任務過多，請稍後再試")
     except Exception as e:
         logger.error(f"❌ 文案生成失敗: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -698,6 +797,17 @@ async def upload_file(
         raise HTTPException(status_code=500, detail=f"檔案上傳處理失敗: {str(e)}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """關閉前提交尚未寫入的對話歷史"""
+    memory_mgr.close()
+    if llm_cassette is not None:
+        llm_cassette.close()
+    llm_usage.close()
+    if llm_gateway is not None:
+        llm_gateway.close()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
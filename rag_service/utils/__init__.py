@@ -1,8 +1,10 @@
 """Utils 模組"""
 from .db_helper import StaffDatabase
 from .task_manager import TaskManager
+from .stream_parser import FinalAnswerStreamParser
 
 __all__ = [
     "StaffDatabase",
-    "TaskManager"
+    "TaskManager",
+    "FinalAnswerStreamParser"
 ]
\ No newline at end of file
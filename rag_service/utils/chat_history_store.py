@@ -0,0 +1,628 @@
+"""
+對話歷史儲存模組
+以單一 SQLite（WAL 模式）資料庫保存所有會話的訊息，取代每個會話一個 JSON 檔：
+- 新訊息只做 INSERT（append-only），由背景執行緒批次提交（write-behind）
+- 以 (session_id, id) 索引讀取最近 N 則訊息，不必整份載入
+- chat_sessions 表記錄每個會話的訊息數與最後活動時間，供統計與冷資料歸檔使用
+- 以訊息 ID 作為游標分頁讀取或逐批匯出，不建立 LangChain 訊息物件
+- chat_summaries 表保存 TokenBudgetMemory 的滾動摘要，與訊息一起刪除、歸檔
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from loguru import logger
+
+
+class ChatHistoryStore:
+    """
+    SQLite 對話歷史儲存
+
+    寫入先放進記憶體佇列，由背景執行緒每 flush_interval 秒
+    （或累積 batch_size 則）以一次交易提交；讀取時會合併尚未提交的訊息，
+    同一程序內寫入後立即可讀。程序異常終止時最多遺失 flush_interval 秒內的訊息。
+
+    Attributes:
+        db_path: 資料庫路徑
+        flush_interval: 批次提交間隔（秒）
+        batch_size: 累積多少則訊息時立即提交
+    """
+
+    def __init__(
+        self,
+        db_path: str = "chat_history/chat_history.db",
+        flush_interval: float = 0.5,
+        batch_size: int = 200
+    ):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        # 所有資料庫操作共用一條連線，以 _lock 序列化
+        self._lock = threading.RLock()
+        self._wakeup = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._init_db()
+
+        # 尚未提交的訊息: (session_id, message JSON, created_at)
+        self._pending: List[Tuple[str, str, str]] = []
+        self._closed = False
+        # compact 進行中時背景執行緒暫停提交，改由 compact 在每段 vacuum 之間提交
+        self._compacting = False
+        self._counters = {
+            "appended": 0,
+            "flushes": 0,
+            "flushed_messages": 0,
+            "flush_failures": 0,
+            "total_flush_ms": 0.0,
+        }
+
+        self._writer = threading.Thread(
+            target=self._write_loop,
+            name="chat-history-writer",
+            daemon=True
+        )
+        self._writer.start()
+
+        logger.info(f"✅ChatHistoryStore初始化完成: {self.db_path} (批次間隔: {flush_interval}s)")
+
+    def _init_db(self):
+        """初始化資料表與索引"""
+        with self._lock:
+            # auto_vacuum 只對新建立的資料庫生效，讓歸檔後釋放的空間可以歸還
+            self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_chat_messages_session
+                ON chat_messages (session_id, id)
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_sessions (
+                    session_id TEXT PRIMARY KEY,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    last_active TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_chat_sessions_last_active
+                ON chat_sessions (last_active)
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_summaries (
+                    session_id TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    summarized_messages INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            # 舊資料庫補建會話索引
+            self._conn.execute("""
+                INSERT OR IGNORE INTO chat_sessions (session_id, message_count, last_active)
+                SELECT session_id, COUNT(*), MAX(created_at) FROM chat_messages GROUP BY session_id
+            """)
+            self._conn.commit()
+
+    # ==================== 寫入 ====================
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]):
+        """
+        追加訊息（write-behind，背景批次提交）
+
+        Args:
+            session_id: 會話 ID
+            messages: LangChain 訊息列表
+        """
+        if not messages:
+            return
+        created_at = datetime.now().isoformat()
+        rows = [
+            (session_id, json.dumps(message_to_dict(m), ensure_ascii=False), created_at)
+            for m in messages
+        ]
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("ChatHistoryStore 已關閉")
+            self._pending.extend(rows)
+            self._counters["appended"] += len(rows)
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.notify()
+
+    def import_messages(
+        self,
+        session_id: str,
+        messages: Sequence[BaseMessage],
+        created_at: Optional[Sequence[str]] = None
+    ) -> bool:
+        """
+        直接匯入整段歷史（供遷移工具與歸檔還原使用，會話已有資料時略過）
+
+        Args:
+            session_id: 會話 ID
+            messages: LangChain 訊息列表
+            created_at: 各訊息原本的建立時間（None 表示以現在時間寫入）
+
+        Returns:
+            是否有匯入
+        """
+        if created_at is None or len(created_at) != len(messages):
+            created_at = [datetime.now().isoformat()] * len(messages)
+        with self._lock:
+            self._flush_locked()
+            if self._count_committed(session_id) > 0:
+                return False
+            rows = [
+                (session_id, json.dumps(message_to_dict(m), ensure_ascii=False), ts)
+                for m, ts in zip(messages, created_at)
+            ]
+            self._insert_rows(rows)
+            self._conn.commit()
+            return True
+
+    def delete(self, session_id: str) -> int:
+        """
+        刪除會話的所有訊息
+
+        Args:
+            session_id: 會話 ID
+
+        Returns:
+            刪除的訊息數
+        """
+        with self._lock:
+            pending = [row for row in self._pending if row[0] != session_id]
+            removed = len(self._pending) - len(pending)
+            self._pending = pending
+            cursor = self._conn.execute(
+                "DELETE FROM chat_messages WHERE session_id = ?", (session_id,)
+            )
+            self._conn.execute("DELETE FROM chat_sessions WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM chat_summaries WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+            return removed + cursor.rowcount
+
+    def save_summary(self, session_id: str, summary: str, summarized_messages: int):
+        """
+        寫入會話的滾動摘要（直接提交，摘要更新頻率遠低於訊息）
+
+        Args:
+            session_id: 會話 ID
+            summary: 摘要內容
+            summarized_messages: 已折疊進摘要的訊息數
+        """
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO chat_summaries (session_id, summary, summarized_messages, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    summarized_messages = excluded.summarized_messages,
+                    updated_at = excluded.updated_at
+            """, (session_id, summary, summarized_messages, datetime.now().isoformat()))
+            self._conn.commit()
+
+    def import_summary(self, session_id: str, summary: Dict[str, Any]) -> bool:
+        """
+        匯入摘要（供遷移工具與歸檔還原使用，會話已有摘要時略過）
+
+        Args:
+            session_id: 會話 ID
+            summary: {"summary", "summarized_messages", "updated_at"}
+
+        Returns:
+            是否有匯入
+        """
+        if not summary or not summary.get("summary"):
+            return False
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO chat_summaries (session_id, summary, summarized_messages, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    session_id,
+                    summary["summary"],
+                    int(summary.get("summarized_messages", 0)),
+                    summary.get("updated_at") or datetime.now().isoformat()
+                )
+            )
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def delete_if_unchanged(self, session_id: str, message_count: int) -> bool:
+        """
+        訊息數仍為 message_count 時才刪除會話（歸檔後確認期間沒有新訊息）
+
+        Args:
+            session_id: 會話 ID
+            message_count: 預期的訊息數
+
+        Returns:
+            是否有刪除
+        """
+        with self._lock:
+            if self.count(session_id) != message_count:
+                return False
+            self.delete(session_id)
+            return True
+
+    def compact(self, pages_per_step: int = 1000):
+        """
+        歸還刪除後的空白頁並截斷 WAL 檔
+
+        以獨立連線分段執行、不持有 _lock：WAL 模式下讀取不受影響；
+        期間背景執行緒暫停提交，待寫入的訊息在每段 vacuum 之間提交，
+        不會因等待資料庫寫入鎖而卡住進行中的對話請求
+
+        Args:
+            pages_per_step: 每段歸還的頁數
+        """
+        with self._lock:
+            self._flush_locked()
+            self._compacting = True
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        try:
+            # 舊資料庫未啟用 incremental auto_vacuum 時只截斷 WAL
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                while remaining > 0:
+                    conn.execute(f"PRAGMA incremental_vacuum({int(pages_per_step)})").fetchall()
+                    self.flush()
+                    previous, remaining = remaining, conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    if remaining >= previous:
+                        break
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        finally:
+            conn.close()
+            with self._lock:
+                self._compacting = False
+                self._wakeup.notify()
+
+    def flush(self):
+        """立即提交所有待寫入的訊息"""
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        """停止背景寫入並提交剩餘訊息"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._writer.join(timeout=5)
+        with self._lock:
+            self._flush_locked()
+            self._conn.close()
+        logger.info(f"💾 ChatHistoryStore 已關閉: {self.db_path}")
+
+    # ==================== 讀取 ====================
+
+    def get_messages(self, session_id: str, limit: Optional[int] = None) -> List[BaseMessage]:
+        """
+        取得會話訊息（依時間順序）
+
+        Args:
+            session_id: 會話 ID
+            limit: 只取最近幾則，None 表示全部
+
+        Returns:
+            LangChain 訊息列表
+        """
+        return self.get_recent(session_id, limit)[1]
+
+    def get_recent(
+        self,
+        session_id: str,
+        limit: Optional[int] = None
+    ) -> Tuple[int, List[BaseMessage]]:
+        """
+        取得會話訊息總數與最近的訊息
+
+        Args:
+            session_id: 會話 ID
+            limit: 只取最近幾則，None 表示全部
+
+        Returns:
+            (訊息總數, 最近的訊息列表)
+        """
+        with self._lock:
+            pending = [row[1] for row in self._pending if row[0] == session_id]
+            if limit is not None and len(pending) >= limit:
+                committed_rows = []
+            elif limit is None:
+                committed_rows = self._conn.execute(
+                    "SELECT message FROM chat_messages WHERE session_id = ? ORDER BY id",
+                    (session_id,)
+                ).fetchall()
+            else:
+                committed_rows = self._conn.execute(
+                    "SELECT message FROM chat_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                    (session_id, limit - len(pending))
+                ).fetchall()[::-1]
+            total = self._count_committed(session_id) + len(pending)
+
+        items = [row[0] for row in committed_rows] + pending
+        if limit is not None:
+            items = items[-limit:] if limit > 0 else []
+        return total, messages_from_dict([json.loads(item) for item in items])
+
+    def get_page(
+        self,
+        session_id: str,
+        before: Optional[int] = None,
+        limit: int = 50
+    ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        以訊息 ID 為游標，由新到舊分頁讀取
+
+        Args:
+            session_id: 會話 ID
+            before: 只取 ID 小於此值的訊息（None 表示從最新一則開始）
+            limit: 每頁則數
+
+        Returns:
+            (本頁訊息列表（依時間順序）, 下一頁的 before 游標，沒有更早的訊息時為 None)
+            每則訊息為 {"id", "created_at", "message": 訊息 dict}
+        """
+        with self._lock:
+            self._flush_locked()
+            rows = self._conn.execute(
+                "SELECT id, message, created_at FROM chat_messages "
+                "WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (session_id, before if before is not None else 2 ** 63 - 1, limit + 1)
+            ).fetchall()
+        has_more = len(rows) > limit
+        page = [self._row_to_item(row) for row in reversed(rows[:limit])]
+        return page, page[0]["id"] if has_more and page else None
+
+    def iter_messages(self, session_id: str, batch_size: int = 500) -> Iterator[List[Dict[str, Any]]]:
+        """
+        依時間順序逐批讀取會話訊息（匯出用，每批各自持鎖，不會長時間阻擋寫入）
+
+        Args:
+            session_id: 會話 ID
+            batch_size: 每批則數
+
+        Yields:
+            訊息列表，每則為 {"id", "created_at", "message": 訊息 dict}
+        """
+        after = 0
+        with self._lock:
+            self._flush_locked()
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, message, created_at FROM chat_messages "
+                    "WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (session_id, after, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield [self._row_to_item(row) for row in rows]
+            after = rows[-1][0]
+
+    def count(self, session_id: str) -> int:
+        """
+        取得會話訊息數
+
+        Args:
+            session_id: 會話 ID
+
+        Returns:
+            訊息數（含尚未提交的）
+        """
+        with self._lock:
+            pending = sum(1 for row in self._pending if row[0] == session_id)
+            return self._count_committed(session_id) + pending
+
+    def get_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        取得會話的滾動摘要
+
+        Args:
+            session_id: 會話 ID
+
+        Returns:
+            {"summary", "summarized_messages", "updated_at"}，沒有摘要時為 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, summarized_messages, updated_at FROM chat_summaries WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"summary": row[0], "summarized_messages": row[1], "updated_at": row[2]}
+
+    def session_count(self) -> int:
+        """取得有訊息的會話數"""
+        with self._lock:
+            self._flush_locked()
+            return self._conn.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()[0]
+
+    def idle_sessions(self, before: datetime, limit: int = 1000) -> List[str]:
+        """
+        取得最後活動時間早於 before 的會話
+
+        Args:
+            before: 時間界線
+            limit: 最多幾個
+
+        Returns:
+            session ID 列表（由最久未活動的開始）
+        """
+        with self._lock:
+            self._flush_locked()
+            rows = self._conn.execute(
+                "SELECT session_id FROM chat_sessions WHERE last_active < ? ORDER BY last_active LIMIT ?",
+                (before.isoformat(), limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def export_session(self, session_id: str) -> Dict[str, Any]:
+        """
+        匯出會話的原始訊息（供歸檔使用）
+
+        Args:
+            session_id: 會話 ID
+
+        Returns:
+            {"last_active": ..., "summary": 摘要 dict 或 None,
+             "messages": [訊息 dict, ...], "created_at": [各訊息的建立時間, ...]}
+        """
+        with self._lock:
+            self._flush_locked()
+            rows = self._conn.execute(
+                "SELECT message, created_at FROM chat_messages WHERE session_id = ? ORDER BY id",
+                (session_id,)
+            ).fetchall()
+            session = self._conn.execute(
+                "SELECT last_active FROM chat_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return {
+            "last_active": session[0] if session else None,
+            "summary": self.get_summary(session_id),
+            "messages": [json.loads(row[0]) for row in rows],
+            "created_at": [row[1] for row in rows],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """取得寫入統計"""
+        with self._lock:
+            counters = dict(self._counters)
+            pending = len(self._pending)
+        flushes = counters["flushes"]
+        return {
+            "db_path": str(self.db_path),
+            "pending": pending,
+            "appended": counters["appended"],
+            "flushes": flushes,
+            "flush_failures": counters["flush_failures"],
+            "avg_batch_size": round(counters["flushed_messages"] / flushes, 1) if flushes else 0.0,
+            "avg_flush_ms": round(counters["total_flush_ms"] / flushes, 2) if flushes else 0.0,
+        }
+
+    # ==================== 內部 ====================
+
+    @staticmethod
+    def _row_to_item(row: Tuple[int, str, str]) -> Dict[str, Any]:
+        return {"id": row[0], "created_at": row[2], "message": json.loads(row[1])}
+
+    def _count_committed(self, session_id: str) -> int:
+        """已提交的訊息數（呼叫端需持有 _lock）"""
+        row = self._conn.execute(
+            "SELECT message_count FROM chat_sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _insert_rows(self, rows: List[Tuple[str, str, str]]):
+        """寫入訊息並更新會話索引（呼叫端需持有 _lock 並負責 commit）"""
+        self._conn.executemany(
+            "INSERT INTO chat_messages (session_id, message, created_at) VALUES (?, ?, ?)",
+            rows
+        )
+        sessions: Dict[str, List] = {}
+        for session_id, _, created_at in rows:
+            entry = sessions.setdefault(session_id, [0, created_at])
+            entry[0] += 1
+            entry[1] = max(entry[1], created_at)
+        self._conn.executemany("""
+            INSERT INTO chat_sessions (session_id, message_count, last_active) VALUES (?, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET
+                message_count = message_count + excluded.message_count,
+                last_active = MAX(last_active, excluded.last_active)
+        """, [(session_id, count, last) for session_id, (count, last) in sessions.items()])
+
+    def _write_loop(self):
+        """背景執行緒：定期批次提交"""
+        with self._lock:
+            while not self._closed:
+                self._wakeup.wait(timeout=self.flush_interval)
+                if not self._compacting:
+                    self._flush_locked()
+
+    def _flush_locked(self):
+        """以單一交易提交待寫入的訊息（呼叫端需持有 _lock）"""
+        if not self._pending:
+            return
+        batch = self._pending
+        started_at = time.perf_counter()
+        try:
+            self._insert_rows(batch)
+            self._conn.commit()
+        except Exception as e:
+            self._conn.rollback()
+            self._counters["flush_failures"] += 1
+            logger.error(f"❌ 寫入對話歷史失敗 ({len(batch)} 則，稍後重試): {e}")
+            return
+
+        self._pending = []
+        self._counters["flushes"] += 1
+        self._counters["flushed_messages"] += len(batch)
+        self._counters["total_flush_ms"] += (time.perf_counter() - started_at) * 1000
+
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """
+    以 ChatHistoryStore 為後端的 LangChain 對話歷史
+
+    可直接替換 FileChatMessageHistory；另提供 get_recent_messages
+    讓 TokenBudgetMemory 只讀取最近幾則訊息，load_summary / save_summary 讀寫滾動摘要。
+    """
+
+    def __init__(self, session_id: str, store: ChatHistoryStore):
+        self.session_id = session_id
+        self.store = store
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore[override]
+        """取得完整對話歷史"""
+        return self.store.get_messages(self.session_id)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """追加訊息"""
+        self.store.append(self.session_id, messages)
+
+    def clear(self) -> None:
+        """清除對話歷史"""
+        self.store.delete(self.session_id)
+
+    def get_recent_messages(self, limit: int) -> Tuple[int, List[BaseMessage]]:
+        """
+        取得訊息總數與最近的訊息
+
+        Args:
+            limit: 最多幾則
+
+        Returns:
+            (訊息總數, 最近的訊息列表)
+        """
+        return self.store.get_recent(self.session_id, limit)
+
+    def load_summary(self) -> Optional[Dict[str, Any]]:
+        """取得會話的滾動摘要"""
+        return self.store.get_summary(self.session_id)
+
+    def save_summary(self, summary: str, summarized_messages: int) -> None:
+        """寫入會話的滾動摘要"""
+        self.store.save_summary(self.session_id, summary, summarized_messages)
+
+    def estimated_bytes(self) -> int:
+        """訊息存放在資料庫，不佔用常駐記憶體"""
+        return 0
@@ -0,0 +1,139 @@
+"""
+併發控制模組
+提供有上限的執行緒池，讓同步的 LLM / 向量檢索呼叫不會卡住事件迴圈
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+# 同步呼叫（Gemini、m3e、Qdrant）共用的執行緒池大小
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", 16))
+
+_blocking_executor = ThreadPoolExecutor(
+    max_workers=BLOCKING_POOL_SIZE,
+    thread_name_prefix="pais-blocking"
+)
+
+
+def get_blocking_executor() -> ThreadPoolExecutor:
+    """取得共用的執行緒池"""
+    return _blocking_executor
+
+
+def install_default_executor():
+    """
+    將共用執行緒池設為事件迴圈的預設 executor
+
+    LangChain 對沒有原生 async 實作的元件（例如 GoogleGenerativeAI）
+    會退回 run_in_executor(None, ...)，設定後這些呼叫也受到同一個上限控制。
+    必須在事件迴圈啟動後呼叫（例如 FastAPI startup 事件）。
+    """
+    asyncio.get_running_loop().set_default_executor(_blocking_executor)
+    logger.info(f"🧵 已設定預設執行緒池 (上限: {BLOCKING_POOL_SIZE})")
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    在共用執行緒池中執行同步函數，並保留呼叫端的 contextvars
+
+    Args:
+        func: 同步函數
+        *args: 位置參數
+        **kwargs: 關鍵字參數
+
+    Returns:
+        函數回傳值
+    """
+    ctx = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _blocking_executor,
+        partial(ctx.run, func, *args, **kwargs)
+    )
+
+
+def submit_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> Future:
+    """
+    將同步函數提交到共用執行緒池並立即返回 Future
+
+    與 run_blocking 不同，回傳的 concurrent.futures.Future
+    可以在其他執行緒中以 .result() 等待。
+
+    Args:
+        func: 同步函數
+        *args: 位置參數
+        **kwargs: 關鍵字參數
+
+    Returns:
+        concurrent.futures.Future
+    """
+    ctx = contextvars.copy_context()
+    return _blocking_executor.submit(partial(ctx.run, func, *args, **kwargs))
+
+
+class SingleFlight:
+    """
+    合併相同鍵值的併發非同步呼叫（single-flight）
+
+    同一個鍵在執行中時，後到的呼叫不會重新執行，而是等待第一個呼叫的結果。
+    實際執行以獨立的 Task 進行，第一個呼叫者斷線或被取消時，
+    其他等待者仍可取得結果。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        self._counters = {"executions": 0, "coalesced": 0}
+
+    async def do(
+        self,
+        key: Hashable,
+        func: Callable[[], Awaitable[T]]
+    ) -> Tuple[T, bool]:
+        """
+        執行或加入相同鍵值的呼叫
+
+        Args:
+            key: 合併用的鍵值
+            func: 無參數的 coroutine function
+
+        Returns:
+            (結果, 是否為共用他人的執行結果)
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(partial(self._forget, key))
+        with self._lock:
+            self._counters["coalesced" if shared else "executions"] += 1
+        return await asyncio.shield(task), shared
+
+    def stats(self) -> Dict[str, Any]:
+        """取得合併統計"""
+        with self._lock:
+            counters = dict(self._counters)
+        requests = counters["executions"] + counters["coalesced"]
+        return {
+            **counters,
+            "inflight": len(self._inflight),
+            "coalesce_rate": round(counters["coalesced"] / requests, 4) if requests else 0.0,
+        }
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        """執行完成後移除鍵值（只移除同一個 Task）"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # 避免沒有等待者時出現 "exception was never retrieved" 警告
+            task.exception()
@@ -5,6 +5,8 @@ from typing import Optional, List, Dict, Any
 import json
 from loguru import logger
 
+from utils.metrics import TimedConnection
+
 
 class StaffDatabase:
     """幕僚系統資料庫管理"""
@@ -72,13 +74,32 @@ class StaffDatabase:
             )
         """)
 
+        # LLM 用量表（每日 × 路由 × 角色 × 會話 × 模型 彙總）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS llm_usage_daily (
+                day TEXT NOT NULL,
+                route TEXT NOT NULL,
+                role TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                model TEXT NOT NULL,
+                calls INTEGER NOT NULL DEFAULT 0,
+                estimated_calls INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                latency_ms REAL NOT NULL DEFAULT 0,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (day, route, role, session_id, model)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_usage_session ON llm_usage_daily(session_id, day)")
+
         conn.commit()
         conn.close()
         logger.info(f"✅ 資料庫初始化完成: {self.db_path}")
     
     def _get_connection(self):
-        """取得資料庫連線"""
-        conn = sqlite3.connect(self.db_path)
+        """取得資料庫連線（每個 SQL 的耗時記錄到 /metrics）"""
+        conn = sqlite3.connect(self.db_path, factory=TimedConnection)
         conn.row_factory = sqlite3.Row  # 讓結果可以用欄位名稱存取
         return conn
     
@@ -361,4 +382,105 @@ class StaffDatabase:
         rows = cursor.fetchall()
         conn.close()
 
-        return [dict(row) for row in rows]
\ No newline at end of file
+        return [dict(row) for row in rows]
+
+    # ==================== LLM Usage ====================
+
+    # 可用來排行的欄位（避免 SQL 注入，只接受這些欄位名稱）
+    LLM_USAGE_GROUPS = ("session_id", "route", "role", "day", "model")
+
+    def add_llm_usage(self, rows: List[Dict[str, Any]]):
+        """
+        累加 LLM 用量（同一天、路由、角色、會話、模型的資料合併為一列）
+
+        Args:
+            rows: [{"day", "route", "role", "session_id", "model", "calls", "estimated_calls",
+                    "prompt_tokens", "completion_tokens", "latency_ms"}, ...]
+        """
+        if not rows:
+            return
+        now = datetime.now().isoformat()
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO llm_usage_daily
+            (day, route, role, session_id, model, calls, estimated_calls,
+             prompt_tokens, completion_tokens, latency_ms, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(day, route, role, session_id, model) DO UPDATE SET
+                calls = calls + excluded.calls,
+                estimated_calls = estimated_calls + excluded.estimated_calls,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                completion_tokens = completion_tokens + excluded.completion_tokens,
+                latency_ms = latency_ms + excluded.latency_ms,
+                updated_at = excluded.updated_at
+        """, [
+            (
+                row["day"], row["route"], row["role"], row["session_id"], row["model"],
+                row["calls"], row["estimated_calls"], row["prompt_tokens"],
+                row["completion_tokens"], row["latency_ms"], now
+            )
+            for row in rows
+        ])
+        conn.commit()
+        conn.close()
+
+    def get_llm_usage_totals(self, since_day: str) -> Dict[str, Any]:
+        """
+        取得指定日期以來的 LLM 用量總計
+
+        Args:
+            since_day: 起始日期 (YYYY-MM-DD，含當天)
+
+        Returns:
+            {"calls", "estimated_calls", "prompt_tokens", "completion_tokens", "latency_ms"}
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COALESCE(SUM(calls), 0) AS calls,
+                   COALESCE(SUM(estimated_calls), 0) AS estimated_calls,
+                   COALESCE(SUM(prompt_tokens), 0) AS prompt_tokens,
+                   COALESCE(SUM(completion_tokens), 0) AS completion_tokens,
+                   COALESCE(SUM(latency_ms), 0) AS latency_ms
+            FROM llm_usage_daily WHERE day >= ?
+        """, (since_day,))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row)
+
+    def get_llm_usage_top(self, since_day: str, group_by: str = "session_id", limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        依指定欄位彙總 LLM 用量，依總 token 數由大到小排序
+
+        Args:
+            since_day: 起始日期 (YYYY-MM-DD，含當天)
+            group_by: 彙總欄位 (LLM_USAGE_GROUPS 之一)
+            limit: 回傳筆數
+
+        Returns:
+            [{group_by, "calls", "prompt_tokens", "completion_tokens", "total_tokens", "latency_ms"}, ...]
+
+        Raises:
+            ValueError: group_by 不支援時
+        """
+        if group_by not in self.LLM_USAGE_GROUPS:
+            raise ValueError(f"group_by 只能是 {', '.join(self.LLM_USAGE_GROUPS)}")
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {group_by},
+                   SUM(calls) AS calls,
+                   SUM(prompt_tokens) AS prompt_tokens,
+                   SUM(completion_tokens) AS completion_tokens,
+                   SUM(prompt_tokens + completion_tokens) AS total_tokens,
+                   SUM(latency_ms) AS latency_ms
+            FROM llm_usage_daily
+            WHERE day >= ?
+            GROUP BY {group_by}
+            ORDER BY total_tokens DESC
+            LIMIT ?
+        """, (since_day, limit))
+        rows = cursor.fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
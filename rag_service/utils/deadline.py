@@ -0,0 +1,211 @@
+"""
+請求期限模組
+每個對話請求依角色取得總時限，Agent 在每一步之前檢查剩餘時間，
+時間不足時改走降級路徑（單次 RAG 或擷取式回答）
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, TypeVar
+
+from loguru import logger
+
+from utils.metrics import CHAT_DEGRADATIONS_TOTAL
+
+
+T = TypeVar("T")
+
+# 降級層級（回應的 degradation 欄位）
+DEGRADATION_NONE = "none"              # 正常完成
+DEGRADATION_RAG = "rag"                # 時間不足，改用單次 RAG
+DEGRADATION_EXTRACTIVE = "extractive"  # LLM 無法使用或已超過期限，直接摘錄知識庫內容
+DEGRADATION_TIERS = (DEGRADATION_NONE, DEGRADATION_RAG, DEGRADATION_EXTRACTIVE)
+
+
+class Deadline:
+    """
+    單一請求的期限
+
+    Attributes:
+        seconds: 總時限（秒）
+        step_seconds: 預估一個 Agent 步驟所需時間（秒）
+        rag_seconds: 執行單次 RAG 至少需要的時間（秒）
+        exhausted: Agent 是否因剩餘時間不足而提前停止
+    """
+
+    def __init__(self, seconds: float, step_seconds: float, rag_seconds: float):
+        self.seconds = seconds
+        self.step_seconds = step_seconds
+        self.rag_seconds = rag_seconds
+        self.expires_at = time.perf_counter() + seconds
+        self.exhausted = False
+
+    def remaining(self) -> float:
+        """剩餘秒數（已超過期限時為 0）"""
+        return max(self.expires_at - time.perf_counter(), 0.0)
+
+    def expired(self) -> bool:
+        """是否已超過期限"""
+        return self.remaining() <= 0
+
+    def allows_step(self, iterations: int = 0, time_elapsed: float = 0.0) -> bool:
+        """
+        剩餘時間是否足夠再執行一個 Agent 步驟
+
+        預估耗時取設定值與本請求目前每步平均耗時的較大者；不足時標記 exhausted
+
+        Args:
+            iterations: 已完成的步數
+            time_elapsed: Agent 已執行的秒數
+
+        Returns:
+            是否可以繼續
+        """
+        estimate = self.step_seconds
+        if iterations:
+            estimate = max(estimate, time_elapsed / iterations)
+        if self.remaining() >= estimate:
+            return True
+        self.exhausted = True
+        return False
+
+    def allows_rag(self) -> bool:
+        """剩餘時間是否足夠執行單次 RAG"""
+        return self.remaining() >= self.rag_seconds
+
+
+class DeadlinePolicy:
+    """
+    各角色的請求期限設定與降級統計
+
+    Attributes:
+        seconds_by_role: 角色 -> 總時限（秒，0 表示不限）
+        step_seconds: 預估一個 Agent 步驟所需時間（秒）
+        rag_seconds: 執行單次 RAG 至少需要的時間（秒）
+    """
+
+    def __init__(
+        self,
+        seconds_by_role: Dict[str, float],
+        step_seconds: float = 4.0,
+        rag_seconds: float = 3.0
+    ):
+        self.seconds_by_role = dict(seconds_by_role)
+        self.step_seconds = step_seconds
+        self.rag_seconds = rag_seconds
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+        roles_desc = ", ".join(f"{role}={seconds:g}s" for role, seconds in self.seconds_by_role.items())
+        logger.info(f"✅DeadlinePolicy初始化完成 ({roles_desc})")
+
+    def start(self, role: str) -> Optional[Deadline]:
+        """
+        為新請求建立期限
+
+        Args:
+            role: 角色
+
+        Returns:
+            Deadline，該角色不限時時為 None
+        """
+        seconds = self.seconds_by_role.get(role, 0)
+        if seconds <= 0:
+            return None
+        self._count(role, "requests")
+        return Deadline(seconds, self.step_seconds, self.rag_seconds)
+
+    def record(self, role: str, tier: str):
+        """
+        記錄一次降級
+
+        Args:
+            role: 角色
+            tier: 降級層級 (rag/extractive)
+        """
+        self._count(role, tier)
+        CHAT_DEGRADATIONS_TOTAL.labels(role=role, tier=tier).inc()
+
+    def _count(self, role: str, name: str):
+        with self._lock:
+            counts = self._counts.setdefault(role, {"requests": 0, DEGRADATION_RAG: 0, DEGRADATION_EXTRACTIVE: 0})
+            counts[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """取得期限設定與各角色的請求數 / 降級次數"""
+        with self._lock:
+            counts = {role: dict(c) for role, c in self._counts.items()}
+        return {
+            "seconds_by_role": dict(self.seconds_by_role),
+            "step_seconds": self.step_seconds,
+            "rag_seconds": self.rag_seconds,
+            "degradations": counts,
+        }
+
+
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """
+    在區塊內設定目前請求的期限（Agent 執行器由此讀取）
+
+    Args:
+        deadline: 期限（None 表示不限時）
+
+    Yields:
+        同一個 deadline
+    """
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        try:
+            _current_deadline.reset(token)
+        except ValueError:
+            pass  # 串流中斷時產生器可能在其他 context 中被關閉
+
+
+def current_deadline() -> Optional[Deadline]:
+    """取得目前請求的期限"""
+    return _current_deadline.get()
+
+
+async def iter_until_deadline(
+    iterator: AsyncIterator[T],
+    deadline: Optional[Deadline],
+    enforce: Callable[[], bool] = lambda: True
+) -> AsyncIterator[T]:
+    """
+    逐一取出非同步迭代器的項目，等待下一個項目超過剩餘時間時拋出 TimeoutError
+
+    Args:
+        iterator: 非同步迭代器（例如 astream_events）
+        deadline: 期限（None 表示不限時）
+        enforce: 回傳 False 時不限制等待時間（例如已開始輸出回覆，不中途截斷）
+
+    Yields:
+        迭代器的項目
+
+    Raises:
+        TimeoutError: 超過期限時
+    """
+    it = iterator.__aiter__()
+    try:
+        while True:
+            try:
+                if deadline is None or not enforce():
+                    item = await it.__anext__()
+                else:
+                    item = await asyncio.wait_for(it.__anext__(), timeout=deadline.remaining())
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        aclose = getattr(it, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,46 @@
+"""
+延遲統計工具
+百分位數與延遲分佈彙整（服務統計與基準測試共用）
+"""
+
+import math
+from typing import Dict, List
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    計算百分位數（最近排名法）
+
+    Args:
+        values: 數值列表
+        pct: 百分位 (0-100)
+
+    Returns:
+        百分位數值，列表為空時回傳 0
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize_latencies(latencies_ms: List[float]) -> Dict[str, float]:
+    """
+    彙整延遲分佈
+
+    Args:
+        latencies_ms: 延遲列表（毫秒）
+
+    Returns:
+        平均、p50、p95、p99 與最大值
+    """
+    if not latencies_ms:
+        return {"avg_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    return {
+        "avg_ms": round(sum(latencies_ms) / len(latencies_ms), 1),
+        "p50_ms": round(percentile(latencies_ms, 50), 1),
+        "p95_ms": round(percentile(latencies_ms, 95), 1),
+        "p99_ms": round(percentile(latencies_ms, 99), 1),
+        "max_ms": round(max(latencies_ms), 1),
+    }
@@ -0,0 +1,395 @@
+"""
+LLM / Embedding 錄製與重播（cassette）
+record 模式把每一次 Gemini 呼叫（Prompt、輸出、逐塊時間）與 Embedding 輸入輸出寫入 JSONL 檔；
+replay 模式從檔案回放，可選擇依原始時間或零延遲輸出，讓問題可以離線重現、
+量測 LLM 以外的處理開銷，或在不連網的情況下回歸測試 Prompt 修改
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.language_models.llms import LLM, BaseLLM
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult, GenerationChunk
+from langchain_core.runnables import Runnable
+from loguru import logger
+
+CASSETTE_MODES = ("off", "record", "replay")
+
+
+class CassetteMissError(RuntimeError):
+    """重播時找不到對應的錄製內容"""
+
+
+def _fingerprint(payload: Any) -> str:
+    """將請求內容轉為穩定的雜湊鍵值"""
+    text = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    錄製檔
+
+    每行一筆 {"kind", "key", "recorded_at", "request", "chunks": [[offset_ms, 內容], ...]}；
+    chunks 記錄每一塊輸出距離呼叫開始的時間，重播時依此還原首個 token 延遲與輸出速率。
+    相同請求出現多次時依錄製順序回放，用完後重複最後一筆
+
+    Attributes:
+        path: 錄製檔路徑
+        mode: "record" 或 "replay"
+        replay_latency: "original"（依原始時間）或 "none"（零延遲）
+    """
+
+    def __init__(self, path: str, mode: str = "record", replay_latency: str = "original"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"不支援的 cassette 模式: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._cursors: Dict[str, int] = defaultdict(int)
+        self._counters = {"recorded": 0, "replayed": 0, "misses": 0}
+        self._file = None
+
+        if mode == "replay":
+            if not self.path.exists():
+                raise FileNotFoundError(f"找不到錄製檔: {self.path}")
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]].append(entry)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+
+        loaded = sum(len(v) for v in self._entries.values())
+        detail = f"{loaded} 筆, 延遲: {replay_latency}" if mode == "replay" else "錄製中"
+        logger.info(f"✅Cassette初始化完成: {self.path} ({mode}, {detail})")
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    def record(self, kind: str, request: Dict[str, Any], chunks: List[Tuple[float, Any]]):
+        """
+        寫入一筆錄製內容
+
+        Args:
+            kind: "llm"、"chat" 或 "embedding"
+            request: 請求內容（用來計算鍵值，並保留在檔案中方便檢視）
+            chunks: [(距離開始的毫秒數, 輸出內容), ...]
+        """
+        entry = {
+            "kind": kind,
+            "key": _fingerprint([kind, request]),
+            "recorded_at": datetime.now().isoformat(),
+            "request": request,
+            "chunks": [[round(offset_ms, 1), content] for offset_ms, content in chunks],
+        }
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._counters["recorded"] += 1
+
+    def replay(self, kind: str, request: Dict[str, Any]) -> List[Tuple[float, Any]]:
+        """
+        取得錄製內容
+
+        Args:
+            kind: "llm"、"chat" 或 "embedding"
+            request: 請求內容
+
+        Returns:
+            [(距離開始的毫秒數, 輸出內容), ...]
+
+        Raises:
+            CassetteMissError: 找不到對應的錄製內容時
+        """
+        key = _fingerprint([kind, request])
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self._counters["misses"] += 1
+                raise CassetteMissError(f"錄製檔中沒有這個 {kind} 請求 (key: {key[:12]})")
+            index = min(self._cursors[key], len(entries) - 1)
+            self._cursors[key] += 1
+            self._counters["replayed"] += 1
+        return [(offset_ms, content) for offset_ms, content in entries[index]["chunks"]]
+
+    def paced(self, chunks: List[Tuple[float, Any]]) -> Iterator[Any]:
+        """依錄製時間（或零延遲）逐塊產出內容"""
+        started_at = time.perf_counter()
+        for offset_ms, content in chunks:
+            if self.replay_latency == "original":
+                remaining = offset_ms / 1000 - (time.perf_counter() - started_at)
+                if remaining > 0:
+                    time.sleep(remaining)
+            yield content
+
+    def stats(self) -> Dict[str, Any]:
+        """取得錄製 / 重播統計"""
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "path": str(self.path),
+                "replay_latency": self.replay_latency,
+                "entries": sum(len(v) for v in self._entries.values()),
+                **self._counters,
+            }
+
+    def close(self):
+        """關閉錄製檔"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _message_key(message: BaseMessage) -> Dict[str, Any]:
+    """訊息中會影響模型輸出的欄位（排除每次執行都不同的 run id 與 metadata）"""
+    return {
+        "type": message.type,
+        "content": message.content,
+        "tool_calls": getattr(message, "tool_calls", None),
+        "tool_call_id": getattr(message, "tool_call_id", None),
+        "name": message.name,
+    }
+
+
+class _Timer:
+    """記錄每一塊輸出距離開始的時間"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1000
+
+
+class CassetteLLM(LLM):
+    """
+    包裝 GoogleGenerativeAI 的錄製 / 重播 LLM
+
+    直接呼叫內部 LLM 的 _generate / _stream，Callback 與串流事件只由外層發出一次
+    """
+
+    inner: BaseLLM
+    cassette: Any
+    model: str = ""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return f"cassette-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.inner._identifying_params
+
+    def _request(self, prompt: str, stop: Optional[List[str]]) -> Dict[str, Any]:
+        return {"llm": self.inner._identifying_params, "prompt": prompt, "stop": stop}
+
+    def _call(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> str:
+        request = self._request(prompt, stop)
+        if not self.cassette.recording:
+            return "".join(self.cassette.paced(self.cassette.replay("llm", request)))
+
+        timer = _Timer()
+        result = self.inner._generate([prompt], stop=stop, **kwargs)
+        text = result.generations[0][0].text
+        self.cassette.record("llm", request, [(timer.elapsed_ms(), text)])
+        return text
+
+    def _stream(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        request = self._request(prompt, stop)
+        if self.cassette.recording:
+            timer = _Timer()
+            chunks = []
+            for chunk in self.inner._stream(prompt, stop=stop, **kwargs):
+                chunks.append((timer.elapsed_ms(), chunk.text))
+                yield self._emit(chunk.text, run_manager)
+            self.cassette.record("llm", request, chunks)
+        else:
+            for text in self.cassette.paced(self.cassette.replay("llm", request)):
+                yield self._emit(text, run_manager)
+
+    @staticmethod
+    def _emit(text: str, run_manager) -> GenerationChunk:
+        chunk = GenerationChunk(text=text)
+        if run_manager:
+            run_manager.on_llm_new_token(text, chunk=chunk)
+        return chunk
+
+
+class CassetteChatModel(BaseChatModel):
+    """
+    包裝 ChatGoogleGenerativeAI 的錄製 / 重播聊天模型（Function Calling Agent 使用）
+
+    bind_tools 交給內部模型轉換工具定義後綁定在外層，工具定義也會納入鍵值
+    """
+
+    inner: BaseChatModel
+    cassette: Any
+    model: str = ""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return f"cassette-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.inner._identifying_params
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> Runnable:
+        bound = self.inner.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(bound, "kwargs", {}))
+
+    def _request(self, messages: List[BaseMessage], stop: Optional[List[str]], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "llm": self.inner._identifying_params,
+            "messages": [_message_key(m) for m in messages],
+            "stop": stop,
+            "kwargs": kwargs,
+        }
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        request = self._request(messages, stop, kwargs)
+        if self.cassette.recording:
+            timer = _Timer()
+            result = self.inner._generate(messages, stop=stop, **kwargs)
+            message = result.generations[0].message
+            self.cassette.record("chat", request, [(timer.elapsed_ms(), message_to_dict(message))])
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        recorded = messages_from_dict(list(self.cassette.paced(self.cassette.replay("chat", request))))
+        message = recorded[0]
+        for chunk in recorded[1:]:
+            message = message + chunk
+        if isinstance(message, AIMessageChunk):
+            message = AIMessage(content=message.content, tool_calls=message.tool_calls)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        request = self._request(messages, stop, kwargs)
+        if self.cassette.recording:
+            timer = _Timer()
+            chunks = []
+            for chunk in self.inner._stream(messages, stop=stop, **kwargs):
+                chunks.append((timer.elapsed_ms(), message_to_dict(chunk.message)))
+                yield self._emit(chunk.message, run_manager)
+            self.cassette.record("chat", request, chunks)
+        else:
+            for data in self.cassette.paced(self.cassette.replay("chat", request)):
+                message = messages_from_dict([data])[0]
+                if not isinstance(message, AIMessageChunk):
+                    message = AIMessageChunk(content=message.content, tool_call_chunks=[
+                        {
+                            "name": call["name"],
+                            "args": json.dumps(call["args"], ensure_ascii=False),
+                            "id": call.get("id"),
+                            "index": i,
+                        }
+                        for i, call in enumerate(getattr(message, "tool_calls", []))
+                    ])
+                yield self._emit(message, run_manager)
+
+    @staticmethod
+    def _emit(message: AIMessageChunk, run_manager) -> ChatGenerationChunk:
+        chunk = ChatGenerationChunk(message=message)
+        if run_manager:
+            run_manager.on_llm_new_token(str(message.content), chunk=chunk)
+        return chunk
+
+
+class CassetteEmbeddings(Embeddings):
+    """
+    錄製 / 重播 Embedding（以模型名稱 + 文字為鍵值，每段文字一筆）
+
+    重播模式下不會載入實際的 Embedding 模型，可完全離線執行
+    """
+
+    def __init__(self, factory: Callable[[], Embeddings], cassette: Cassette, model_name: str):
+        self.factory = factory
+        self.cassette = cassette
+        self.model_name = model_name
+        self._inner: Optional[Embeddings] = factory() if cassette.recording else None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not self.cassette.recording:
+            return [self._replay(text) for text in texts]
+
+        timer = _Timer()
+        vectors = self._inner.embed_documents(texts)
+        per_text_ms = timer.elapsed_ms() / max(len(texts), 1)
+        for text, vector in zip(texts, vectors):
+            self.cassette.record("embedding", self._request(text), [(per_text_ms, vector)])
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        if not self.cassette.recording:
+            return self._replay(text)
+
+        timer = _Timer()
+        vector = self._inner.embed_query(text)
+        self.cassette.record("embedding", self._request(text), [(timer.elapsed_ms(), vector)])
+        return vector
+
+    def _request(self, text: str) -> Dict[str, Any]:
+        return {"model": self.model_name, "text": text}
+
+    def _replay(self, text: str) -> List[float]:
+        return list(self.cassette.paced(self.cassette.replay("embedding", self._request(text))))[-1]
+
+
+def open_cassette(mode: str, path: str, replay_latency: str = "original") -> Optional[Cassette]:
+    """
+    依設定建立 Cassette（mode 為 "off" 時回傳 None）
+
+    Args:
+        mode: "off"、"record" 或 "replay"
+        path: 錄製檔路徑
+        replay_latency: "original" 或 "none"
+
+    Returns:
+        Cassette 或 None
+    """
+    if mode not in CASSETTE_MODES:
+        raise ValueError(f"LLM_CASSETTE_MODE 只能是 {', '.join(CASSETTE_MODES)}，收到: {mode}")
+    if mode == "off":
+        return None
+    return Cassette(path, mode=mode, replay_latency=replay_latency)
+
+
+def wrap_llm(llm: BaseLLM, cassette: Optional[Cassette]) -> BaseLLM:
+    """有 Cassette 時包裝 LLM，否則原樣回傳"""
+    if cassette is None:
+        return llm
+    return CassetteLLM(
+        inner=llm, cassette=cassette, model=getattr(llm, "model", ""), callbacks=llm.callbacks
+    )
+
+
+def wrap_chat_model(chat_model: BaseChatModel, cassette: Optional[Cassette]) -> BaseChatModel:
+    """有 Cassette 時包裝聊天模型，否則原樣回傳"""
+    if cassette is None:
+        return chat_model
+    return CassetteChatModel(
+        inner=chat_model, cassette=cassette, model=getattr(chat_model, "model", ""), callbacks=chat_model.callbacks
+    )
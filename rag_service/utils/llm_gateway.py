@@ -0,0 +1,568 @@
+"""
+Gemini 呼叫閘道
+公眾服務與幕僚服務的 Gemini 呼叫都先經過這裡：以 SQLite 共用的令牌桶限制每分鐘請求數（RPM）
+與 token 數（TPM），兩個容器掛載同一個資料庫檔案即可共用額度；遇到 429 / 5xx 時以隨機退避重試，
+並把收到 429 的消息同步給其他程序（清空令牌桶），排隊等待時間記錄到 /metrics
+"""
+
+import asyncio
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.language_models.llms import LLM, BaseLLM
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult, GenerationChunk
+from langchain_core.runnables import Runnable
+from loguru import logger
+
+from utils.concurrency import run_blocking
+from utils.deadline import current_deadline
+from utils.metrics import LLM_QUEUE_WAIT_SECONDS, LLM_RETRIES_TOTAL
+from utils.token_counter import count_message_tokens, count_tokens
+
+T = TypeVar("T")
+
+# 可以重試的 HTTP 狀態碼（google.api_core 的例外以 .code 提供）
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class LLMQueueTimeout(RuntimeError):
+    """等待 Gemini 額度超過上限（或超過請求期限）"""
+
+
+def retryable_status(error: BaseException) -> Optional[int]:
+    """
+    取得可重試錯誤的 HTTP 狀態碼
+
+    Args:
+        error: 呼叫 Gemini 時的例外（包含被包裝過的原始例外）
+
+    Returns:
+        狀態碼，不可重試時為 None
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        code = getattr(error, "code", None) or getattr(error, "status_code", None)
+        code = getattr(code, "value", code)  # grpc.StatusCode 等列舉
+        if isinstance(code, int) and code in RETRYABLE_STATUS:
+            return code
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def _model_key(model: str) -> str:
+    return (model or "gemini").split("/")[-1]
+
+
+class SharedTokenBucket:
+    """
+    SQLite 共用的 RPM / TPM 令牌桶
+
+    每個模型有兩個桶（"<model>:rpm"、"<model>:tpm"），容量為每分鐘上限、每秒回補 1/60；
+    以 BEGIN IMMEDIATE 交易讀寫，多個程序同時取用時由 SQLite 鎖序列化
+
+    Attributes:
+        db_path: 共用資料庫路徑
+        rpm: 每分鐘請求數上限（0 表示不限）
+        tpm: 每分鐘 token 數上限（0 表示不限）
+    """
+
+    def __init__(self, db_path: str, rpm: int, tpm: int):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), timeout=5, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_rate_buckets (
+                    name TEXT PRIMARY KEY,
+                    level REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[float]:
+        """以 BEGIN IMMEDIATE 取得寫入鎖，yield 目前時間"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield time.time()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _limits(self, model: str) -> Dict[str, int]:
+        key = _model_key(model)
+        return {name: limit for name, limit in ((f"{key}:rpm", self.rpm), (f"{key}:tpm", self.tpm)) if limit > 0}
+
+    def _levels(self, limits: Dict[str, int], now: float) -> Dict[str, float]:
+        """讀取並回補各桶目前的令牌數（須在交易中呼叫）"""
+        levels = {}
+        for name, limit in limits.items():
+            row = self._conn.execute(
+                "SELECT level, updated_at FROM llm_rate_buckets WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None:
+                levels[name] = float(limit)
+            else:
+                levels[name] = min(float(limit), row[0] + max(now - row[1], 0.0) * limit / 60)
+        return levels
+
+    def _write(self, levels: Dict[str, float], now: float):
+        self._conn.executemany(
+            "INSERT INTO llm_rate_buckets (name, level, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET level = excluded.level, updated_at = excluded.updated_at",
+            [(name, level, now) for name, level in levels.items()]
+        )
+
+    def try_acquire(self, model: str, tokens: int) -> float:
+        """
+        嘗試取用一次請求與 tokens 個 token 的額度
+
+        Args:
+            model: 模型名稱
+            tokens: 預估 token 數（超過桶容量時以容量計）
+
+        Returns:
+            0 表示已取得，否則為預估還要等待的秒數
+        """
+        limits = self._limits(model)
+        if not limits:
+            return 0.0
+        need = {
+            name: 1.0 if name.endswith(":rpm") else float(min(tokens, limit))
+            for name, limit in limits.items()
+        }
+        with self._transaction() as now:
+            levels = self._levels(limits, now)
+            wait = max((need[name] - levels[name]) * 60 / limits[name] for name in limits)
+            if wait <= 0:
+                self._write({name: levels[name] - need[name] for name in limits}, now)
+        return max(wait, 0.0)
+
+    def debit(self, model: str, tokens: int):
+        """扣除呼叫完成後才知道的 token（例如回覆長度），令牌數可以暫時為負"""
+        limits = {name: limit for name, limit in self._limits(model).items() if name.endswith(":tpm")}
+        if not limits or tokens <= 0:
+            return
+        with self._transaction() as now:
+            levels = self._levels(limits, now)
+            self._write({name: level - tokens for name, level in levels.items()}, now)
+
+    def drain(self, model: str):
+        """收到 429 時清空該模型的令牌桶，讓所有程序一起放慢"""
+        limits = self._limits(model)
+        if not limits:
+            return
+        with self._transaction() as now:
+            levels = self._levels(limits, now)
+            self._write({name: min(level, 0.0) for name, level in levels.items()}, now)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LLMGateway:
+    """
+    Gemini 呼叫閘道（限流 + 重試）
+
+    - 每次呼叫前向共用令牌桶取得額度，不足時等待（最多 max_wait 秒，且不超過目前請求的剩餘期限）
+    - 429 / 5xx 以指數退避加隨機抖動重試，最多 max_attempts 次；串流已輸出內容後不重試
+    - 共用資料庫無法使用時不限流，只記錄錯誤
+
+    Attributes:
+        service: 服務名稱（指標標籤）
+        max_attempts: 最多嘗試次數（含第一次）
+        base_delay: 第一次重試前的退避秒數
+        max_delay: 單次退避秒數上限
+        max_wait: 等待額度的秒數上限
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        rpm: int = 0,
+        tpm: int = 0,
+        service: str = "",
+        max_attempts: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        max_wait: float = 30.0
+    ):
+        self.bucket = SharedTokenBucket(db_path, rpm, tpm)
+        self.service = service
+        self.max_attempts = max(max_attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0, "queued": 0, "queue_wait_seconds": 0.0, "queue_timeouts": 0,
+            "retries": 0, "failures": 0, "limiter_errors": 0,
+        }
+        logger.info(f"✅LLMGateway初始化完成: {db_path} (RPM {rpm or '不限'}, TPM {tpm or '不限'})")
+
+    def _count(self, name: str, amount: float = 1):
+        with self._lock:
+            self._counters[name] += amount
+
+    # ==================== 額度 ====================
+
+    def _wait_budget(self) -> float:
+        deadline = current_deadline()
+        if deadline is None:
+            return self.max_wait
+        return min(self.max_wait, deadline.remaining())
+
+    def _try_acquire(self, model: str, tokens: int) -> float:
+        try:
+            return self.bucket.try_acquire(model, tokens)
+        except sqlite3.Error as e:
+            logger.error(f"❌ LLM 限流資料庫無法使用，暫不限流: {e}")
+            self._count("limiter_errors")
+            return 0.0
+
+    def _queued(self, model: str, waited: float, throttled: bool):
+        LLM_QUEUE_WAIT_SECONDS.labels(service=self.service, model=_model_key(model)).observe(waited)
+        self._count("calls")
+        if throttled:
+            self._count("queued")
+            self._count("queue_wait_seconds", waited)
+
+    def _next_sleep(self, wait: float, waited: float, budget: float) -> float:
+        if waited + wait > budget:
+            self._count("queue_timeouts")
+            raise LLMQueueTimeout(f"等待 Gemini 額度超過 {budget:.1f} 秒")
+        # 加入抖動，避免多個等待者同時醒來
+        return wait + random.uniform(0, min(wait, 0.1))
+
+    def acquire(self, model: str, tokens: int) -> float:
+        """
+        取得一次呼叫的額度（同步，不足時阻塞等待）
+
+        Args:
+            model: 模型名稱
+            tokens: 預估 prompt token 數
+
+        Returns:
+            等待秒數
+
+        Raises:
+            LLMQueueTimeout: 等待超過上限時
+        """
+        started_at = time.perf_counter()
+        budget = self._wait_budget()
+        throttled = False
+        while True:
+            wait = self._try_acquire(model, tokens)
+            waited = time.perf_counter() - started_at
+            if wait <= 0:
+                self._queued(model, waited, throttled)
+                return waited
+            time.sleep(self._next_sleep(wait, waited, budget))
+            throttled = True
+
+    async def aacquire(self, model: str, tokens: int) -> float:
+        """取得一次呼叫的額度（非同步版本）"""
+        started_at = time.perf_counter()
+        budget = self._wait_budget()
+        throttled = False
+        while True:
+            wait = await run_blocking(self._try_acquire, model, tokens)
+            waited = time.perf_counter() - started_at
+            if wait <= 0:
+                self._queued(model, waited, throttled)
+                return waited
+            await asyncio.sleep(self._next_sleep(wait, waited, budget))
+            throttled = True
+
+    def debit(self, model: str, tokens: int):
+        """扣除回覆使用的 token"""
+        try:
+            self.bucket.debit(model, tokens)
+        except sqlite3.Error as e:
+            logger.error(f"❌ LLM 限流資料庫無法使用: {e}")
+            self._count("limiter_errors")
+
+    # ==================== 重試 ====================
+
+    def _retry_delay(self, model: str, error: Exception, attempt: int) -> Optional[float]:
+        """
+        決定是否重試
+
+        Returns:
+            退避秒數，不重試時為 None
+        """
+        status = retryable_status(error)
+        if status is None:
+            return None
+        if status == 429:
+            try:
+                self.bucket.drain(model)
+            except sqlite3.Error:
+                self._count("limiter_errors")
+        cap = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = random.uniform(cap / 2, cap)
+        deadline = current_deadline()
+        if attempt + 1 >= self.max_attempts or (deadline is not None and deadline.remaining() <= delay):
+            self._count("failures")
+            return None
+        self._count("retries")
+        LLM_RETRIES_TOTAL.labels(service=self.service, model=_model_key(model), status=str(status)).inc()
+        logger.warning(f"⚠️ Gemini 回應 {status}，{delay:.1f} 秒後重試 ({attempt + 1}/{self.max_attempts - 1})")
+        return delay
+
+    def call(self, model: str, tokens: int, func: Callable[[], T]) -> T:
+        """
+        經過限流與重試執行一次同步呼叫
+
+        Args:
+            model: 模型名稱
+            tokens: 預估 prompt token 數
+            func: 實際呼叫 Gemini 的函數
+
+        Returns:
+            func 的回傳值
+        """
+        attempt = 0
+        while True:
+            self.acquire(model, tokens)
+            try:
+                return func()
+            except Exception as e:
+                delay = self._retry_delay(model, e, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            time.sleep(delay)
+
+    async def acall(self, model: str, tokens: int, func: Callable[[], Awaitable[T]]) -> T:
+        """經過限流與重試執行一次非同步呼叫"""
+        attempt = 0
+        while True:
+            await self.aacquire(model, tokens)
+            try:
+                return await func()
+            except Exception as e:
+                delay = self._retry_delay(model, e, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stream(self, model: str, tokens: int, open_stream: Callable[[], Iterator[T]]) -> Iterator[T]:
+        """經過限流與重試的同步串流（已輸出內容後不重試）"""
+        attempt = 0
+        while True:
+            self.acquire(model, tokens)
+            started = False
+            try:
+                for chunk in open_stream():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if started else self._retry_delay(model, e, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            time.sleep(delay)
+
+    async def astream(self, model: str, tokens: int, open_stream: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """經過限流與重試的非同步串流（已輸出內容後不重試）"""
+        attempt = 0
+        while True:
+            await self.aacquire(model, tokens)
+            started = False
+            try:
+                async for chunk in open_stream():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if started else self._retry_delay(model, e, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """取得限流與重試統計"""
+        with self._lock:
+            counters = dict(self._counters)
+        counters["queue_wait_seconds"] = round(counters["queue_wait_seconds"], 3)
+        return {
+            "db_path": str(self.bucket.db_path),
+            "rpm": self.bucket.rpm,
+            "tpm": self.bucket.tpm,
+            "max_attempts": self.max_attempts,
+            **counters,
+        }
+
+    def close(self):
+        self.bucket.close()
+
+
+def _completion_tokens(text: str, message: Any = None) -> int:
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage.get("output_tokens", 0)
+    return count_tokens(text)
+
+
+class GatewayLLM(LLM):
+    """
+    經過 LLMGateway 的 GoogleGenerativeAI
+
+    直接呼叫內部 LLM 的 _generate / _stream，Callback 與串流事件只由外層發出一次
+    """
+
+    inner: BaseLLM
+    gateway: Any
+    model: str = ""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.inner._identifying_params
+
+    def _call(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> str:
+        result = self.gateway.call(
+            self.model, count_tokens(prompt), lambda: self.inner._generate([prompt], stop=stop, **kwargs)
+        )
+        text = result.generations[0][0].text
+        self.gateway.debit(self.model, _completion_tokens(text))
+        return text
+
+    async def _acall(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> str:
+        result = await self.gateway.acall(
+            self.model, count_tokens(prompt), lambda: self.inner._agenerate([prompt], stop=stop, **kwargs)
+        )
+        text = result.generations[0][0].text
+        await run_blocking(self.gateway.debit, self.model, _completion_tokens(text))
+        return text
+
+    def _stream(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        parts = []
+        for chunk in self.gateway.stream(
+            self.model, count_tokens(prompt), lambda: self.inner._stream(prompt, stop=stop, **kwargs)
+        ):
+            parts.append(chunk.text)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        self.gateway.debit(self.model, count_tokens("".join(parts)))
+
+    async def _astream(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[GenerationChunk]:
+        parts = []
+        async for chunk in self.gateway.astream(
+            self.model, count_tokens(prompt), lambda: self.inner._astream(prompt, stop=stop, **kwargs)
+        ):
+            parts.append(chunk.text)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        await run_blocking(self.gateway.debit, self.model, count_tokens("".join(parts)))
+
+
+class GatewayChatModel(BaseChatModel):
+    """
+    經過 LLMGateway 的 ChatGoogleGenerativeAI（Function Calling Agent 使用）
+
+    bind_tools 交給內部模型轉換工具定義後綁定在外層
+    """
+
+    inner: BaseChatModel
+    gateway: Any
+    model: str = ""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.inner._identifying_params
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> Runnable:
+        bound = self.inner.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(bound, "kwargs", {}))
+
+    def _result_tokens(self, result: ChatResult) -> int:
+        return sum(_completion_tokens(g.text, g.message) for g in result.generations)
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        result = self.gateway.call(
+            self.model, count_message_tokens(messages), lambda: self.inner._generate(messages, stop=stop, **kwargs)
+        )
+        self.gateway.debit(self.model, self._result_tokens(result))
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        result = await self.gateway.acall(
+            self.model, count_message_tokens(messages), lambda: self.inner._agenerate(messages, stop=stop, **kwargs)
+        )
+        await run_blocking(self.gateway.debit, self.model, self._result_tokens(result))
+        return result
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        parts = []
+        for chunk in self.gateway.stream(
+            self.model, count_message_tokens(messages), lambda: self.inner._stream(messages, stop=stop, **kwargs)
+        ):
+            parts.append(chunk.text)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        self.gateway.debit(self.model, count_tokens("".join(parts)))
+
+    async def _astream(
+        self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        parts = []
+        async for chunk in self.gateway.astream(
+            self.model, count_message_tokens(messages), lambda: self.inner._astream(messages, stop=stop, **kwargs)
+        ):
+            parts.append(chunk.text)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        await run_blocking(self.gateway.debit, self.model, count_tokens("".join(parts)))
+
+
+def wrap_gateway_llm(llm: BaseLLM, gateway: Optional[LLMGateway]) -> BaseLLM:
+    """有閘道時包裝 LLM，否則原樣回傳"""
+    if gateway is None:
+        return llm
+    return GatewayLLM(inner=llm, gateway=gateway, model=getattr(llm, "model", ""), callbacks=llm.callbacks)
+
+
+def wrap_gateway_chat_model(chat_model: BaseChatModel, gateway: Optional[LLMGateway]) -> BaseChatModel:
+    """有閘道時包裝聊天模型，否則原樣回傳"""
+    if gateway is None:
+        return chat_model
+    return GatewayChatModel(
+        inner=chat_model, gateway=gateway, model=getattr(chat_model, "model", ""), callbacks=chat_model.callbacks
+    )
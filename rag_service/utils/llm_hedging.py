@@ -0,0 +1,345 @@
+"""
+Gemini 請求避險（hedged requests）
+呼叫超過近期 p90 延遲仍未完成時，再送出一個相同的請求，先完成者為準、另一個取消；
+額外請求數受全域預算限制（例如最多 5%），用來壓低少數極慢回應造成的長尾延遲
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.language_models.llms import LLM, BaseLLM
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult, GenerationChunk
+from langchain_core.runnables import Runnable
+from loguru import logger
+
+from utils.latency_stats import percentile
+from utils.metrics import LLM_HEDGES_TOTAL
+
+T = TypeVar("T")
+
+
+class HedgePolicy:
+    """
+    避險策略（同一個服務內的模型共用，預算為全域）
+
+    - 延遲門檻: 各呼叫類型最近 window 次延遲的第 pct 百分位（樣本不足 min_samples 時不避險），
+      串流以首個區塊的延遲計算
+    - 預算: 每次主要請求累積 budget 個額度、每次避險用掉 1 個（額度上限 1），
+      長期額外請求數不超過主要請求的 budget 比例
+
+    Attributes:
+        pct: 延遲門檻百分位
+        budget: 額外請求比例上限
+        min_samples: 開始避險前需要的延遲樣本數
+        min_delay: 延遲門檻下限（秒）
+    """
+
+    def __init__(
+        self,
+        pct: float = 90,
+        budget: float = 0.05,
+        min_samples: int = 20,
+        window: int = 200,
+        min_delay: float = 0.25
+    ):
+        self.pct = pct
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._window = window
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._credit = 0.0
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "hedged": 0, "hedge_wins": 0, "denied": 0, "errors": 0}
+        logger.info(f"✅HedgePolicy初始化完成 (p{pct:g}, 預算 {budget:.0%})")
+
+    def delay(self, key: str) -> Optional[float]:
+        """
+        取得避險門檻（秒）
+
+        Args:
+            key: 呼叫類型（例如 "google_gemini:gemini-2.0-flash/generate"，各模型分開統計）
+
+        Returns:
+            門檻秒數，樣本不足時為 None
+        """
+        with self._lock:
+            samples = list(self._latencies.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return max(percentile(samples, self.pct), self.min_delay)
+
+    def observe(self, key: str, seconds: float):
+        """記錄一次呼叫延遲"""
+        with self._lock:
+            window = self._latencies.setdefault(key, deque(maxlen=self._window))
+            window.append(seconds)
+
+    def _admit(self):
+        with self._lock:
+            self._counters["calls"] += 1
+            self._credit = min(self._credit + self.budget, 1.0)
+
+    def _acquire(self) -> bool:
+        with self._lock:
+            if self._credit < 1.0:
+                self._counters["denied"] += 1
+                return False
+            self._credit -= 1.0
+            self._counters["hedged"] += 1
+            return True
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    async def run(
+        self,
+        key: str,
+        model: str,
+        start: Callable[[], Awaitable[T]],
+        discard: Optional[Callable[[T], Awaitable[Any]]] = None
+    ) -> T:
+        """
+        執行一次可避險的呼叫
+
+        主要請求超過門檻仍未完成且預算足夠時送出第二個請求，先成功者為準，另一個被取消；
+        兩者都失敗時拋出主要請求的錯誤
+
+        Args:
+            key: 呼叫類型（延遲分開統計）
+            model: 模型名稱（指標標籤）
+            start: 建立一次請求的函數
+            discard: 落敗但已完成的結果的清理函數（例如關閉串流）
+
+        Returns:
+            先完成的結果
+        """
+        self._admit()
+        delay = self.delay(key)
+        started_at = time.perf_counter()
+        primary = asyncio.ensure_future(start())
+        tasks: List[asyncio.Future] = [primary]
+        hedge_started_at = 0.0
+        winner: Optional[asyncio.Future] = None
+        try:
+            if delay is not None:
+                await asyncio.wait(tasks, timeout=delay)
+                if not primary.done():
+                    if self._acquire():
+                        hedge_started_at = time.perf_counter()
+                        tasks.append(asyncio.ensure_future(start()))
+                        LLM_HEDGES_TOTAL.labels(model=model, outcome="sent").inc()
+                    else:
+                        LLM_HEDGES_TOTAL.labels(model=model, outcome="denied").inc()
+
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # 同時完成時以主要請求為準
+                for task in tasks:
+                    if task in done and task.exception() is None:
+                        winner = task
+                        break
+            if winner is None:
+                self._count("errors")
+                raise primary.exception() or tasks[-1].exception()
+
+            now = time.perf_counter()
+            if winner is primary:
+                self.observe(key, now - started_at)
+                if len(tasks) > 1:
+                    LLM_HEDGES_TOTAL.labels(model=model, outcome="lost").inc()
+            else:
+                # 主要請求被取消，以目前經過時間（已超過門檻）保留長尾樣本
+                self.observe(key, now - hedge_started_at)
+                self.observe(key, now - started_at)
+                self._count("hedge_wins")
+                LLM_HEDGES_TOTAL.labels(model=model, outcome="won").inc()
+            return winner.result()
+        finally:
+            for task in tasks:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif discard is not None and not task.cancelled() and task.exception() is None:
+                    await discard(task.result())
+
+    def stats(self) -> Dict[str, Any]:
+        """取得避險統計"""
+        with self._lock:
+            counters = dict(self._counters)
+            keys = list(self._latencies)
+        hedged = counters["hedged"]
+        return {
+            "enabled": True,
+            "percentile": self.pct,
+            "budget": self.budget,
+            **counters,
+            "hedge_rate": round(hedged / counters["calls"], 4) if counters["calls"] else 0.0,
+            "hedge_win_rate": round(counters["hedge_wins"] / hedged, 4) if hedged else 0.0,
+            "delay_ms": {
+                key: round(delay * 1000, 1) if delay is not None else None
+                for key, delay in ((key, self.delay(key)) for key in keys)
+            },
+        }
+
+
+async def _first_chunk(stream: AsyncIterator[T]) -> Tuple[AsyncIterator[T], Optional[T]]:
+    """開始串流並等待第一個區塊（沒有任何輸出時為 None）"""
+    iterator = stream.__aiter__()
+    try:
+        return iterator, await iterator.__anext__()
+    except StopAsyncIteration:
+        return iterator, None
+
+
+async def _close_stream(started: Tuple[AsyncIterator[Any], Any]):
+    aclose = getattr(started[0], "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+async def _continue_stream(iterator: AsyncIterator[Any], first: Any, run_manager: Any) -> AsyncIterator[Any]:
+    """輸出勝出串流的第一個區塊與其餘區塊，並發出 on_llm_new_token"""
+    try:
+        if first is None:
+            return
+        if run_manager:
+            await run_manager.on_llm_new_token(first.text, chunk=first)
+        yield first
+        async for chunk in iterator:
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+    finally:
+        await _close_stream((iterator, None))
+
+
+class HedgedLLM(LLM):
+    """
+    包裝 GoogleGenerativeAI 的避險 LLM
+
+    只有非同步呼叫（ainvoke / astream，ChatService 與 ContentGenerator 都走這條路徑）會避險；
+    直接呼叫內部 LLM 的 _agenerate / _astream，Callback 與串流事件只由外層發出一次。
+    內部模型沒有原生非同步實作時，被取消的請求會在執行緒中跑完後丟棄
+    """
+
+    inner: BaseLLM
+    policy: Any
+    model: str = ""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return f"hedged-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.inner._identifying_params
+
+    def _call(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> str:
+        return self.inner._generate([prompt], stop=stop, **kwargs).generations[0][0].text
+
+    def _stream(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> Iterator[GenerationChunk]:
+        for chunk in self.inner._stream(prompt, stop=stop, **kwargs):
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _acall(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> str:
+        result = await self.policy.run(
+            f"{self.inner._llm_type}:{self.model}/generate",
+            self.model,
+            lambda: self.inner._agenerate([prompt], stop=stop, **kwargs)
+        )
+        return result.generations[0][0].text
+
+    async def _astream(self, prompt: str, stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[GenerationChunk]:
+        iterator, first = await self.policy.run(
+            f"{self.inner._llm_type}:{self.model}/stream",
+            self.model,
+            lambda: _first_chunk(self.inner._astream(prompt, stop=stop, **kwargs)),
+            discard=_close_stream
+        )
+        async for chunk in _continue_stream(iterator, first, run_manager):
+            yield chunk
+
+
+class HedgedChatModel(BaseChatModel):
+    """
+    包裝 ChatGoogleGenerativeAI 的避險聊天模型（Function Calling Agent 使用）
+
+    bind_tools 交給內部模型轉換工具定義後綁定在外層
+    """
+
+    inner: BaseChatModel
+    policy: Any
+    model: str = ""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return f"hedged-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.inner._identifying_params
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> Runnable:
+        bound = self.inner.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(bound, "kwargs", {}))
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return self.inner._generate(messages, stop=stop, **kwargs)
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for chunk in self.inner._stream(messages, stop=stop, **kwargs):
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return await self.policy.run(
+            f"{self.inner._llm_type}:{self.model}/generate",
+            self.model,
+            lambda: self.inner._agenerate(messages, stop=stop, **kwargs)
+        )
+
+    async def _astream(
+        self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        iterator, first = await self.policy.run(
+            f"{self.inner._llm_type}:{self.model}/stream",
+            self.model,
+            lambda: _first_chunk(self.inner._astream(messages, stop=stop, **kwargs)),
+            discard=_close_stream
+        )
+        async for chunk in _continue_stream(iterator, first, run_manager):
+            yield chunk
+
+
+def wrap_hedged_llm(llm: BaseLLM, policy: Optional[HedgePolicy]) -> BaseLLM:
+    """有避險策略時包裝 LLM，否則原樣回傳"""
+    if policy is None:
+        return llm
+    return HedgedLLM(inner=llm, policy=policy, model=getattr(llm, "model", ""), callbacks=llm.callbacks)
+
+
+def wrap_hedged_chat_model(chat_model: BaseChatModel, policy: Optional[HedgePolicy]) -> BaseChatModel:
+    """有避險策略時包裝聊天模型，否則原樣回傳"""
+    if policy is None:
+        return chat_model
+    return HedgedChatModel(
+        inner=chat_model, policy=policy, model=getattr(chat_model, "model", ""), callbacks=chat_model.callbacks
+    )
@@ -0,0 +1,517 @@
+"""
+效能指標模組
+以 Prometheus 直方圖 / 計數器記錄各階段耗時（HTTP 路由、Agent 迭代、Gemini 呼叫、工具、
+Embedding、Qdrant 檢索、SQLite、外部 API），並可收集單一請求的各階段耗時
+
+未安裝 prometheus_client 時所有指標都不做事，/metrics 回傳 503
+"""
+
+import functools
+import inspect
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+
+try:
+    import prometheus_client
+except ImportError:  # 未安裝時指標不做事
+    prometheus_client = None
+
+
+class _NoopMetric:
+    """未安裝 prometheus_client 時的替代指標"""
+
+    def labels(self, *args: Any, **kwargs: Any) -> "_NoopMetric":
+        return self
+
+    def observe(self, value: float):
+        pass
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+
+def _histogram(name: str, documentation: str, labelnames: Tuple[str, ...], buckets=None):
+    if prometheus_client is None:
+        return _NoopMetric()
+    kwargs = {"buckets": buckets} if buckets else {}
+    return prometheus_client.Histogram(name, documentation, labelnames, **kwargs)
+
+
+def _counter(name: str, documentation: str, labelnames: Tuple[str, ...]):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Counter(name, documentation, labelnames)
+
+
+def _gauge(name: str, documentation: str, labelnames: Tuple[str, ...]):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Gauge(name, documentation, labelnames)
+
+
+# LLM 與外部 API 的耗時較長，使用較寬的區間
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+HTTP_REQUEST_SECONDS = _histogram(
+    "pais_http_request_duration_seconds", "HTTP 請求耗時（串流回應計算到最後一個位元組）",
+    ("service", "method", "route", "status"), SLOW_BUCKETS
+)
+AGENT_ITERATIONS = _histogram(
+    "pais_agent_iterations", "每次回答的 Agent 推理次數",
+    ("role", "mode"), (1, 2, 3, 4, 5, 6, 8, 10)
+)
+LLM_CALL_SECONDS = _histogram(
+    "pais_llm_call_duration_seconds", "Gemini 呼叫耗時",
+    ("model", "status"), SLOW_BUCKETS
+)
+TOOL_CALL_SECONDS = _histogram(
+    "pais_tool_call_duration_seconds", "Agent 工具執行耗時",
+    ("tool",), FAST_BUCKETS + (5, 10)
+)
+EMBEDDING_SECONDS = _histogram(
+    "pais_embedding_duration_seconds", "Embedding 計算耗時",
+    ("operation",), FAST_BUCKETS + (5, 10)
+)
+VECTOR_SEARCH_SECONDS = _histogram(
+    "pais_qdrant_request_duration_seconds", "Qdrant 請求耗時",
+    ("operation",), FAST_BUCKETS + (5, 10)
+)
+SQLITE_SECONDS = _histogram(
+    "pais_sqlite_query_duration_seconds", "StaffDatabase SQLite 查詢耗時",
+    ("operation", "table"), FAST_BUCKETS
+)
+EXTERNAL_API_SECONDS = _histogram(
+    "pais_external_api_duration_seconds", "外部 API（ElevenLabs / HeyGen）呼叫耗時",
+    ("service", "operation", "status"), SLOW_BUCKETS + (300, 600)
+)
+LLM_TOKENS_TOTAL = _counter(
+    "pais_llm_tokens_total", "Gemini 使用的 token 數（kind=prompt/completion）",
+    ("model", "kind")
+)
+LLM_QUEUE_WAIT_SECONDS = _histogram(
+    "pais_llm_queue_wait_seconds", "Gemini 呼叫等待 RPM / TPM 額度的時間",
+    ("service", "model"), FAST_BUCKETS + (5, 10, 30)
+)
+LLM_RETRIES_TOTAL = _counter(
+    "pais_llm_retries_total", "Gemini 因 429 / 5xx 重試的次數",
+    ("service", "model", "status")
+)
+LLM_TIER_SELECTIONS_TOTAL = _counter(
+    "pais_llm_tier_selections_total", "各任務選用的模型等級（tier=lite/full）",
+    ("task", "tier", "reason")
+)
+LLM_HEDGES_TOTAL = _counter(
+    "pais_llm_hedges_total", "Gemini 避險請求次數（outcome=sent/won/lost/denied）",
+    ("model", "outcome")
+)
+CHAT_DEGRADATIONS_TOTAL = _counter(
+    "pais_chat_degradations_total", "因期限或 LLM 無法使用而降級的對話次數（tier=rag/extractive）",
+    ("role", "tier")
+)
+ADMISSION_QUEUE_DEPTH = _gauge(
+    "pais_admission_queue_depth", "各優先類別排隊中的請求數",
+    ("service", "priority_class")
+)
+ADMISSION_RUNNING = _gauge(
+    "pais_admission_running", "各優先類別執行中的請求數",
+    ("service", "priority_class")
+)
+ADMISSION_WAIT_SECONDS = _histogram(
+    "pais_admission_wait_seconds", "各優先類別取得執行名額前的等待時間",
+    ("service", "priority_class"), FAST_BUCKETS + (5, 10, 30)
+)
+ADMISSION_REJECTED_TOTAL = _counter(
+    "pais_admission_rejected_total", "排隊已滿或等待逾時而未執行的請求數（reason=queue_full/timeout）",
+    ("service", "priority_class", "reason")
+)
+ERRORS_TOTAL = _counter(
+    "pais_errors_total", "各階段發生的錯誤次數",
+    ("stage",)
+)
+
+# ==================== 單一請求的階段耗時 ====================
+
+_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+_stage_lock = threading.Lock()
+
+
+@contextmanager
+def collect_stage_timings() -> Iterator[Dict[str, float]]:
+    """
+    在區塊內收集各階段耗時（毫秒，同一階段多次呼叫會累加）
+
+    Yields:
+        階段 -> 累計毫秒數 的字典（區塊結束後仍可讀取）
+    """
+    timings: Dict[str, float] = {}
+    token = _stage_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        try:
+            _stage_timings.reset(token)
+        except ValueError:
+            pass  # 串流中斷時產生器可能在其他 context 中被關閉
+
+
+def build_trace(
+    timings: Dict[str, float],
+    started_at: float,
+    tokens: Optional[Dict[str, int]] = None
+) -> Dict[str, Any]:
+    """
+    組成回應中的 trace 欄位
+
+    Args:
+        timings: collect_stage_timings 收集到的階段耗時
+        started_at: 請求開始時間（time.perf_counter()）
+        tokens: 本次請求的 LLM 用量（LLMUsageTracker.scope 收集）
+
+    Returns:
+        {"total_ms": float, "stages": {階段: 毫秒}, "tokens": {...}}
+    """
+    trace = {
+        "total_ms": round((time.perf_counter() - started_at) * 1000, 1),
+        "stages": dict(timings),
+    }
+    if tokens is not None:
+        trace["tokens"] = dict(tokens)
+    return trace
+
+
+def add_stage_time(stage: str, seconds: float):
+    """
+    將耗時累加到目前請求的階段統計（不在收集範圍內時不做事）
+
+    Args:
+        stage: 階段名稱
+        seconds: 耗時（秒）
+    """
+    timings = _stage_timings.get()
+    if timings is None:
+        return
+    with _stage_lock:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 1)
+
+
+@contextmanager
+def timed(histogram, stage: Optional[str] = None, **labels: str) -> Iterator[None]:
+    """
+    量測區塊耗時並寫入直方圖與目前請求的階段統計
+
+    Args:
+        histogram: 直方圖
+        stage: 階段名稱（None 表示不計入請求的階段統計）
+        **labels: 直方圖標籤
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        histogram.labels(**labels).observe(elapsed)
+        if stage:
+            add_stage_time(stage, elapsed)
+
+
+def observe_agent_iterations(role: str, mode: str, result: Dict[str, Any]):
+    """
+    記錄 Agent 推理次數（工具呼叫步數 + 最後產生回覆的一次）
+
+    Args:
+        role: 角色
+        mode: Agent 模式
+        result: AgentExecutor 的輸出
+    """
+    steps = result.get("intermediate_steps") or []
+    AGENT_ITERATIONS.labels(role=role, mode=mode).observe(len(steps) + 1)
+
+
+def observe_tool(tool: str) -> Callable:
+    """
+    量測 Agent 工具執行耗時的裝飾器
+
+    Args:
+        tool: 工具名稱
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any):
+            with timed(TOOL_CALL_SECONDS, f"tool:{tool}", tool=tool):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ==================== Gemini 呼叫 ====================
+
+def llm_model_name(callback_kwargs: Dict[str, Any]) -> str:
+    """
+    從 on_llm_start / on_chat_model_start 的參數取得模型名稱
+
+    Args:
+        callback_kwargs: callback 收到的關鍵字參數
+
+    Returns:
+        模型名稱（取不到時為 "unknown"）
+    """
+    params = callback_kwargs.get("invocation_params") or {}
+    metadata = callback_kwargs.get("metadata") or {}
+    return str(params.get("model") or params.get("model_name") or metadata.get("ls_model_name") or "unknown")
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    記錄每次 Gemini 呼叫耗時的 Callback，同時保留最近一次成功 / 失敗的時間供健康檢查使用
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._started: Dict[UUID, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+        self.last_success: Optional[datetime] = None
+        self.last_error: Optional[datetime] = None
+        self.last_error_message: Optional[str] = None
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any):
+        self._start(run_id, kwargs)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[Any], *, run_id: UUID, **kwargs: Any):
+        self._start(run_id, kwargs)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, "ok")
+        self.last_success = datetime.now()
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, "error")
+        self.last_error = datetime.now()
+        self.last_error_message = str(error)[:200]
+        ERRORS_TOTAL.labels(stage="llm").inc()
+
+    def healthy(self) -> bool:
+        """最近一次呼叫成功（或尚未呼叫過）時視為正常"""
+        if self.last_error is None:
+            return True
+        return self.last_success is not None and self.last_success > self.last_error
+
+    def status(self) -> Dict[str, Any]:
+        """健康檢查用的狀態"""
+        return {
+            "healthy": self.healthy(),
+            "last_success": self.last_success.isoformat() if self.last_success else None,
+            "last_error": self.last_error.isoformat() if self.last_error else None,
+            "last_error_message": self.last_error_message,
+        }
+
+    def _start(self, run_id: UUID, kwargs: Dict[str, Any]):
+        with self._lock:
+            self._started[run_id] = (time.perf_counter(), llm_model_name(kwargs))
+
+    def _finish(self, run_id: UUID, status: str):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started[0]
+        LLM_CALL_SECONDS.labels(model=started[1], status=status).observe(elapsed)
+        add_stage_time("llm", elapsed)
+
+
+# ==================== Embedding / Qdrant ====================
+
+class InstrumentedEmbeddings(Embeddings):
+    """記錄 Embedding 耗時的包裝"""
+
+    def __init__(self, inner: Embeddings):
+        self.inner = inner
+        self.model_name = getattr(inner, "model_name", "unknown")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with timed(EMBEDDING_SECONDS, "embedding", operation="documents"):
+            return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with timed(EMBEDDING_SECONDS, "embedding", operation="query"):
+            return self.inner.embed_query(text)
+
+
+def _timed_qdrant_method(method: Callable, name: str) -> Callable:
+    stage = "vector_search" if name == "search" else None
+
+    @functools.wraps(method)
+    def wrapper(*args: Any, **kwargs: Any):
+        with timed(VECTOR_SEARCH_SECONDS, stage, operation=name):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+def instrument_qdrant_client(client, operations: Tuple[str, ...] = ("search", "upsert", "delete")):
+    """
+    記錄 Qdrant 請求耗時（包裝 client 實例上的方法）
+
+    Args:
+        client: QdrantClient
+        operations: 要量測的方法名稱
+
+    Returns:
+        同一個 client
+    """
+    for name in operations:
+        method = getattr(client, name, None)
+        if method is not None:
+            setattr(client, name, _timed_qdrant_method(method, name))
+    return client
+
+
+# ==================== SQLite ====================
+
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?)\s+(\w+)", re.IGNORECASE)
+
+
+def _sql_labels(sql: str) -> Dict[str, str]:
+    words = sql.split(None, 1)
+    match = _SQL_TABLE.search(sql)
+    return {
+        "operation": words[0].upper() if words else "UNKNOWN",
+        "table": match.group(1) if match else "",
+    }
+
+
+class TimedCursor(sqlite3.Cursor):
+    """記錄每個 SQL 耗時的 Cursor"""
+
+    def execute(self, sql, parameters=()):
+        with timed(SQLITE_SECONDS, "sqlite", **_sql_labels(sql)):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with timed(SQLITE_SECONDS, "sqlite", **_sql_labels(sql)):
+            return super().executemany(sql, seq_of_parameters)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    預設使用 TimedCursor 的連線（sqlite3.connect(..., factory=TimedConnection)）
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# ==================== 外部 API ====================
+
+def observe_external(service: str, operation: Optional[str] = None) -> Callable:
+    """
+    量測外部 API 呼叫耗時的裝飾器（支援同步與 async 函數）
+
+    Args:
+        service: 服務名稱（例如 "elevenlabs"）
+        operation: 操作名稱，預設為函數名稱
+    """
+    def decorator(func: Callable) -> Callable:
+        op = operation or func.__name__
+
+        def observe(started_at: float, status: str):
+            elapsed = time.perf_counter() - started_at
+            EXTERNAL_API_SECONDS.labels(service=service, operation=op, status=status).observe(elapsed)
+            if status == "error":
+                ERRORS_TOTAL.labels(stage=service).inc()
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any):
+                started_at = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException:
+                    observe(started_at, "error")
+                    raise
+                observe(started_at, "ok")
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any):
+            started_at = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                observe(started_at, "error")
+                raise
+            observe(started_at, "ok")
+            return result
+        return wrapper
+
+    return decorator
+
+
+# ==================== HTTP ====================
+
+class MetricsMiddleware:
+    """
+    記錄每個路由耗時的 ASGI middleware（以路由樣板為標籤，避免路徑參數造成標籤爆炸）
+
+    串流回應會計算到最後一個位元組送出為止
+    """
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                service=self.service,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status["code"]),
+            ).observe(time.perf_counter() - started_at)
+
+
+def render_metrics() -> Optional[Tuple[bytes, str]]:
+    """
+    輸出 Prometheus 文字格式
+
+    Returns:
+        (內容, Content-Type)；未安裝 prometheus_client 時回傳 None
+    """
+    if prometheus_client is None:
+        return None
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
@@ -0,0 +1,91 @@
+"""
+檢索結果共用工具
+在同一個執行範圍（例如一次批次問答）內共用知識庫檢索結果；
+範圍由 ContextVar 傳到工具、RAG 流程等檢索函數，不在範圍內時直接檢索
+"""
+
+import contextvars
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+# 目前執行範圍共用的檢索快取（None 表示不共用）
+_current_memo: contextvars.ContextVar[Optional["RetrievalMemo"]] = contextvars.ContextVar(
+    "retrieval_memo", default=None
+)
+
+
+class RetrievalMemo:
+    """
+    共用的檢索結果快取
+
+    同一個鍵同時只會有一個執行緒實際檢索，其他執行緒等待並共用結果
+    """
+
+    def __init__(self):
+        self._results: Dict[Hashable, Any] = {}
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        取得快取結果，不存在時執行 compute
+
+        Args:
+            key: 快取鍵值
+            compute: 實際檢索的函數
+
+        Returns:
+            檢索結果
+        """
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._results:
+                    self.hits += 1
+                    return self._results[key]
+            result = compute()
+            with self._lock:
+                self._results[key] = result
+                self.misses += 1
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """取得命中統計"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._results),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def use_retrieval_memo(memo: Optional[RetrievalMemo]):
+    """
+    設定目前 context 共用的檢索快取（應在獨立的 Task 中呼叫，結束時隨 context 一起丟棄）
+
+    Args:
+        memo: 檢索快取，None 表示不共用
+    """
+    _current_memo.set(memo)
+
+
+def memoized_retrieval(key: Hashable, compute: Callable[[], Any]) -> Any:
+    """
+    在目前的執行範圍中共用檢索結果；沒有設定快取時直接檢索
+
+    Args:
+        key: 快取鍵值（例如 ("similarity", 查詢, k)）
+        compute: 實際檢索的函數
+
+    Returns:
+        檢索結果
+    """
+    memo = _current_memo.get()
+    if memo is None:
+        return compute()
+    return memo.get_or_compute(key, compute)
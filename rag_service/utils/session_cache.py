@@ -0,0 +1,248 @@
+"""
+會話快取模組
+以 LRU + 估計位元組數 + 閒置時間限制常駐記憶體中的對話記憶，
+被淘汰的會話會先寫回磁碟，下次存取時再從磁碟重新載入
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Generic, Iterator, Optional, TypeVar
+
+from loguru import logger
+
+V = TypeVar("V")
+
+# 每個常駐會話的固定開銷估計（物件、字典項目等）
+SESSION_BASE_BYTES = 2048
+
+
+def estimate_chat_memory_bytes(memory: Any) -> int:
+    """
+    估計 LangChain 對話記憶佔用的位元組數
+
+    對話歷史提供 estimated_bytes 時直接採用（例如資料庫型歷史），
+    檔案型歷史以檔案大小估算（每次存取都會整份載入），
+    記憶體型歷史以訊息內容長度估算；另加上摘要長度
+
+    Args:
+        memory: ConversationBufferMemory 或其子類別
+
+    Returns:
+        估計位元組數
+    """
+    size = 0
+    chat_memory = getattr(memory, "chat_memory", None)
+    file_path = getattr(chat_memory, "file_path", None)
+    if hasattr(chat_memory, "estimated_bytes"):
+        size += chat_memory.estimated_bytes()
+    elif file_path is not None:
+        path = Path(file_path)
+        if path.exists():
+            size += path.stat().st_size
+    elif isinstance(getattr(chat_memory, "messages", None), list):
+        size += sum(len(str(m.content).encode("utf-8")) for m in chat_memory.messages)
+    size += len((getattr(memory, "summary", "") or "").encode("utf-8"))
+    return size
+
+
+class SessionCache(Generic[V]):
+    """
+    有上限的會話快取
+
+    - max_entries: 常駐會話數上限
+    - max_bytes: 常駐會話估計位元組數上限
+    - idle_ttl_seconds: 閒置超過此秒數的會話會被淘汰
+
+    淘汰前會呼叫 on_evict（寫回磁碟）；can_evict 回傳 False 的會話
+    （例如請求仍在處理中）會被略過，保留到下一次檢查。
+
+    Attributes:
+        size_func: 估計單一會話位元組數的函數
+        on_evict: 淘汰時的回呼 (key, value)
+        can_evict: 判斷會話目前是否可淘汰的函數
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        idle_ttl_seconds: int = 1800,
+        size_func: Optional[Callable[[V], int]] = None,
+        on_evict: Optional[Callable[[str, V], None]] = None,
+        can_evict: Optional[Callable[[str], bool]] = None,
+        name: str = "session"
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.size_func = size_func
+        self.on_evict = on_evict
+        self.can_evict = can_evict
+        self.name = name
+
+        # key -> (value, 最後存取時間, 估計位元組數)
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._counters = {
+            "hits": 0,
+            "loads": 0,
+            "evicted_capacity": 0,
+            "evicted_bytes": 0,
+            "evicted_idle": 0,
+        }
+
+        logger.info(
+            f"✅SessionCache[{name}]初始化完成 (上限: {max_entries} 個 / "
+            f"{max_bytes // (1024 * 1024)} MB, 閒置 {idle_ttl_seconds}s)"
+        )
+
+    def get(self, key: str) -> Optional[V]:
+        """
+        取得會話並更新存取時間
+
+        Args:
+            key: 會話鍵值
+
+        Returns:
+            會話物件，不在快取中時為 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry[1] = time.monotonic()
+            self._resize(key, entry)
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[0]
+
+    def get_or_create(self, key: str, factory: Callable[[], V]) -> V:
+        """
+        取得會話，不存在時以 factory 建立（從磁碟重新載入）
+
+        Args:
+            key: 會話鍵值
+            factory: 建立會話的函數
+
+        Returns:
+            會話物件
+        """
+        with self._lock:
+            value = self.get(key)
+            if value is None:
+                value = factory()
+                self._counters["loads"] += 1
+                self.put(key, value)
+            return value
+
+    def put(self, key: str, value: V):
+        """
+        放入會話，必要時淘汰最久未使用的會話
+
+        Args:
+            key: 會話鍵值
+            value: 會話物件
+        """
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            entry = [value, time.monotonic(), 0]
+            self._entries[key] = entry
+            self._resize(key, entry)
+            self._evict(protect=key)
+
+    def pop(self, key: str) -> Optional[V]:
+        """
+        移除會話（不呼叫 on_evict）
+
+        Args:
+            key: 會話鍵值
+
+        Returns:
+            被移除的會話物件或 None
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self._bytes -= entry[2]
+            return entry[0]
+
+    def sweep(self) -> int:
+        """
+        淘汰閒置與超出上限的會話
+
+        Returns:
+            淘汰數量
+        """
+        with self._lock:
+            return self._evict()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._entries))
+
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        with self._lock:
+            return {
+                "resident": len(self._entries),
+                "max_entries": self.max_entries,
+                "estimated_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "idle_ttl_seconds": self.idle_ttl_seconds,
+                **self._counters,
+            }
+
+    def _resize(self, key: str, entry: list):
+        """重新估計會話大小"""
+        size = SESSION_BASE_BYTES
+        if self.size_func is not None:
+            try:
+                size += int(self.size_func(entry[0]))
+            except Exception as e:
+                logger.debug(f"估計會話大小失敗 ({key}): {e}")
+        self._bytes += size - entry[2]
+        entry[2] = size
+
+    def _evict(self, protect: Optional[str] = None) -> int:
+        """依閒置時間、數量、位元組數依序淘汰（由最久未使用的開始）"""
+        now = time.monotonic()
+        evicted = 0
+        for key in list(self._entries):
+            entry = self._entries[key]
+            over_entries = len(self._entries) > self.max_entries
+            over_bytes = self._bytes > self.max_bytes
+            idle = now - entry[1] > self.idle_ttl_seconds
+            if not (over_entries or over_bytes or idle):
+                # 越後面越新，之後的項目不會閒置
+                break
+            if key == protect or (self.can_evict is not None and not self.can_evict(key)):
+                continue
+
+            reason = "idle" if idle else "capacity" if over_entries else "bytes"
+            self._entries.pop(key)
+            self._bytes -= entry[2]
+            self._counters[f"evicted_{reason}"] += 1
+            evicted += 1
+            if self.on_evict is not None:
+                try:
+                    self.on_evict(key, entry[0])
+                except Exception as e:
+                    logger.error(f"❌ 寫回被淘汰的會話失敗 ({key}): {e}")
+
+        if evicted:
+            logger.info(f"♻️ SessionCache[{self.name}] 淘汰 {evicted} 個會話 (常駐: {len(self._entries)})")
+        return evicted
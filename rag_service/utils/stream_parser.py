@@ -0,0 +1,108 @@
+"""
+ReAct 串流解析模組
+在 Agent 逐字輸出時即時擷取 Final Answer，過濾 Thought/Action/Observation
+"""
+
+from typing import List
+
+
+class FinalAnswerStreamParser:
+    """
+    增量式 Final Answer 解析器
+
+    ReAct Agent 的每次 LLM 呼叫都會輸出 Thought/Action 等內部流程，
+    只有出現 `Final Answer:` 之後的文字才是給使用者看的內容。
+    此解析器逐段接收 token，僅回傳 Final Answer 的部分；
+    為了處理標記被切在兩個 chunk 之間的情況，會保留尾端少量字元暫不輸出。
+
+    使用方式：
+        parser = FinalAnswerStreamParser()
+        parser.start_generation()       # 每次 LLM 呼叫開始時
+        visible = parser.feed(chunk)    # 每個 token
+        visible += parser.finish()      # LLM 呼叫結束時
+    """
+
+    FINAL_ANSWER_MARKER = "Final Answer:"
+    STOP_MARKERS: List[str] = ["Thought:", "Action:", "Action Input:", "Observation:"]
+
+    def __init__(self):
+        self._hold = max(len(m) for m in self.STOP_MARKERS + [self.FINAL_ANSWER_MARKER]) - 1
+        self.emitted = ""
+        self.start_generation()
+
+    @property
+    def has_answer(self) -> bool:
+        """是否已輸出任何 Final Answer 內容"""
+        return bool(self.emitted)
+
+    def start_generation(self):
+        """重置單次 LLM 呼叫的解析狀態"""
+        self._buffer = ""
+        self._in_answer = False
+        self._answer_started = False
+        self._done = False
+
+    def feed(self, chunk: str) -> str:
+        """
+        接收一段 token，回傳可以立即顯示給使用者的文字
+
+        Args:
+            chunk: LLM 串流輸出的片段
+
+        Returns:
+            可顯示的 Final Answer 文字（可能為空字串）
+        """
+        if self._done or not chunk:
+            return ""
+
+        self._buffer += chunk
+
+        if not self._in_answer:
+            idx = self._buffer.find(self.FINAL_ANSWER_MARKER)
+            if idx == -1:
+                # 只保留可能構成標記開頭的尾端字元
+                self._buffer = self._buffer[-self._hold:]
+                return ""
+            self._in_answer = True
+            self._buffer = self._buffer[idx + len(self.FINAL_ANSWER_MARKER):]
+
+        return self._drain(final=False)
+
+    def finish(self) -> str:
+        """LLM 呼叫結束，輸出暫存的剩餘內容"""
+        if self._done or not self._in_answer:
+            self._buffer = ""
+            return ""
+        text = self._drain(final=True)
+        self._done = True
+        return text
+
+    def _drain(self, final: bool) -> str:
+        """從暫存區取出可輸出的文字，遇到思考標記即停止"""
+        if not self._answer_started:
+            # 去除 Final Answer: 後方的空白與換行
+            self._buffer = self._buffer.lstrip()
+            if not self._buffer:
+                return ""
+            self._answer_started = True
+
+        cut = -1
+        for marker in self.STOP_MARKERS:
+            pos = self._buffer.find(marker)
+            if pos != -1 and (cut == -1 or pos < cut):
+                cut = pos
+
+        if cut != -1:
+            text = self._buffer[:cut].rstrip()
+            self._buffer = ""
+            self._done = True
+        elif final:
+            text = self._buffer.rstrip()
+            self._buffer = ""
+        else:
+            safe_length = max(len(self._buffer) - self._hold, 0)
+            text = self._buffer[:safe_length]
+            self._buffer = self._buffer[safe_length:]
+
+        self.emitted += text
+        return text
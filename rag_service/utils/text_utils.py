@@ -0,0 +1,141 @@
+"""
+文字處理工具
+問題正規化與追問判斷，供快取、路由等模組共用
+"""
+
+import re
+import unicodedata
+
+# 中英文標點與空白
+_PUNCTUATION_PATTERN = re.compile(r"[\s　-〿＀-／：-＠［-｀｛-･!-/:-@\[-`{-~]+")
+
+# 句尾語助詞（不影響問題語意）
+_TRAILING_PARTICLES = ("呢", "嗎", "啊", "呀", "喔", "哦", "吧", "啦")
+
+# 指涉前文的開頭用語，出現時代表問題依賴對話歷史
+_FOLLOWUP_PREFIXES = (
+    "那", "那麼", "還有", "另外", "所以", "然後", "而且", "它", "他", "她",
+    "這個", "那個", "這些", "那些", "這樣", "那樣", "上面", "剛剛", "剛才", "承上"
+)
+
+# 句中出現即視為追問的指代詞
+_FOLLOWUP_KEYWORDS = ("剛剛", "剛才", "上述", "前面提到", "你說的", "這項", "該政策", "同樣")
+
+# 只有疑問詞、缺少主題的短句（例如「多少錢」「什麼時候」）
+_BARE_QUESTION_WORDS = ("多少", "什麼", "何時", "哪裡", "哪些", "怎麼", "為什麼", "如何", "誰")
+
+# 依中英文句末標點切分句子（保留標點）
+_SENTENCE_PATTERN = re.compile(r"[^。！？!?\n]+[。！？!?]?")
+
+
+def normalize_question(text: str) -> str:
+    """
+    將問題正規化為比對用的鍵值
+
+    全形轉半形、轉小寫、移除標點與空白、去除句尾語助詞
+
+    Args:
+        text: 原始問題
+
+    Returns:
+        正規化後的字串
+    """
+    if not text:
+        return ""
+    normalized = unicodedata.normalize("NFKC", text).lower()
+    normalized = _PUNCTUATION_PATTERN.sub("", normalized)
+    while normalized and normalized.endswith(_TRAILING_PARTICLES):
+        normalized = normalized[:-1]
+    return normalized
+
+
+def looks_like_followup(text: str) -> bool:
+    """
+    以啟發式規則判斷訊息是否為依賴前文的追問
+
+    Args:
+        text: 使用者訊息
+
+    Returns:
+        是否可能為追問
+    """
+    normalized = normalize_question(text)
+    if not normalized:
+        return False
+    if normalized.startswith(_FOLLOWUP_PREFIXES):
+        return True
+    if any(keyword in normalized for keyword in _FOLLOWUP_KEYWORDS):
+        return True
+    # 缺少主題的短問句（例如「多少錢」「什麼時候」）要靠前文才能理解
+    return len(normalized) <= 5 and any(word in normalized for word in _BARE_QUESTION_WORDS)
+
+
+def char_bigrams(text: str) -> set:
+    """
+    取得正規化後文字的字元 bigram 集合（單字元時回傳該字元）
+
+    Args:
+        text: 原始文字
+
+    Returns:
+        bigram 集合
+    """
+    normalized = normalize_question(text)
+    if len(normalized) < 2:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + 2] for i in range(len(normalized) - 1)}
+
+
+def char_bigram_overlap(a: str, b: str) -> float:
+    """
+    以字元 bigram 的重疊係數 (|A∩B| / min(|A|, |B|)) 計算兩段文字的相近程度
+
+    適合比對「短查詢是否取自長句」，例如 Agent 從使用者問題中擷取的關鍵字
+
+    Args:
+        a: 文字 A
+        b: 文字 B
+
+    Returns:
+        0 ~ 1 的重疊係數
+    """
+    bigrams_a, bigrams_b = char_bigrams(a), char_bigrams(b)
+    if not bigrams_a or not bigrams_b:
+        return 0.0
+    return len(bigrams_a & bigrams_b) / min(len(bigrams_a), len(bigrams_b))
+
+
+def extract_key_sentences(text: str, question: str, max_chars: int = 160) -> str:
+    """
+    從段落中挑出與問題最相關的句子（依字元 bigram 重疊數排序），按原本順序組合
+
+    Args:
+        text: 段落
+        question: 使用者問題
+        max_chars: 輸出長度上限
+
+    Returns:
+        摘錄文字（沒有相關句子時取段落開頭）
+    """
+    sentences = [m.group().strip() for m in _SENTENCE_PATTERN.finditer(text)]
+    sentences = [s for s in sentences if s]
+    if not sentences:
+        return ""
+
+    question_bigrams = char_bigrams(question)
+    scored = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(char_bigrams(sentences[i]) & question_bigrams), i)
+    )
+
+    chosen, used = [], 0
+    for index in scored:
+        if used and used + len(sentences[index]) > max_chars:
+            continue
+        chosen.append(index)
+        used += len(sentences[index])
+        if used >= max_chars:
+            break
+
+    excerpt = "".join(sentences[i] for i in sorted(chosen))
+    return excerpt if len(excerpt) <= max_chars else excerpt[:max_chars] + "…"
@@ -0,0 +1,71 @@
+"""
+Token 計數工具
+以 tiktoken 估算 Prompt 長度；tiktoken 不可用（未安裝或無法下載編碼檔）時改以字元數估算
+"""
+
+import threading
+from typing import Iterable
+
+from langchain_core.messages import BaseMessage
+from loguru import logger
+
+# Gemini 沒有公開的本地 tokenizer，以 cl100k_base 近似
+TIKTOKEN_ENCODING = "cl100k_base"
+
+# 每則訊息的角色標記等額外開銷
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoder = None
+_encoder_loaded = False
+_encoder_lock = threading.Lock()
+
+
+def _get_encoder():
+    """延遲載入 tiktoken 編碼器，失敗時只記錄一次並改用字元數"""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        with _encoder_lock:
+            if not _encoder_loaded:
+                try:
+                    import tiktoken
+                    _encoder = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+                    logger.info(f"🔢 使用 tiktoken ({TIKTOKEN_ENCODING}) 計算 token")
+                except Exception as e:
+                    _encoder = None
+                    logger.warning(f"⚠️ 無法載入 tiktoken，改以字元數估算 token: {e}")
+                _encoder_loaded = True
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    """
+    估算文字的 token 數
+
+    Args:
+        text: 文字
+
+    Returns:
+        token 數（字元數估算時，中文約一字一 token）
+    """
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is None:
+        return len(text)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: Iterable[BaseMessage]) -> int:
+    """
+    估算訊息列表的 token 數
+
+    Args:
+        messages: LangChain 訊息列表
+
+    Returns:
+        token 數
+    """
+    return sum(
+        count_tokens(str(message.content)) + MESSAGE_OVERHEAD_TOKENS
+        for message in messages
+    )